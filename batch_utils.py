@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# batch_utils.py — v0.7d
+# Lote de vídeos de um mesmo levantamento (CLI --input-dir / --manifest, API /analyze_batch).
+# - list_clips(): vídeos de uma pasta (extensões VIDEO_EXTS, ordem alfabética) ou de um manifesto
+#   (texto, um caminho por linha e # comentário; ou JSON: lista de caminhos / {"input", "name"}),
+#   caminhos relativos à pasta do manifesto. Nomes de saída únicos (stem, _2, _3...).
+# - longest_first(): ordem de execução pelo custo (frames x pixels, lido do cabeçalho; tamanho
+#   do arquivo se o contêiner não informa) — o clipe mais longo começa primeiro e o lote não
+#   termina com um núcleo ocupado e os outros parados.
+# - run_batch(): CLI; `jobs` clipes ao mesmo tempo. jobs=1 roda `analyze` no próprio processo
+#   (aquecido desde o primeiro clipe); jobs>1 usa um engine_utils.EnginePool com analyze_clip().
+#   Em ambos os casos cada processo carrega o --model uma vez (scorer_utils.load_scorer guarda o
+#   último carregado).
+# - write_index(): occurrences_batch.json = ocorrências de todos os clipes (ordem dos clipes) com
+#   "clip" e "run_id"; as saídas de cada clipe ficam na pasta dele, como num run avulso.
+# - Com options["catalog"], cada clipe se registra no catálogo ao terminar e o lote liga os runs
+#   ao batch_id (run_id do lote ou nome da pasta).
+import json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+import cv2
+
+from catalog_utils import RunCatalog
+
+VIDEO_EXTS = (".mp4", ".mov", ".avi", ".mkv", ".m4v", ".mts", ".mpg", ".mpeg", ".webm")
+BATCH_NAME = "batch.json"
+INDEX_NAME = "occurrences_batch.json"
+
+def unique_names(paths:Iterable[Path])->List[str]:
+    seen: Dict[str,int] = {}; out = []
+    for p in paths:
+        base = Path(p).stem or "clip"
+        n = seen.get(base, 0) + 1; seen[base] = n
+        out.append(base if n == 1 else f"{base}_{n}")
+    return out
+
+def list_clips(input_dir:Optional[Union[str,Path]]=None, manifest:Optional[Union[str,Path]]=None)->List[Dict[str,Any]]:
+    """[{name, input}] dos vídeos do lote. Levanta IOError se a pasta/manifesto não existe ou está vazio."""
+    clips = []
+    if manifest:
+        mpath = Path(manifest).expanduser().resolve()
+        try:
+            text = mpath.read_text(encoding="utf-8")
+        except OSError as e:
+            raise IOError(f"manifesto não abriu: {e}")
+        if mpath.suffix.lower() == ".json":
+            try:
+                items = json.loads(text)
+            except ValueError as e:
+                raise IOError(f"manifesto JSON inválido: {e}")
+            items = items.get("clips", []) if isinstance(items, dict) else items
+            clips = [it if isinstance(it, dict) else {"input": it} for it in items]
+        else:
+            clips = [{"input": ln.strip()} for ln in text.splitlines() if ln.strip() and not ln.lstrip().startswith("#")]
+        for c in clips:
+            p = Path(str(c["input"])).expanduser()
+            c["input"] = str(p if p.is_absolute() else (mpath.parent / p).resolve())
+    elif input_dir:
+        d = Path(input_dir).expanduser().resolve()
+        if not d.is_dir():
+            raise IOError(f"pasta não encontrada: {d}")
+        clips = [{"input": str(p)} for p in sorted(d.iterdir()) if p.is_file() and p.suffix.lower() in VIDEO_EXTS]
+    if not clips:
+        raise IOError("nenhum vídeo no lote")
+    names = unique_names(Path(c["input"]) for c in clips)
+    for c, n in zip(clips, names):
+        c["name"] = c.get("name") or n
+    if len({c["name"] for c in clips}) != len(clips):
+        raise IOError("nomes de clipe repetidos no manifesto")
+    return clips
+
+def clip_cost(path:Union[str,Path])->float:
+    """Custo estimado da análise: frames x pixels; sem contagem no cabeçalho, bytes do arquivo."""
+    cap = cv2.VideoCapture(str(path))
+    try:
+        n = cap.get(cv2.CAP_PROP_FRAME_COUNT) if cap.isOpened() else 0
+        px = cap.get(cv2.CAP_PROP_FRAME_WIDTH) * cap.get(cv2.CAP_PROP_FRAME_HEIGHT) if cap.isOpened() else 0
+    finally:
+        cap.release()
+    if n > 0 and px > 0:
+        return float(n * px)
+    try:
+        return float(os.path.getsize(path))
+    except OSError:
+        return 0.0
+
+def longest_first(clips:List[Dict[str,Any]])->List[Dict[str,Any]]:
+    """Clipes em ordem de execução (maior custo primeiro; empate mantém a ordem do lote).
+    Preenche "cost" e "order" (posição na execução) em cada clipe."""
+    for c in clips:
+        if "cost" not in c:
+            c["cost"] = clip_cost(c["input"])
+    ordered = sorted(clips, key=lambda c: -c["cost"])
+    for i, c in enumerate(ordered):
+        c["order"] = i
+    return ordered
+
+def write_json(path:Path, data:Any):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+def write_index(out_dir:Path, clips:List[Dict[str,Any]])->int:
+    """occurrences_batch.json a partir do occurrences_v2.json de cada clipe ("out" = pasta do clipe);
+    clipes sem resultado ficam de fora. Retorna o total de ocorrências."""
+    index = []
+    for c in clips:
+        try:
+            occs = json.loads((Path(c["out"]) / "occurrences_v2.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        for o in occs:
+            index.append({"clip": c["name"], "run_id": c.get("run_id") or Path(c["out"]).name, **o})
+    write_json(Path(out_dir) / INDEX_NAME, index)
+    return len(index)
+
+def warm():
+    from veg_product_cli import warm_up
+    warm_up()
+
+def analyze_clip(input_path:str, out_dir:str, options:Dict[str,Any])->Dict[str,Any]:
+    """analyze_video() importável por nome de módulo (worker do EnginePool do lote)."""
+    from veg_product_cli import analyze_video
+    return analyze_video(input_path, out_dir, options)
+
+def run_batch(clips:List[Dict[str,Any]], out_dir:Union[str,Path], options:Dict[str,Any], jobs:int=1,
+              run_id:Optional[str]=None, analyze:Callable=analyze_clip, version:Optional[str]=None)->Dict[str,Any]:
+    """Analisa os clipes em out_dir/<nome>/ (maior primeiro, `jobs` de cada vez) e grava batch.json +
+    occurrences_batch.json. `options` = opções do analyze_video (sem input/out); o run_id de cada
+    clipe é o nome dele (prefixado por `run_id`, se dado). Um clipe com erro não interrompe o lote
+    (fica com "ok": false e "erro")."""
+    out_dir = Path(out_dir).expanduser().resolve()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    ordered = longest_first(clips)
+    jobs = max(1, min(int(jobs), len(ordered)))
+    for c in clips:
+        c["out"] = str(out_dir / c["name"])
+        c["run_id"] = f"{run_id}_{c['name']}" if run_id else c["name"]
+    pool = None
+    if jobs > 1:
+        from engine_utils import EnginePool
+        pool = EnginePool(analyze_clip, workers=jobs, max_jobs=0, init=warm)
+        run = pool.run
+    else:
+        run = analyze
+    lock = threading.Lock()
+
+    def one(c):
+        t = time.perf_counter()
+        try:
+            summary = run(c["input"], c["out"], {**options, "run_id": c["run_id"]})
+            res = {"ok": True, "occ": summary["occ"], "resumo": summary}
+        except Exception as e:  # IOError/ValueError do motor ou RuntimeError do pool
+            res = {"ok": False, "occ": 0, "erro": str(e).strip().splitlines()[0] if str(e).strip() else type(e).__name__}
+        res["wall_s"] = round(time.perf_counter() - t, 3)
+        with lock:
+            c.update(res)
+
+    try:
+        with ThreadPoolExecutor(jobs, thread_name_prefix="batch") as ex:
+            list(ex.map(one, ordered))  # threads pegam os clipes na ordem (maior primeiro)
+    finally:
+        if pool is not None:
+            pool.close()
+    n_occ = write_index(out_dir, clips)
+    if options.get("catalog"):
+        catalog = RunCatalog(options["catalog"])
+        try:
+            catalog.set_batch([c["run_id"] for c in clips if c.get("ok")], run_id or out_dir.name)
+        finally:
+            catalog.close()
+    batch = {"versao": version, "jobs": jobs, "wall_s": round(time.perf_counter() - t0, 3),
+             "clips_ok": sum(1 for c in clips if c.get("ok")), "clips": clips, "occ": n_occ, "index": INDEX_NAME}
+    write_json(out_dir / BATCH_NAME, batch)
+    return batch
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_cli.py — benchmark reprodutível do CLI com vídeo sintético (sem imagens de cliente)
+Gera um voo sintético (dossel verde, faixas de solo, manchas de baixo vigor, ruído de sensor;
+câmera deslocando `--speed` px por frame) e mede:
+- etapas: o laço do analyze_frame refeito etapa por etapa no próprio processo — decode
+  (FrameSampler: inclui os grab() dos frames pulados até o amostrado), indices (redução 2x > 1280 px + IndexEngine, como o CLI), indices_from_bgr
+  (referência antiga, fora do total), mask_morphology, region_stats, contours, thumbs
+  (ThumbWriter síncrono) e json (OccurrenceWriter.add; o close vai em json_close_ms);
+  latência por frame em ms (média, p50, p90, p95, p99, máx) e frames/s do total das etapas;
+- ponta a ponta: veg_product_cli.py num subprocesso (mais `--cli-args`), frames amostrados/s,
+  frames decodificados/s, pico de RSS do processo filho (os.wait4) e as etapas que o próprio CLI
+  mediu (timings.json, em "etapas_cli");
+- pico de RSS do processo do benchmark (etapas).
+Saída em JSON (stdout e --out). Com --baseline, compara com um JSON anterior (outro commit):
+etapa p50 ou tempo ponta a ponta piores que (1 + --tolerance) x baseline são regressões, listadas
+em "comparacao", e o código de saída é 1.
+
+Uso:
+  python bench_cli.py [--width 1920 --height 1080 --seconds 10 --fps 30 --every 15 --seed 0]
+                      [--cli-args "--tile-size 512"] [--out bench.json]
+                      [--baseline bench_main.json --tolerance 0.15]
+  python bench_cli.py --make-video voo.mp4 [--width ... --seconds ...]   # só gera o vídeo
+"""
+import argparse, json, os, platform, shlex, subprocess, sys, tempfile, time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import numpy as np
+import cv2
+
+import veg_product_cli as cli
+from video_utils import FrameSampler
+from index_utils import get_engine
+from region_utils import region_stats, contours_of
+from thumb_utils import ThumbWriter
+from candidate_utils import MIN_BOX, REGION_COLS, is_soil, make_occurrence, occurrence_id
+from output_utils import OccurrenceWriter, parse_formats
+from metrics_utils import latency, read_timings
+
+STAGES = ("decode", "indices", "indices_from_bgr", "mask_morphology", "region_stats", "contours", "thumbs", "json")
+REFERENCE_STAGES = ("indices_from_bgr",)  # medidas à parte, fora do total do pipeline
+CANOPY = (40, 140, 60)
+SOIL = (60, 90, 120)
+PATCH = (70, 110, 150)
+
+# --- vídeo sintético ---
+
+def field_canvas(h:int, w:int, seed:int=0, patches_per_frame:int=6, row_period:int=0)->np.ndarray:
+    """Faixa de campo (h x 3w) para a câmera percorrer: dossel com variação suave, faixas de solo
+    perpendiculares ao voo e manchas elípticas de baixo vigor."""
+    rng = np.random.default_rng(seed)
+    cw = 3 * w
+    low = cv2.resize(rng.normal(0, 10, (max(2, h // 64), max(2, cw // 64))).astype(np.float32), (cw, h),
+                     interpolation=cv2.INTER_CUBIC)
+    canvas = np.empty((h, cw, 3), np.float32); canvas[:] = CANOPY
+    canvas += low[..., None]
+    period = row_period or max(8, w // 6)
+    for x in range(0, cw, period):
+        canvas[:, x:x + max(1, w // 40)] = SOIL
+    for _ in range(3 * patches_per_frame):
+        cx, cy = int(rng.integers(0, cw)), int(rng.integers(0, h))
+        ax, ay = int(rng.integers(h // 30 + 2, h // 9 + 3)), int(rng.integers(h // 30 + 2, h // 9 + 3))
+        cv2.ellipse(canvas, (cx, cy), (ax, ay), float(rng.integers(0, 180)), 0, 360, PATCH, -1)
+    return np.clip(canvas, 0, 255).astype(np.uint8)
+
+def make_video(path:Path, width:int=1920, height:int=1080, seconds:float=10.0, fps:float=30.0,
+               speed:int=6, seed:int=0, codec:str="mp4v", patches_per_frame:int=6)->Dict[str,Any]:
+    """Grava o voo sintético (determinístico para os mesmos parâmetros) e retorna seus metadados."""
+    canvas = field_canvas(height, width, seed, patches_per_frame)
+    span = canvas.shape[1] - width
+    rng = np.random.default_rng(seed + 1)
+    n = max(1, int(round(seconds * fps)))
+    vw = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+    if not vw.isOpened():
+        raise IOError(f"não abriu o VideoWriter ({codec})")
+    try:
+        for i in range(n):
+            x0 = (i * speed) % span
+            noise = rng.integers(-8, 9, (height, width, 1), dtype=np.int16)
+            vw.write(np.clip(canvas[:, x0:x0 + width].astype(np.int16) + noise, 0, 255).astype(np.uint8))
+    finally:
+        vw.release()
+    return {"width": width, "height": height, "frames": n, "fps": fps, "speed_px": speed, "seed": seed,
+            "codec": codec, "patches_per_frame": patches_per_frame, "bytes": Path(path).stat().st_size}
+
+# --- medidas ---
+
+def peak_rss_mb(usage=None)->float:
+    """ru_maxrss em MB (KB no Linux, bytes no macOS)."""
+    import resource
+    usage = usage or resource.getrusage(resource.RUSAGE_SELF)
+    return round(usage.ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+def bench_stages(video:Path, work_dir:Path, every:int)->Dict[str,Any]:
+    """Etapas do analyze_frame (modo padrão do CLI: sem blocos, soil-guard ativo) cronometradas uma a uma."""
+    args = cli.options_namespace({"every": every})
+    cap = cv2.VideoCapture(str(video))
+    if not cap.isOpened():
+        raise IOError("não abriu vídeo")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    sampler = FrameSampler(cap, every=args.every, strategy=args.sampling, fps=fps)
+    engine = get_engine(args.index_precision)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    (work_dir / "thumbs").mkdir(parents=True, exist_ok=True)
+    thumbs = ThumbWriter(work_dir / "thumbs", fmt=args.thumb_format, quality=args.thumb_quality,
+                         max_edge=args.thumb_max_edge, overlay=args.overlay, threads=0)
+    writer = OccurrenceWriter(work_dir, parse_formats(args.output_format))
+    times = {s: [] for s in STAGES}
+    n_frames = n_soil = 0
+    it = iter(sampler)
+    try:
+        while True:
+            t = time.perf_counter()
+            item = next(it, None)
+            if item is None:
+                break
+            times["decode"].append(time.perf_counter() - t)
+            idx, frame = item
+            n_frames += 1
+            H, W = frame.shape[:2]
+
+            t = time.perf_counter()
+            work = cv2.resize(frame, (W // 2, H // 2)) if max(W, H) > 1280 else frame
+            vari, ngrdi, ifv, agree = engine.compute(work, args.agree_k)
+            mF, mN = float(ifv.mean()), float(ngrdi.mean())
+            times["indices"].append(time.perf_counter() - t)
+            sx = W / work.shape[1]; sy = H / work.shape[0]
+
+            t = time.perf_counter()
+            cli.indices_from_bgr(work)
+            times["indices_from_bgr"].append(time.perf_counter() - t)
+
+            if is_soil(mF, mN):
+                n_soil += 1
+                t = time.perf_counter()
+                thumbs.submit(idx, frame, [], has_occ=False)
+                times["thumbs"].append(time.perf_counter() - t)
+                continue
+
+            t = time.perf_counter()
+            mask = cv2.morphologyEx(agree, cv2.MORPH_OPEN, kernel, iterations=1)
+            times["mask_morphology"].append(time.perf_counter() - t)
+
+            t = time.perf_counter()
+            rs = region_stats(mask, vari, ngrdi, ifv, exact=args.exact_means)
+            times["region_stats"].append(time.perf_counter() - t)
+
+            t = time.perf_counter()
+            keep = (rs["area"] >= args.min_area) & (rs["w"]*rs["h"] >= MIN_BOX) & (rs["severity"] >= args.min_severity)
+            cnts = [(c.astype(np.float32) * [sx, sy]).astype(np.int32) for c in contours_of(rs["labels"], keep)]
+            times["contours"].append(time.perf_counter() - t)
+
+            t = time.perf_counter()
+            thumbs.submit(idx, frame, cnts, has_occ=bool(cnts))
+            times["thumbs"].append(time.perf_counter() - t)
+
+            t = time.perf_counter()
+            writer.add([make_occurrence(idx, fps, {c: rs[c][i] for c in REGION_COLS}, sx, sy,
+                                        occurrence_id("bench", idx, args.agree_k, i)) for i in np.flatnonzero(keep)])
+            times["json"].append(time.perf_counter() - t)
+    finally:
+        cap.release()
+    thumbs.close()
+    t = time.perf_counter()
+    writer.close()
+    close_ms = (time.perf_counter() - t) * 1000.0
+    total = sum(sum(v) for s, v in times.items() if s not in REFERENCE_STAGES) + close_ms / 1000.0
+    return {"frames": n_frames, "frames_solo": n_soil, "occ": writer.count,
+            "fps": round(n_frames / total, 2) if total else None, "total_s": round(total, 3),
+            "json_close_ms": round(close_ms, 3),
+            "etapas": {s: latency(v) for s, v in times.items()}, "referencia_fora_do_total": list(REFERENCE_STAGES)}
+
+def bench_end_to_end(video:Path, work_dir:Path, every:int, cli_args:List[str], n_video_frames:int)->Dict[str,Any]:
+    """veg_product_cli.py num subprocesso: tempo de parede e pico de RSS do filho."""
+    out = work_dir / "run"
+    cmd = [sys.executable, str(Path(cli.__file__).resolve()), "--input", str(video), "--out", str(out),
+           "--every", str(every)] + cli_args
+    t = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    _pid, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - t
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    err = proc.stderr.read().decode("utf-8", "replace")[-2000:]; proc.stderr.close()
+    if proc.returncode != 0:
+        raise RuntimeError(f"CLI saiu com {proc.returncode}: {err}")
+    resumo = dict(line.split("=", 1) for line in (out / "resumo.txt").read_text(encoding="utf-8").splitlines() if "=" in line)
+    sampled = int(resumo.get("frames_amostrados", 0))
+    timings = read_timings(out) or {}  # etapas medidas pelo próprio CLI (timings.json)
+    return {"cmd_args": ["--every", str(every)] + cli_args, "wall_s": round(wall, 3),
+            "frames_amostrados": sampled, "occ": int(resumo.get("occ", 0)),
+            "fps": round(sampled / wall, 2), "fps_video": round(n_video_frames / wall, 2),
+            "peak_rss_mb": peak_rss_mb(usage), "etapas_cli": timings.get("etapas", {})}
+
+def environment()->Dict[str,Any]:
+    here = Path(__file__).resolve().parent
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"commit": commit, "cli_version": cli.CLI_VERSION, "python": platform.python_version(),
+            "numpy": np.__version__, "opencv": cv2.__version__, "cpus": os.cpu_count(), "machine": platform.machine()}
+
+def compare(cur:Dict[str,Any], base:Dict[str,Any], tolerance:float)->Dict[str,Any]:
+    """Razões atual/baseline (p50 por etapa e tempo ponta a ponta); > 1 + tolerance = regressão."""
+    ratios = {}
+    for s, st in cur.get("etapas", {}).get("etapas", {}).items():
+        b = base.get("etapas", {}).get("etapas", {}).get(s, {})
+        if st.get("p50_ms") and b.get("p50_ms"):
+            ratios[f"etapa.{s}.p50"] = round(st["p50_ms"] / b["p50_ms"], 3)
+    ce, be = cur.get("ponta_a_ponta"), base.get("ponta_a_ponta")
+    if ce and be and be.get("wall_s"):
+        ratios["ponta_a_ponta.wall"] = round(ce["wall_s"] / be["wall_s"], 3)
+    if ce and be and ce.get("peak_rss_mb") and be.get("peak_rss_mb"):
+        ratios["ponta_a_ponta.peak_rss"] = round(ce["peak_rss_mb"] / be["peak_rss_mb"], 3)
+    regress = sorted(k for k, r in ratios.items() if r > 1.0 + tolerance)
+    return {"baseline_commit": base.get("ambiente", {}).get("commit"), "tolerancia": tolerance,
+            "razoes": ratios, "regressoes": regress}
+
+def main(argv:Optional[list]=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--width", type=int, default=1920)
+    ap.add_argument("--height", type=int, default=1080)
+    ap.add_argument("--seconds", type=float, default=10.0)
+    ap.add_argument("--fps", type=float, default=30.0)
+    ap.add_argument("--speed", type=int, default=6, help="deslocamento da câmera (px por frame)")
+    ap.add_argument("--patches", type=int, default=6, help="manchas de baixo vigor por largura de frame")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--codec", default="mp4v", help="FOURCC do vídeo sintético (mp4v, MJPG...)")
+    ap.add_argument("--every", type=int, default=15)
+    ap.add_argument("--cli-args","--cli_args", dest="cli_args", default="", help="flags extras do CLI na medida ponta a ponta")
+    ap.add_argument("--skip-stages", action="store_true", help="só a medida ponta a ponta")
+    ap.add_argument("--skip-e2e", action="store_true", help="só as etapas")
+    ap.add_argument("--make-video", default=None, help="só gera o vídeo sintético neste caminho e sai")
+    ap.add_argument("--out", default=None, help="grava o JSON também neste arquivo")
+    ap.add_argument("--baseline", default=None, help="JSON de uma execução anterior para comparar")
+    ap.add_argument("--tolerance", type=float, default=0.15, help="piora relativa tolerada antes de acusar regressão")
+    args = ap.parse_args(argv)
+
+    gen = dict(width=args.width, height=args.height, seconds=args.seconds, fps=args.fps, speed=args.speed,
+               seed=args.seed, codec=args.codec, patches_per_frame=args.patches)
+    if args.make_video:
+        print(json.dumps(make_video(Path(args.make_video), **gen), ensure_ascii=False, indent=2))
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix="bench_cli_") as tmp:
+        tmp = Path(tmp)
+        ext = ".avi" if args.codec.upper() == "MJPG" else ".mp4"
+        video = tmp / f"synth{ext}"
+        t = time.perf_counter()
+        meta = make_video(video, **gen)
+        meta["gerado_em_s"] = round(time.perf_counter() - t, 2)
+        out = {"ambiente": environment(), "video": meta, "every": args.every}
+        if not args.skip_stages:
+            out["etapas"] = bench_stages(video, tmp / "stages", args.every)
+            out["peak_rss_mb_etapas"] = peak_rss_mb()
+        if not args.skip_e2e:
+            out["ponta_a_ponta"] = bench_end_to_end(video, tmp, args.every, shlex.split(args.cli_args), meta["frames"])
+    code = 0
+    if args.baseline:
+        out["comparacao"] = compare(out, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.tolerance)
+        code = 1 if out["comparacao"]["regressoes"] else 0
+    text = json.dumps(out, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    print(text)
+    return code
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_indices.py — micro-benchmark de índices + consenso
+Compara indices_from_bgr (+ três máscaras booleanas e soma uint8, como no CLI v0.7c2)
+com index_utils.IndexEngine em cada precisão: tempo por frame (mediana/p95) e pico de
+memória alocada por frame (tracemalloc; NumPy/OpenCV registram suas alocações).
+
+Uso:
+  python bench_indices.py [--width 1920 --height 1080 --frames 30 --agree-k 2]
+"""
+import argparse, json, sys, time, tracemalloc
+import numpy as np
+
+from veg_product_cli import indices_from_bgr
+from index_utils import IndexEngine, PRECISIONS
+
+def synthetic_frame(h:int, w:int, seed:int=0)->np.ndarray:
+    """Dossel verde com faixas de solo e manchas de baixo vigor + ruído."""
+    rng = np.random.default_rng(seed)
+    f = np.empty((h, w, 3), np.uint8); f[:] = (40, 140, 60)
+    for x in range(0, w, max(1, w//6)):
+        f[:, x:x+max(1, w//40)] = (60, 90, 120)
+    yy, xx = np.mgrid[0:h, 0:w]
+    for _ in range(12):
+        cx, cy, rad = rng.integers(0, w), rng.integers(0, h), rng.integers(h//30+1, h//8+2)
+        f[(xx-cx)**2 + (yy-cy)**2 < rad*rad] = (70, 110, 150)
+    return np.clip(f.astype(np.int16) + rng.integers(-12, 12, f.shape), 0, 255).astype(np.uint8)
+
+def legacy(frame:np.ndarray, agree_k:int):
+    vari, ngrdi, ifv = indices_from_bgr(frame)
+    m1 = vari < 0.02; m2 = ngrdi < 0.02; m3 = ifv < 0.30
+    agree = (m1.astype(np.uint8)+m2.astype(np.uint8)+m3.astype(np.uint8)) >= agree_k
+    return vari, ngrdi, ifv, agree.astype(np.uint8)*255
+
+def measure(fn, frames, agree_k:int):
+    fn(frames[0], agree_k)  # aquecimento (buffers/LUT alocados fora da medição)
+    times = []; peak = 0
+    for f in frames:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        fn(f, agree_k)
+        times.append(time.perf_counter() - t0)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    ms = np.array(times) * 1000.0
+    return {"ms_p50": round(float(np.percentile(ms, 50)), 3), "ms_p95": round(float(np.percentile(ms, 95)), 3),
+            "peak_alloc_mb": round(peak / 2**20, 2)}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--width", type=int, default=1920)
+    ap.add_argument("--height", type=int, default=1080)
+    ap.add_argument("--frames", type=int, default=30)
+    ap.add_argument("--agree-k","--agree_k", dest="agree_k", type=int, default=2, choices=[2,3])
+    args = ap.parse_args()
+
+    frames = [synthetic_frame(args.height, args.width, seed=i) for i in range(min(args.frames, 4))]
+    frames = [frames[i % len(frames)] for i in range(args.frames)]
+    ref = legacy(frames[0], args.agree_k)
+
+    out = {"resolucao": f"{args.width}x{args.height}", "frames": args.frames, "agree_k": args.agree_k,
+           "indices_from_bgr": measure(legacy, frames, args.agree_k)}
+    for p in PRECISIONS:
+        eng = IndexEngine(p)
+        res = measure(eng.compute, frames, args.agree_k)
+        got = eng.compute(frames[0], args.agree_k)
+        res["mask_diff_frac"] = round(float((got[3] != ref[3]).mean()), 6)
+        res["max_abs_err"] = round(float(max(np.nanmax(np.abs(got[i].astype(np.float32) - ref[i])) for i in range(3))), 6)
+        out[f"engine_{p}"] = res
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
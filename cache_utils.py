@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# cache_utils.py — v0.7d
+# Cache de resultados endereçado por conteúdo: chave = sha256(vídeo) + opções normalizadas
+# do CLI + versão do CLI (+ versão do modelo aplicado). Uma nova análise com a mesma chave
+# devolve o run existente na hora. Também faz a evicção LRU/por tamanho dos runs antigos.
+#
+# Índice em runs/_cache/index.json: {chave: {"run_id", "created", "last_hit", "bytes"}}
+import hashlib, json, os, shutil, threading, time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+# Arquivos preservados quando um run com rótulos é "evictado": o treino precisa deles
+KEEP_ON_EVICT = ("labels.csv", "occurrences_v2.json", "occurrences.json", "input.json")
+
+def make_key(video_sha256:str, options:Dict[str,Any], version:str, extra:Optional[Dict[str,Any]]=None)->str:
+    blob = json.dumps({"video": video_sha256, "options": options, "version": version, "extra": extra or {}},
+                      sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def dir_size(path:Path)->int:
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for f in files:
+            try: total += os.path.getsize(os.path.join(root, f))
+            except OSError: pass
+    return total
+
+class RunCache:
+    def __init__(self, runs_dir:Path):
+        self.runs_dir = Path(runs_dir)
+        self.dir = self.runs_dir / "_cache"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.dir / "index.json"
+        self._lock = threading.Lock()
+        self._index = self._load()
+
+    def _load(self)->Dict[str,Dict[str,Any]]:
+        try:
+            return json.loads(self.index_path.read_text(encoding="utf-8"))
+        except Exception:
+            return {}
+
+    def _save(self):
+        tmp = self.index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._index), encoding="utf-8")
+        os.replace(tmp, self.index_path)
+
+    def lookup(self, key:str)->Optional[str]:
+        """run_id com resultado válido para a chave (e marca o acesso), ou None."""
+        with self._lock:
+            ent = self._index.get(key)
+            if not ent:
+                return None
+            out_dir = self.runs_dir / ent["run_id"]
+            if not (out_dir/"occurrences_v2.json").exists() or not (out_dir/"thumbs").exists():
+                self._index.pop(key, None); self._save()
+                return None
+            ent["last_hit"] = time.time()
+            self._save()
+            return ent["run_id"]
+
+    def store(self, key:str, run_id:str):
+        with self._lock:
+            now = time.time()
+            self._index[key] = {"run_id": run_id, "created": now, "last_hit": now,
+                                "bytes": dir_size(self.runs_dir / run_id)}
+            self._save()
+
+    def forget(self, run_id:str):
+        """Remove as chaves que apontam para run_id (ex.: resultado refiltrado com outros limiares)."""
+        with self._lock:
+            n = len(self._index)
+            self._index = {k: v for k, v in self._index.items() if v["run_id"] != run_id}
+            if len(self._index) != n:
+                self._save()
+
+    def _last_used(self)->Dict[str,float]:
+        used = {}
+        for ent in self._index.values():
+            used[ent["run_id"]] = max(used.get(ent["run_id"], 0.0), ent["last_hit"])
+        return used
+
+    def evict(self, max_bytes:int=0, max_runs:int=0, protect:Iterable[str]=())->List[str]:
+        """Remove runs menos usados até caber em max_bytes / max_runs (0 = sem limite).
+        Runs com labels.csv perdem só os artefatos pesados (KEEP_ON_EVICT fica)."""
+        if not max_bytes and not max_runs:
+            return []
+        protect = set(protect)
+        with self._lock:
+            used = self._last_used()
+            runs = []; kept_bytes = kept_runs = 0
+            for d in self.runs_dir.iterdir():
+                if not d.is_dir() or d.name.startswith("_"):
+                    continue
+                if d.name in protect:
+                    kept_bytes += dir_size(d); kept_runs += 1  # conta no limite, mas não sai
+                    continue
+                if not (d/"occurrences_v2.json").exists():
+                    continue  # ainda rodando/sem resultado: nunca evictar
+                if (d/"labels.csv").exists() and not (d/"thumbs").exists():
+                    continue  # já reduzido aos arquivos de treino
+                runs.append((used.get(d.name, d.stat().st_mtime), d, dir_size(d)))
+            runs.sort(key=lambda r: r[0])  # LRU primeiro
+            total = kept_bytes + sum(r[2] for r in runs); count = kept_runs + len(runs)
+            removed = []
+            for _t, d, size in runs:
+                if (not max_bytes or total <= max_bytes) and (not max_runs or count <= max_runs):
+                    break
+                if (d/"labels.csv").exists():
+                    for p in d.iterdir():
+                        if p.name in KEEP_ON_EVICT: continue
+                        shutil.rmtree(p, ignore_errors=True) if p.is_dir() else p.unlink(missing_ok=True)
+                    total -= size - dir_size(d)
+                else:
+                    shutil.rmtree(d, ignore_errors=True)
+                    total -= size
+                count -= 1
+                removed.append(d.name)
+            if removed:
+                gone = set(removed)
+                self._index = {k: v for k, v in self._index.items() if v["run_id"] not in gone}
+                self._save()
+            return removed
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# candidate_utils.py — v0.7d
+# Armazém de candidatos por run (runs/<id>/candidates.npz): todas as manchas antes do
+# filtro do CLI (bbox, área, médias dos índices, severidade) para agree_k=2 e 3, mais as
+# médias de IFV/NGRDI de cada frame usadas pelo soil-guard. apply_thresholds() refaz o
+# filtro de min_area / agree_k / min_severity / soil_guard sobre essas colunas em
+# milissegundos, sem decodificar o vídeo de novo (API POST /rethreshold/<run_id>).
+#
+# Colunas (uma linha por mancha): frame, k, region, x, y, w, h, area, vari, ngrdi, ifv, severity
+# (bbox/área na escala da imagem analisada; sx/sy por frame levam à escala original).
+#
+# Por frame também o deslocamento (frame_dx, frame_dy) em relação ao frame amostrado anterior
+# (track_utils.estimate_shift): com params["track"] (CLI --track) o refiltro refaz as trilhas.
+# frame_src: frame cujo resultado vale para o frame (ele mesmo, ou o frame fonte de um frame
+# parado com --skip-static — as ocorrências saem com "reused_from", como no CLI).
+#
+# occ_id estável de cada ocorrência: "<run_id>:<frame>:<agree_k>:<região>", com região = índice
+# da mancha na rotulação do frame para aquele agree_k (o mesmo no CLI e no refiltro).
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+from track_utils import IOU_MIN, MAX_GAP, track_occurrences
+
+AGREE_KS = (2, 3)
+# Soil-guard: frame majoritariamente solo se IFV médio < 0.28 e NGRDI médio < 0.02
+SOIL_IFV = 0.28
+SOIL_NGRDI = 0.02
+# bbox mínima (w*h) — filtro fixo do CLI, aplicado já na gravação
+MIN_BOX = 25
+REGION_COLS = ("x", "y", "w", "h", "area", "vari", "ngrdi", "ifv", "severity")
+_INT_COLS = ("x", "y", "w", "h", "area")
+
+def is_soil(ifv_mean, ngrdi_mean):
+    return (ifv_mean < SOIL_IFV) & (ngrdi_mean < SOIL_NGRDI)
+
+def occurrence_id(run_id:str, frame:int, agree_k:int, region:int)->str:
+    return f"{run_id}:{int(frame)}:{int(agree_k)}:{int(region)}"
+
+def make_occurrence(frame:int, fps:float, row:Dict[str,Any], sx:float, sy:float, occ_id:Optional[str]=None)->Dict[str,Any]:
+    """Ocorrência no formato de occurrences_v2.json a partir de uma linha de region_stats."""
+    x, y, w, h = (int(row[c]) for c in ("x", "y", "w", "h"))
+    mV = float(row["vari"]); mN = float(row["ngrdi"]); mF = float(row["ifv"]); sev = float(row["severity"])
+    occ = {"occ_id": occ_id} if occ_id else {}
+    return {
+        **occ,
+        "frame": frame, "time_s": round(frame/float(fps), 3),
+        "bbox": [int(x*sx), int(y*sy), int(w*sx), int(h*sy)],
+        "area_px": int(row["area"]*sx*sy),
+        "type": "baixo_sinal",
+        "confidence": 80 if sev < 1.3 else 92,
+        "recommendation": "Atenção moderada: monitorar; checar irrigação/manejo." if sev < 1.3 else "Prioridade alta: vistoriar imediatamente; verificar irrigação/solo/pragas.",
+        "evidence": {"vari": round(mV,3), "ngrdi": round(mN,3), "ifv": round(mF,3), "severity": round(sev,2)}
+    }
+
+def frame_candidates(by_k:Dict[int,Dict[str,np.ndarray]], ifv_mean:float, ngrdi_mean:float,
+                     sx:float, sy:float)->Dict[str,Any]:
+    """Resumo compacto de um frame: {k: colunas das manchas com w*h >= MIN_BOX} + stats do frame."""
+    regions = {}
+    for k, rs in by_k.items():
+        sel = rs["w"]*rs["h"] >= MIN_BOX
+        regions[k] = {c: rs[c][sel] for c in REGION_COLS}
+        regions[k]["region"] = np.flatnonzero(sel)
+    return {"regions": regions, "ifv_mean": float(ifv_mean), "ngrdi_mean": float(ngrdi_mean),
+            "sx": float(sx), "sy": float(sy)}
+
+class CandidateStore:
+    """Acumula os candidatos dos frames (em ordem) e grava candidates.npz."""
+    def __init__(self, fps:float, params:Dict[str,Any]):
+        self.fps = float(fps); self.params = dict(params)
+        self.frames: List[tuple] = []
+        self.cols: Dict[str, List[np.ndarray]] = {c: [] for c in ("frame", "k", "region") + REGION_COLS}
+
+    def add(self, idx:int, cand:Dict[str,Any], shift:Tuple[float,float]=(0.0, 0.0), src:Optional[int]=None):
+        self.frames.append((idx, cand["ifv_mean"], cand["ngrdi_mean"], cand["sx"], cand["sy"], shift[0], shift[1],
+                            idx if src is None else src))
+        for k in sorted(cand["regions"]):
+            reg = cand["regions"][k]; n = len(reg["area"])
+            self.cols["frame"].append(np.full(n, idx, np.int64)); self.cols["k"].append(np.full(n, k, np.uint8))
+            for c in ("region",) + REGION_COLS:
+                self.cols[c].append(reg[c])
+
+    def save(self, path:Path):
+        arrays = {}
+        for c, parts in self.cols.items():
+            dt = np.int64 if c == "frame" else np.uint8 if c == "k" else np.int32 if c in _INT_COLS + ("region",) else np.float64
+            arrays[c] = np.concatenate(parts).astype(dt, copy=False) if parts else np.zeros(0, dt)
+        fr = np.array(self.frames, np.float64).reshape(-1, 8)
+        arrays.update({"frame_idx": fr[:, 0].astype(np.int64), "frame_ifv": fr[:, 1], "frame_ngrdi": fr[:, 2],
+                       "frame_sx": fr[:, 3], "frame_sy": fr[:, 4], "frame_dx": fr[:, 5], "frame_dy": fr[:, 6],
+                       "frame_src": fr[:, 7].astype(np.int64)})
+        arrays["meta"] = np.array(json.dumps({"fps": self.fps, "params": self.params}))
+        # np.savez acrescenta ".npz" a nomes sem a extensão: grava via handle e renomeia
+        tmp = path.with_name(path.name + ".tmp")
+        with tmp.open("wb") as f:
+            np.savez_compressed(f, **arrays)
+        tmp.replace(path)
+
+def load_candidates(path:Path)->Dict[str,Any]:
+    with np.load(path, allow_pickle=False) as z:
+        data = {k: z[k] for k in z.files}
+    meta = json.loads(str(data.pop("meta")))
+    data["fps"] = meta["fps"]; data["params"] = meta["params"]
+    return data
+
+def apply_thresholds(cands:Dict[str,Any], min_area:Optional[int]=None, agree_k:Optional[int]=None,
+                     min_severity:Optional[float]=None, soil_guard:Optional[bool]=None,
+                     track:Optional[bool]=None)->List[Dict[str,Any]]:
+    """Filtro do CLI sobre o armazém; parâmetros None usam os valores da execução original.
+    Retorna as ocorrências na mesma ordem (e com os mesmos valores) que o CLI produziria.
+    track=True/False liga/desliga o agrupamento em trilhas (parâmetros do run ou os padrões)."""
+    p = cands["params"]
+    min_area = p["min_area"] if min_area is None else int(min_area)
+    agree_k = p["agree_k"] if agree_k is None else int(agree_k)
+    min_severity = p["min_severity"] if min_severity is None else float(min_severity)
+    soil_guard = p["soil_guard"] if soil_guard is None else bool(soil_guard)
+    if agree_k not in AGREE_KS:
+        raise ValueError(f"agree_k inválido: {agree_k}")
+    keep = (cands["k"] == agree_k) & (cands["area"] >= min_area) & (cands["severity"] >= min_severity)
+    fidx = cands["frame_idx"]
+    if soil_guard:
+        soil = fidx[is_soil(cands["frame_ifv"], cands["frame_ngrdi"])]
+        keep &= ~np.isin(cands["frame"], soil)
+    pos = {int(f): i for i, f in enumerate(fidx)}
+    fps = cands["fps"]; run_id = p.get("run_id"); occs = []
+    src = cands.get("frame_src")
+    for i in np.flatnonzero(keep):
+        frame = int(cands["frame"][i]); j = pos[frame]
+        occ_id = occurrence_id(run_id, frame, agree_k, cands["region"][i]) if run_id and "region" in cands else None
+        occ = make_occurrence(frame, fps, {c: cands[c][i] for c in REGION_COLS},
+                              cands["frame_sx"][j], cands["frame_sy"][j], occ_id)
+        if src is not None and int(src[j]) != frame:
+            occ["reused_from"] = int(src[j])
+        occs.append(occ)
+    tp = p.get("track") if track is None else ((p.get("track") or {}) if track else None)
+    if tp is not None:
+        shifts = np.column_stack([cands["frame_dx"], cands["frame_dy"]]) if "frame_dx" in cands else None
+        occs = track_occurrences(occs, fidx, shifts, tp.get("iou_min", IOU_MIN), tp.get("max_gap", MAX_GAP))
+    return occs
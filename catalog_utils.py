@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+# catalog_utils.py — v0.7d
+# Catálogo de runs em SQLite (runs/_catalog/catalog.sqlite; CLI --catalog): consultas multi-run
+# sem varrer runs/ nem reler JSON de cada pasta.
+# - runs: um registro por run (estado, origem api|cli, lote, vídeo/sha256, versão, modelo, contagens,
+#   wall_s) + options (flags efetivas, nome -> valor JSON) + timings (etapas do timings.json).
+# - occurrences: uma linha por ocorrência (frame, time_s, tipo, severidade, confiança, área, bbox,
+#   ml.score e o JSON completo) com índice R-tree 3D (bbox em pixels do frame x time_s) para busca
+#   por região/intervalo e B-tree por run/tempo/tipo.
+# - labels: último rótulo de cada ocorrência (/train), para filtrar rotuladas/não rotuladas.
+# Cada index_run() substitui o run inteiro numa transação (leitores nunca veem um run pela metade);
+# WAL + busy_timeout deixam a API e processos do CLI (lotes com --batch-jobs) gravarem o mesmo
+# arquivo. Listagens paginam por cursor (chave da última linha), não por OFFSET: o custo de uma
+# página não cresce com o número de runs.
+import csv, json, sqlite3, threading, time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from model_utils import label_value, occurrence_key
+
+CATALOG_NAME = "catalog.sqlite"
+PAGE_MAX = 500
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY, created REAL NOT NULL, updated REAL NOT NULL, state TEXT NOT NULL,
+    source TEXT, batch_id TEXT, input_name TEXT, input_sha256 TEXT, input_bytes INTEGER, cli_version TEXT,
+    model TEXT, n_occ INTEGER, frames_sampled INTEGER, frames_analyzed INTEGER, wall_s REAL,
+    evicted INTEGER NOT NULL DEFAULT 0, out_dir TEXT);
+CREATE INDEX IF NOT EXISTS runs_created ON runs(created, run_id);
+CREATE INDEX IF NOT EXISTS runs_state ON runs(state, created, run_id);
+CREATE INDEX IF NOT EXISTS runs_batch ON runs(batch_id, created, run_id);
+CREATE INDEX IF NOT EXISTS runs_sha ON runs(input_sha256);
+CREATE TABLE IF NOT EXISTS options (
+    run_id TEXT NOT NULL, name TEXT NOT NULL, value TEXT, PRIMARY KEY (run_id, name)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS options_value ON options(name, value, run_id);
+CREATE TABLE IF NOT EXISTS timings (
+    run_id TEXT NOT NULL, stage TEXT NOT NULL, n INTEGER, mean_ms REAL, p50_ms REAL, p95_ms REAL,
+    max_ms REAL, total_s REAL, PRIMARY KEY (run_id, stage)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS occurrences (
+    id INTEGER PRIMARY KEY, run_id TEXT NOT NULL, occ_id TEXT NOT NULL, pos INTEGER NOT NULL,
+    frame INTEGER, time_s REAL, type TEXT, severity REAL, confidence REAL, area_px REAL,
+    x0 REAL, y0 REAL, x1 REAL, y1 REAL, score REAL, data TEXT);
+CREATE INDEX IF NOT EXISTS occurrences_run ON occurrences(run_id, time_s);
+CREATE INDEX IF NOT EXISTS occurrences_occ ON occurrences(occ_id);
+CREATE INDEX IF NOT EXISTS occurrences_type ON occurrences(type, severity);
+CREATE VIRTUAL TABLE IF NOT EXISTS occ_rtree USING rtree(id, x0, x1, y0, y1, t0, t1);
+CREATE TABLE IF NOT EXISTS labels (
+    run_id TEXT NOT NULL, occ_id TEXT NOT NULL, frame INTEGER, y INTEGER NOT NULL, label TEXT, ts REAL,
+    PRIMARY KEY (run_id, occ_id)) WITHOUT ROWID;
+"""
+_RUN_COLS = ("run_id", "created", "updated", "state", "source", "batch_id", "input_name", "input_sha256", "input_bytes",
+             "cli_version", "model", "n_occ", "frames_sampled", "frames_analyzed", "wall_s", "evicted", "out_dir")
+_OCC_COLS = ("id", "run_id", "occ_id", "frame", "time_s", "type", "severity", "confidence", "area_px", "score", "data")
+
+def read_resumo(run_dir:Path)->Dict[str,str]:
+    try:
+        lines = (Path(run_dir) / "resumo.txt").read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return {}
+    return dict(ln.split("=", 1) for ln in lines if "=" in ln)
+
+def _json(path:Path)->Any:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+def _int(v)->Optional[int]:
+    try:
+        return int(float(v))
+    except (TypeError, ValueError):
+        return None
+
+def _occ_row(run_id:str, o:Dict[str,Any], i:int)->Tuple:
+    ev = o.get("evidence") or {}
+    bbox = o.get("bbox") or [0, 0, 0, 0]
+    x, y, w, h = (float(v) for v in (list(bbox) + [0, 0, 0, 0])[:4])
+    score = (o.get("ml") or {}).get("score") if isinstance(o.get("ml"), dict) else None
+    return (run_id, occurrence_key(run_id, o, i), i, int(o.get("frame", o.get("idx", i))), o.get("time_s"),
+            o.get("type"), ev.get("severity"), o.get("confidence"), o.get("area_px"), x, y, x + w, y + h, score,
+            json.dumps(o, ensure_ascii=False))
+
+def encode_cursor(*keys)->str:
+    return json.dumps(list(keys), separators=(",", ":"))
+
+def decode_cursor(cursor:Optional[str])->Optional[list]:
+    """Cursor de paginação (chave da última linha da página anterior); ValueError se inválido."""
+    if not cursor:
+        return None
+    keys = json.loads(cursor)
+    if not isinstance(keys, list):
+        raise ValueError("cursor inválido")
+    return keys
+
+class RunCatalog:
+    """Catálogo SQLite de runs/ocorrências/rótulos. Uma conexão por objeto, serializada por lock."""
+    def __init__(self, path:Path, timeout_s:float=30.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), timeout=timeout_s, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # --- gravação ---
+
+    def _upsert_run(self, run_id:str, fields:Dict[str,Any]):
+        now = time.time()
+        fields = {k: v for k, v in fields.items() if k in _RUN_COLS and k != "run_id"}
+        row = self._db.execute("SELECT 1 FROM runs WHERE run_id=?", (run_id,)).fetchone()
+        if row is None:
+            fields.setdefault("created", now); fields.setdefault("state", "done")
+            cols = ["run_id", "updated"] + list(fields)
+            self._db.execute(f"INSERT INTO runs ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                             [run_id, now] + list(fields.values()))
+        else:
+            fields.pop("created", None)
+            sets = ", ".join(f"{k}=?" for k in ["updated"] + list(fields))
+            self._db.execute(f"UPDATE runs SET {sets} WHERE run_id=?", [now] + list(fields.values()) + [run_id])
+
+    def _set_options(self, run_id:str, options:Dict[str,Any]):
+        self._db.execute("DELETE FROM options WHERE run_id=?", (run_id,))
+        self._db.executemany("INSERT INTO options VALUES (?,?,?)",
+                             [(run_id, k, json.dumps(v, ensure_ascii=False, sort_keys=True)) for k, v in sorted(options.items())])
+
+    def _set_occurrences(self, run_id:str, occs:Sequence[Dict[str,Any]]):
+        self._db.execute("DELETE FROM occ_rtree WHERE id IN (SELECT id FROM occurrences WHERE run_id=?)", (run_id,))
+        self._db.execute("DELETE FROM occurrences WHERE run_id=?", (run_id,))
+        self._db.executemany("INSERT INTO occurrences (run_id, occ_id, pos, frame, time_s, type, severity, confidence, "
+                             "area_px, x0, y0, x1, y1, score, data) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                             [_occ_row(run_id, o, i) for i, o in enumerate(occs)])
+        self._db.execute("INSERT INTO occ_rtree SELECT id, x0, x1, y0, y1, COALESCE(time_s, 0), COALESCE(time_s, 0) "
+                         "FROM occurrences WHERE run_id=?", (run_id,))
+
+    def register(self, run_id:str, state:str="queued", **fields):
+        """Cria/atualiza só o registro do run (ex.: job enfileirado, erro)."""
+        with self._lock, self._db:
+            self._upsert_run(run_id, {"state": state, **fields})
+
+    def index_run(self, run_dir:Path, options:Optional[Dict[str,Any]]=None, state:str="done",
+                  occs:Optional[Sequence[Dict[str,Any]]]=None, **fields)->bool:
+        """(Re)grava o run a partir da pasta (resumo.txt, timings.json, input.json, occurrences_v2.json)
+        numa transação: registro, opções (se dadas), etapas e ocorrências. False se não há ocorrências."""
+        run_dir = Path(run_dir)
+        run_id = fields.pop("run_id", None) or run_dir.name
+        if occs is None:
+            occs = _json(run_dir / "occurrences_v2.json")
+            if occs is None:
+                occs = _json(run_dir / "occurrences.json")
+        if occs is None:
+            return False
+        resumo = read_resumo(run_dir)
+        timings = _json(run_dir / "timings.json") or {}
+        info = _json(run_dir / "input.json") or {}
+        frames = timings.get("frames") or {}
+        rec = {"state": state, "out_dir": str(run_dir.resolve()), "n_occ": len(occs),
+               "cli_version": resumo.get("versao") or timings.get("versao"), "model": resumo.get("modelo"),
+               "frames_sampled": _int(resumo.get("frames_amostrados", frames.get("amostrados"))),
+               "frames_analyzed": _int(resumo.get("frames_analisados", frames.get("analisados"))),
+               "wall_s": timings.get("wall_s"), "evicted": 0}
+        if info:
+            rec.update(input_name=info.get("filename"), input_sha256=info.get("sha256"), input_bytes=info.get("bytes"))
+        rec.update(fields)
+        stages = [(run_id, s, st.get("n"), st.get("mean_ms"), st.get("p50_ms"), st.get("p95_ms"), st.get("max_ms"),
+                   st.get("total_s")) for s, st in (timings.get("etapas") or {}).items()]
+        with self._lock, self._db:
+            self._upsert_run(run_id, rec)
+            if options is not None:
+                self._set_options(run_id, options)
+            if timings:
+                self._db.execute("DELETE FROM timings WHERE run_id=?", (run_id,))
+                self._db.executemany("INSERT INTO timings VALUES (?,?,?,?,?,?,?,?)", stages)
+            self._set_occurrences(run_id, occs)
+        return True
+
+    def set_occurrences(self, run_id:str, occs:Sequence[Dict[str,Any]]):
+        """Regrava só as ocorrências (ex.: /rethreshold)."""
+        with self._lock, self._db:
+            self._set_occurrences(run_id, occs)
+            self._upsert_run(run_id, {"n_occ": len(occs)})
+
+    def set_batch(self, run_ids:Iterable[str], batch_id:str):
+        with self._lock, self._db:
+            self._db.executemany("UPDATE runs SET batch_id=? WHERE run_id=?", [(batch_id, r) for r in run_ids])
+
+    def add_label(self, run_id:str, occ_id:str, frame:Optional[int], y:int, label:Optional[str]=None,
+                  ts:Optional[float]=None):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO labels VALUES (?,?,?,?,?,?)",
+                             (run_id, occ_id, frame, int(y), label, time.time() if ts is None else ts))
+
+    def evicted(self, run_ids:Iterable[str], runs_dir:Path):
+        """Depois de RunCache.evict(): pasta apagada sai do catálogo (menos os rótulos); pasta reduzida
+        aos arquivos de treino fica com evicted=1 (ocorrências e rótulos continuam consultáveis)."""
+        with self._lock, self._db:
+            for run_id in run_ids:
+                if (Path(runs_dir) / run_id).exists():
+                    self._db.execute("UPDATE runs SET evicted=1, updated=? WHERE run_id=?", (time.time(), run_id))
+                    continue
+                self._db.execute("DELETE FROM occ_rtree WHERE id IN (SELECT id FROM occurrences WHERE run_id=?)", (run_id,))
+                for table in ("occurrences", "timings", "options", "runs"):
+                    self._db.execute(f"DELETE FROM {table} WHERE run_id=?", (run_id,))
+
+    def sync(self, runs_dir:Path)->int:
+        """Cataloga as pastas de runs/ que ainda não estão no catálogo (migração; uma leitura por run
+        novo). Rótulos vêm de labels.csv com occ_id. Retorna o nº de runs incluídos."""
+        with self._lock:
+            known = {r[0] for r in self._db.execute("SELECT run_id FROM runs")}
+        n = 0
+        for d in sorted(Path(runs_dir).iterdir()):
+            if d.name in known or d.name.startswith("_") or not d.is_dir():
+                continue
+            created = d.stat().st_mtime
+            if self.index_run(d, created=created, source="api", evicted=int(not (d / "thumbs").exists())):
+                n += 1
+                self._sync_labels(d)
+        return n
+
+    def _sync_labels(self, run_dir:Path):
+        path = run_dir / "labels.csv"
+        if not path.exists():
+            return
+        with path.open(newline="", encoding="utf-8") as f:
+            rows = [r for r in csv.DictReader(f) if r.get("occ_id")]
+        for r in rows:
+            self.add_label(run_dir.name, r["occ_id"], _int(r.get("frame")), label_value(r.get("label")),
+                           r.get("label"), float(r.get("ts") or 0) or None)
+
+    # --- consultas ---
+
+    def count_runs(self)->int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def get_run(self, run_id:str)->Optional[Dict[str,Any]]:
+        """Registro do run + opções + etapas + nº de rótulos."""
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_RUN_COLS)} FROM runs WHERE run_id=?", (run_id,)).fetchone()
+            if row is None:
+                return None
+            run = dict(zip(_RUN_COLS, row))
+            run["options"] = {k: json.loads(v) for k, v in self._db.execute(
+                "SELECT name, value FROM options WHERE run_id=? ORDER BY name", (run_id,))}
+            run["timings"] = {r[0]: dict(zip(("n", "mean_ms", "p50_ms", "p95_ms", "max_ms", "total_s"), r[1:]))
+                              for r in self._db.execute("SELECT stage, n, mean_ms, p50_ms, p95_ms, max_ms, total_s "
+                                                        "FROM timings WHERE run_id=? ORDER BY stage", (run_id,))}
+            run["n_labels"] = self._db.execute("SELECT COUNT(*) FROM labels WHERE run_id=?", (run_id,)).fetchone()[0]
+        return run
+
+    def list_runs(self, limit:int=50, cursor:Optional[str]=None, state:Optional[str]=None, source:Optional[str]=None,
+                  batch_id:Optional[str]=None, sha256:Optional[str]=None, since:Optional[float]=None,
+                  until:Optional[float]=None, min_occ:Optional[int]=None,
+                  options:Optional[Dict[str,Any]]=None)->Dict[str,Any]:
+        """Runs do mais novo para o mais antigo, `limit` por página; "next" = cursor da próxima página
+        (None no fim). `options` filtra por flag efetiva ({"track": True, ...})."""
+        limit = max(1, min(int(limit), PAGE_MAX))
+        where, params = [], []
+        for col, v in (("state", state), ("source", source), ("batch_id", batch_id), ("input_sha256", sha256)):
+            if v is not None:
+                where.append(f"r.{col}=?"); params.append(v)
+        if since is not None:
+            where.append("r.created>=?"); params.append(float(since))
+        if until is not None:
+            where.append("r.created<?"); params.append(float(until))
+        if min_occ is not None:
+            where.append("r.n_occ>=?"); params.append(int(min_occ))
+        for name, v in (options or {}).items():
+            where.append("EXISTS (SELECT 1 FROM options o WHERE o.run_id=r.run_id AND o.name=? AND o.value=?)")
+            params += [name, json.dumps(v, ensure_ascii=False, sort_keys=True)]
+        after = decode_cursor(cursor)
+        if after is not None:
+            where.append("(r.created<? OR (r.created=? AND r.run_id<?))"); params += [after[0], after[0], after[1]]
+        sql = (f"SELECT {', '.join('r.' + c for c in _RUN_COLS)} FROM runs r"
+               + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY r.created DESC, r.run_id DESC LIMIT ?")
+        with self._lock:
+            rows = self._db.execute(sql, params + [limit + 1]).fetchall()
+        runs = [dict(zip(_RUN_COLS, r)) for r in rows[:limit]]
+        nxt = encode_cursor(runs[-1]["created"], runs[-1]["run_id"]) if len(rows) > limit else None
+        return {"runs": runs, "next": nxt}
+
+    def query_occurrences(self, limit:int=100, cursor:Optional[str]=None, run_id:Optional[str]=None,
+                          bbox:Optional[Sequence[float]]=None, t0:Optional[float]=None, t1:Optional[float]=None,
+                          occ_type:Optional[str]=None, min_severity:Optional[float]=None, min_score:Optional[float]=None,
+                          labeled:Optional[bool]=None)->Dict[str,Any]:
+        """Ocorrências filtradas, em ordem de catálogo (id), `limit` por página. `bbox` = (x0, y0, x1, y1)
+        em pixels do frame: ocorrências cuja bbox cruza a região (R-tree); t0/t1 = intervalo de time_s."""
+        limit = max(1, min(int(limit), PAGE_MAX))
+        where, params = [], []
+        src = "occurrences c"
+        if bbox is not None:
+            x0, y0, x1, y1 = (float(v) for v in bbox)
+            src = "occ_rtree t JOIN occurrences c ON c.id=t.id"
+            where += ["t.x1>=?", "t.x0<=?", "t.y1>=?", "t.y0<=?"]; params += [x0, x1, y0, y1]
+            if t0 is not None:
+                where.append("t.t1>=?"); params.append(float(t0))
+            if t1 is not None:
+                where.append("t.t0<=?"); params.append(float(t1))
+        else:
+            if t0 is not None:
+                where.append("c.time_s>=?"); params.append(float(t0))
+            if t1 is not None:
+                where.append("c.time_s<=?"); params.append(float(t1))
+        for col, v in (("run_id", run_id), ("type", occ_type)):
+            if v is not None:
+                where.append(f"c.{col}=?"); params.append(v)
+        if min_severity is not None:
+            where.append("c.severity>=?"); params.append(float(min_severity))
+        if min_score is not None:
+            where.append("c.score>=?"); params.append(float(min_score))
+        if labeled is not None:
+            where.append(("" if labeled else "NOT ") + "EXISTS (SELECT 1 FROM labels l WHERE l.run_id=c.run_id AND l.occ_id=c.occ_id)")
+        after = decode_cursor(cursor)
+        if after is not None:
+            where.append("c.id>?"); params.append(int(after[0]))
+        sql = (f"SELECT {', '.join('c.' + c for c in _OCC_COLS)}, "
+               "(SELECT l.y FROM labels l WHERE l.run_id=c.run_id AND l.occ_id=c.occ_id) FROM " + src
+               + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY c.id LIMIT ?")
+        with self._lock:
+            rows = self._db.execute(sql, params + [limit + 1]).fetchall()
+        out = []
+        for r in rows[:limit]:
+            occ = json.loads(r[10])
+            occ.update(run_id=r[1], occ_id=r[2], catalog_id=r[0])
+            if r[11] is not None:
+                occ["label"] = r[11]
+            out.append(occ)
+        nxt = encode_cursor(rows[limit - 1][0]) if len(rows) > limit else None
+        return {"occurrences": out, "next": nxt}
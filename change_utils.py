@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# change_utils.py — v0.7d
+# Mudança de cena entre frames amostrados (CLI --skip-static / --adaptive), para voo parado
+# (hover), decolagem e pouso, em que frames amostrados seguidos são quase iguais.
+# - change_signature(): luminância reduzida (lado maior CHANGE_EDGE px). frame_change() mede entre
+#   duas assinaturas a diferença média absoluta (níveis de cinza, 0–255) e o deslocamento global
+#   (correlação de fase, em fração do lado maior) — em cena lisa um voo em movimento muda pouco a
+#   média, mas desloca. Assinatura + medida ~1 ms num frame 1080p.
+# - ChangeGate filtra o iterador do FrameSampler:
+#   * skip: frame com diferença < static_threshold e deslocamento < STATIC_SHIFT em relação ao
+#     último frame ANALISADO não vai
+#     para a análise; fica em `static` como (idx, frame_fonte) e o CLI reaproveita o resultado do
+#     frame fonte (ocorrências copiadas com "reused_from", candidatos repetidos, sem thumbs).
+#     A comparação é sempre com o último analisado: deriva lenta acumula e acaba reanalisada.
+#   * adaptive: a diferença para o frame amostrado anterior ajusta sampler.scale (multiplicador
+#     do passo, entre 1/range e range): cena parada -> dobra o passo; mudança rápida (diferença
+#     > fast_threshold ou deslocamento > FAST_SHIFT) -> divide por 2; entre os dois, volta um
+#     degrau em direção ao passo base.
+# Funciona igual com --workers: o gate roda no processo principal, antes do anel de memória.
+# `frames` (opcional) substitui a iteração do sampler (o CLI passa o iterador cronometrado da
+# decodificação); `times` guarda o custo do gate por frame amostrado (timings.json).
+import copy, time
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+import cv2
+
+from candidate_utils import occurrence_id
+from track_utils import MIN_RESPONSE
+from thumb_utils import thumb_frame
+
+CHANGE_EDGE = 96
+STATIC_THRESHOLD = 2.0
+STATIC_SHIFT = 0.005   # fração do lado maior (~10 px em 1920)
+FAST_THRESHOLD = 12.0
+FAST_SHIFT = 0.25      # frames amostrados seguidos com menos de 3/4 de sobreposição
+ADAPTIVE_RANGE = 4
+
+def change_signature(frame:np.ndarray, edge:int=CHANGE_EDGE)->np.ndarray:
+    """Luminância reduzida (lado maior = edge) em float32."""
+    h, w = frame.shape[:2]
+    s = min(1.0, edge / float(max(h, w)))
+    step = max(1, max(h, w) // (4 * edge))  # decimação barata; INTER_AREA faz a média do resto
+    small = cv2.resize(frame[::step, ::step], (max(4, int(w*s)), max(4, int(h*s))), interpolation=cv2.INTER_AREA)
+    grey = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+    return grey.astype(np.float32)
+
+def frame_change(a:Optional[np.ndarray], b:Optional[np.ndarray])->Tuple[float,float]:
+    """(média de |a - b| em níveis de cinza, deslocamento em fração do lado maior); (inf, inf) se
+    não comparáveis (primeiro frame, resolução nova). Correlação fraca -> deslocamento 0."""
+    if a is None or b is None or a.shape != b.shape:
+        return float("inf"), float("inf")
+    diff = float(cv2.absdiff(a, b).mean())
+    # cópias: o phaseCorrelate do OpenCV aplica a janela sobre os próprios arrays de entrada
+    (dx, dy), resp = cv2.phaseCorrelate(a.copy(), b.copy(), cv2.createHanningWindow(a.shape[::-1], cv2.CV_32F))
+    shift = float(np.hypot(dx, dy)) / max(a.shape) if resp >= MIN_RESPONSE else 0.0
+    return diff, shift
+
+class ChangeGate:
+    """Itera (idx, frame) dos frames que precisam de análise; os parados ficam em `static`."""
+    def __init__(self, sampler, static_threshold:Optional[float]=STATIC_THRESHOLD,
+                 adaptive_range:int=1, fast_threshold:float=FAST_THRESHOLD, frames:Optional[Iterable]=None):
+        self.sampler = sampler
+        self.frames = frames
+        self.static_threshold = static_threshold  # None = não pula (só amostragem adaptativa)
+        self.range = max(1, int(adaptive_range))
+        self.fast_threshold = float(fast_threshold)
+        self.static: deque = deque()
+        self.stats = {"reutilizados": 0, "passo_min": sampler.step, "passo_max": sampler.step}
+        self.times: List[float] = []
+
+    def _is_static(self, diff:float, shift:float)->bool:
+        return diff < (STATIC_THRESHOLD if self.static_threshold is None else self.static_threshold) and shift < STATIC_SHIFT
+
+    def _adapt(self, diff:float, shift:float):
+        scale = self.sampler.scale
+        if self._is_static(diff, shift):
+            scale *= 2
+        elif diff > self.fast_threshold or shift > FAST_SHIFT:
+            scale /= 2
+        elif scale != 1.0:
+            scale = scale / 2 if scale > 1 else scale * 2
+        self.sampler.scale = float(min(self.range, max(1.0 / self.range, scale)))
+        step = self.sampler.current_step()
+        self.stats["passo_min"] = min(self.stats["passo_min"], step)
+        self.stats["passo_max"] = max(self.stats["passo_max"], step)
+
+    def __iter__(self)->Iterator[Tuple[int,np.ndarray]]:
+        ref = prev = None; src = None
+        for idx, frame in (self.frames if self.frames is not None else self.sampler):
+            t = time.perf_counter()
+            sig = change_signature(frame)
+            if self.range > 1 and prev is not None:
+                self._adapt(*frame_change(prev, sig))
+            prev = sig
+            static = self.static_threshold is not None and self._is_static(*frame_change(ref, sig))
+            self.times.append(time.perf_counter() - t)
+            if static:
+                self.static.append((idx, src)); self.stats["reutilizados"] += 1
+                continue
+            ref = sig; src = idx
+            yield idx, frame
+
+    def pop_static(self, before:Optional[int]=None)->List[Tuple[int,int]]:
+        """(idx, frame_fonte) dos frames parados já vistos com idx < before (todos se None), em ordem."""
+        out = []
+        while self.static and (before is None or self.static[0][0] < before):
+            out.append(self.static.popleft())
+        return out
+
+def reuse_occurrences(occs:List[Dict[str,Any]], frame:int, fps:float)->List[Dict[str,Any]]:
+    """Ocorrências do frame fonte repetidas no frame parado: frame/time_s/occ_id do novo frame e
+    "reused_from" = frame cujas thumbs valem para elas."""
+    out = []
+    for o in occs:
+        c = copy.deepcopy(o)
+        c["frame"] = frame; c["time_s"] = round(frame/float(fps), 3)
+        if o.get("occ_id"):
+            run_id, _f, k, region = o["occ_id"].rsplit(":", 3)
+            c["occ_id"] = occurrence_id(run_id, frame, int(k), int(region))
+        c["reused_from"] = thumb_frame(o)
+        out.append(c)
+    return out
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# engine_utils.py — v0.7d
+# Pool de processos "quentes" para o motor de análise da API: em vez de um
+# `python veg_product_cli.py` por requisição (reimporta NumPy/OpenCV a cada job), N workers
+# ficam vivos com o módulo do motor já importado e recebem jobs por um Pipe.
+#
+# - Pré-fork: com "forkserver" o módulo do motor é pré-carregado uma vez no servidor de
+#   fork; cada worker (e cada reciclagem) nasce de um fork dele, já aquecido.
+# - Reciclagem: o worker é substituído depois de `max_jobs` jobs ou quando o pico de RSS
+#   passa de RECYCLE_FRACTION do limite de memória (fragmentação/vazamentos não acumulam).
+# - Limite de memória: RLIMIT_AS por worker (`mem_limit_mb`); estourar vira MemoryError no
+#   job, não derruba a API. Um worker que morre no meio do job é reiniciado.
+# Os workers não são daemon: o motor pode abrir o próprio pool (--workers > 1).
+import multiprocessing as mp
+import queue, threading, traceback
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import resource
+except ImportError:  # Windows: sem RLIMIT_AS / ru_maxrss
+    resource = None
+
+RECYCLE_FRACTION = 0.8
+
+def _peak_rss_mb()->float:
+    if resource is None:
+        return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # Linux: KiB
+
+def _worker_main(conn, fn:Callable, init:Optional[Callable], mem_limit_mb:int):
+    if mem_limit_mb and resource is not None:
+        lim = int(mem_limit_mb) << 20
+        resource.setrlimit(resource.RLIMIT_AS, (lim, lim))
+    if init is not None:
+        init()
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        if msg is None:
+            return
+        args, kwargs = msg
+        try:
+            reply = ("ok", fn(*args, **kwargs))
+        except BaseException as e:
+            reply = ("error", f"{type(e).__name__}: {e}\n{traceback.format_exc()}")
+        conn.send(reply + (_peak_rss_mb(),))
+
+def _context(preload:str):
+    if "forkserver" in mp.get_all_start_methods():
+        ctx = mp.get_context("forkserver")
+        ctx.set_forkserver_preload([preload])
+        return ctx
+    return mp.get_context("spawn")
+
+class _Worker:
+    def __init__(self, ctx, fn, init, mem_limit_mb):
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_worker_main, args=(child, fn, init, mem_limit_mb), name="engine", daemon=False)
+        self.proc.start()
+        child.close()
+        self.jobs = 0
+
+    def stop(self, timeout:float=5.0):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.proc.join(timeout)
+        if self.proc.is_alive():
+            self.proc.kill(); self.proc.join()
+        self.conn.close()
+
+class EnginePool:
+    """Executa fn(*args, **kwargs) num dos `workers` processos; run() bloqueia a thread
+    chamadora (uma thread do JobQueue) até o resultado. fn e init precisam ser importáveis
+    no nível de módulo. Erros no job viram RuntimeError com o traceback do worker."""
+    def __init__(self, fn:Callable, workers:int=2, max_jobs:int=50, mem_limit_mb:int=0, init:Optional[Callable]=None):
+        self.fn = fn; self.init = init
+        self.workers = max(1, int(workers))
+        self.max_jobs = max(0, int(max_jobs))
+        self.mem_limit_mb = max(0, int(mem_limit_mb))
+        self._ctx = _context(fn.__module__)
+        self._lock = threading.Lock()
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._closed = False
+        self.stats = {"jobs": 0, "errors": 0, "recycled": 0, "crashed": 0}
+        for _ in range(self.workers):
+            self._idle.put(self._spawn())
+
+    def _spawn(self)->_Worker:
+        return _Worker(self._ctx, self.fn, self.init, self.mem_limit_mb)
+
+    def _count(self, key:str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _replace(self, w:_Worker, reason:str)->_Worker:
+        w.stop()
+        self._count(reason)
+        return self._spawn()
+
+    def run(self, *args, **kwargs)->Any:
+        if self._closed:
+            raise RuntimeError("pool do motor encerrado")
+        w = self._idle.get()
+        try:
+            try:
+                w.conn.send((args, kwargs))
+                status, payload, peak_mb = w.conn.recv()
+            except (EOFError, OSError):
+                # worker morreu no meio do job (OOM killer, segfault no decoder...)
+                w.proc.join(1.0)
+                code = w.proc.exitcode
+                w = self._replace(w, "crashed")
+                raise RuntimeError(f"worker do motor terminou durante o job (exitcode {code}); reiniciado")
+            w.jobs += 1
+            self._count("jobs")
+            if ((self.max_jobs and w.jobs >= self.max_jobs)
+                    or (self.mem_limit_mb and peak_mb >= RECYCLE_FRACTION * self.mem_limit_mb)):
+                w = self._replace(w, "recycled")
+        finally:
+            self._idle.put(w)
+        if status == "error":
+            self._count("errors")
+            raise RuntimeError(payload)
+        return payload
+
+    def info(self)->Dict[str,Any]:
+        with self._lock:
+            return {"workers": self.workers, "idle": self._idle.qsize(), "max_jobs": self.max_jobs,
+                    "mem_limit_mb": self.mem_limit_mb, **self.stats}
+
+    def close(self):
+        """Encerra os workers ociosos (chamado na saída da API)."""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
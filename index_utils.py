@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# index_utils.py — v0.7d
+# Motor fundido de índices (VARI/NGRDI/IFV) + máscara de consenso (agree_k).
+# Reaproveita buffers pré-alocados por resolução entre frames (ufuncs com out=),
+# evitando as cópias float32 por canal e os temporários de indices_from_bgr.
+#
+# Precisões:
+# - "float32": mesmas operações, na mesma ordem, de indices_from_bgr (resultado idêntico).
+# - "float16": metade da memória dos buffers; erro ~1e-3 nos índices. Em CPUs sem
+#              aritmética fp16 nativa o NumPy emula (mais lento): use quando memória importa.
+# - "lut":     tabela indexada pelo BGR quantizado (LUT_BITS por canal); índices e
+#              consenso saem de um gather, sem aritmética por pixel.
+from typing import Dict, Tuple
+import numpy as np
+
+PRECISIONS = ("float32", "float16", "lut")
+# Limiares conservadores do CLI (VARI, NGRDI, IFV): pixel "baixo" se índice < limiar
+THRESHOLDS = (0.02, 0.02, 0.30)
+LUT_BITS = 6
+EPS = 1e-6
+
+class IndexEngine:
+    """Calcula índices e máscara de consenso com buffers reutilizados.
+
+    Os arrays retornados por compute() são views dos buffers internos: valem até a
+    próxima chamada com a mesma resolução. Não é thread-safe (use um motor por thread)."""
+    def __init__(self, precision:str="float32", thresholds:Tuple[float,float,float]=THRESHOLDS, lut_bits:int=LUT_BITS):
+        if precision not in PRECISIONS:
+            raise ValueError(f"precisão inválida: {precision}")
+        self.precision = precision
+        self.dtype = np.float16 if precision == "float16" else np.float32
+        self.thresholds = tuple(float(t) for t in thresholds)
+        self.lut_bits = int(lut_bits)
+        self._bufs: Dict[Tuple[int,int], Dict[str,np.ndarray]] = {}
+        self._lut = self._build_lut() if precision == "lut" else None
+
+    def _buffers(self, h:int, w:int)->Dict[str,np.ndarray]:
+        bufs = self._bufs.get((h, w))
+        if bufs is None:
+            shp = (h, w); dt = self.dtype
+            bufs = {
+                "vari": np.empty(shp, dt), "ngrdi": np.empty(shp, dt), "ifv": np.empty(shp, dt),
+                "cnt": np.empty(shp, np.uint8), "low": np.empty(shp, np.bool_),
+                "mask": np.empty(shp, np.uint8),
+            }
+            if self.precision == "lut":
+                bufs["key"] = np.empty(shp, np.intp); bufs["tmp"] = np.empty(shp, np.intp)  # np.take converte índices para intp
+            else:
+                for n in ("b", "g", "r", "num", "sum", "den"):
+                    bufs[n] = np.empty(shp, dt)
+            self._bufs[(h, w)] = bufs
+        return bufs
+
+    def _build_lut(self):
+        q = self.lut_bits; n = 1 << q; step = 256 // n
+        c = (np.arange(n, dtype=np.float32) * step + (step - 1) / 2.0).astype(np.float32)  # centro do bin
+        b, g, r = np.meshgrid(c, c, c, indexing="ij")
+        lut_f = np.empty((3, n, n, n), np.float32)
+        sel = IndexEngine("float32", self.thresholds)
+        bgr = np.stack([b, g, r], axis=-1).reshape(n*n, n, 3)
+        v, ng, f = sel._indices(bgr, sel._buffers(n*n, n))
+        lut_f[0] = v.reshape(n, n, n); lut_f[1] = ng.reshape(n, n, n); lut_f[2] = f.reshape(n, n, n)
+        lut_f = lut_f.reshape(3, -1)
+        t1, t2, t3 = (np.float32(t) for t in self.thresholds)
+        cnt = (lut_f[0] < t1).astype(np.uint8) + (lut_f[1] < t2) + (lut_f[2] < t3)
+        return {"idx": lut_f, "cnt": cnt.astype(np.uint8)}
+
+    def _indices(self, bgr:np.ndarray, bufs:Dict[str,np.ndarray]):
+        dt = self.dtype; eps = dt(EPS)
+        b, g, r = bufs["b"], bufs["g"], bufs["r"]
+        num, s, den = bufs["num"], bufs["sum"], bufs["den"]
+        vari, ngrdi, ifv = bufs["vari"], bufs["ngrdi"], bufs["ifv"]
+        np.add(bgr[..., 0], eps, out=b, dtype=dt)
+        np.add(bgr[..., 1], eps, out=g, dtype=dt)
+        np.add(bgr[..., 2], eps, out=r, dtype=dt)
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            np.subtract(g, r, out=num)
+            np.add(g, r, out=s)
+            # VARI = (g - r) / (g + r - b + eps)
+            np.subtract(s, b, out=den); np.add(den, eps, out=den)
+            np.divide(num, den, out=vari)
+            # NGRDI = (g - r) / (g + r + eps)
+            np.add(s, eps, out=den)
+            np.divide(num, den, out=ngrdi)
+            # IFV = g / (r + g + b + eps)
+            np.add(s, b, out=den); np.add(den, eps, out=den)
+            np.divide(g, den, out=ifv)
+        np.clip(vari, -1, 1, out=vari); np.clip(ngrdi, -1, 1, out=ngrdi); np.clip(ifv, 0, 1, out=ifv)
+        return vari, ngrdi, ifv
+
+    def _indices_lut(self, bgr:np.ndarray, bufs:Dict[str,np.ndarray]):
+        q = self.lut_bits; sh = 8 - q
+        key, tmp = bufs["key"], bufs["tmp"]
+        np.right_shift(bgr[..., 0], sh, out=key, dtype=np.intp); np.left_shift(key, 2*q, out=key)
+        np.right_shift(bgr[..., 1], sh, out=tmp, dtype=np.intp); np.left_shift(tmp, q, out=tmp); np.bitwise_or(key, tmp, out=key)
+        np.right_shift(bgr[..., 2], sh, out=tmp, dtype=np.intp); np.bitwise_or(key, tmp, out=key)
+        # mode="clip": chaves sempre válidas e evita o buffer temporário de mode="raise"
+        lut = self._lut["idx"]
+        np.take(lut[0], key, out=bufs["vari"], mode="clip"); np.take(lut[1], key, out=bufs["ngrdi"], mode="clip")
+        np.take(lut[2], key, out=bufs["ifv"], mode="clip"); np.take(self._lut["cnt"], key, out=bufs["cnt"], mode="clip")
+        return bufs["vari"], bufs["ngrdi"], bufs["ifv"]
+
+    def compute(self, bgr:np.ndarray, agree_k:int=2):
+        """Retorna (vari, ngrdi, ifv, mask) para um frame BGR uint8; mask é uint8 0/255
+        com os pixels em que pelo menos agree_k índices estão abaixo dos limiares."""
+        h, w = bgr.shape[:2]
+        bufs = self._buffers(h, w)
+        cnt, low, mask = bufs["cnt"], bufs["low"], bufs["mask"]
+        if self._lut is not None:
+            vari, ngrdi, ifv = self._indices_lut(bgr, bufs)
+        else:
+            vari, ngrdi, ifv = self._indices(bgr, bufs)
+            t1, t2, t3 = (self.dtype(t) for t in self.thresholds)
+            np.less(vari, t1, out=low); np.copyto(cnt, low)
+            np.less(ngrdi, t2, out=low); np.add(cnt, low, out=cnt)
+            np.less(ifv, t3, out=low); np.add(cnt, low, out=cnt)
+        np.greater_equal(cnt, agree_k, out=low)
+        np.multiply(low.view(np.uint8), 255, out=mask)
+        return vari, ngrdi, ifv, mask
+
+    def consensus(self, shape:Tuple[int,int], agree_k:int)->np.ndarray:
+        """Máscara uint8 0/255 para outro agree_k a partir das contagens do último compute()
+        nessa resolução (sem recalcular os índices). Retorna um array novo."""
+        cnt = self._bufs[tuple(shape[:2])]["cnt"]
+        return np.greater_equal(cnt, agree_k).view(np.uint8) * np.uint8(255)
+
+_ENGINES: Dict[str, IndexEngine] = {}
+
+def get_engine(precision:str="float32")->IndexEngine:
+    """Motor compartilhado por processo (um por precisão)."""
+    eng = _ENGINES.get(precision)
+    if eng is None:
+        eng = _ENGINES[precision] = IndexEngine(precision)
+    return eng
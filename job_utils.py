@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# job_utils.py — v0.7d
+# Fila de jobs da API: /analyze enfileira e responde na hora com o run_id; um pool
+# limitado de threads executa os jobs (cada um bloqueia só a sua thread, não o event
+# loop do uvicorn). O progresso vem do progress.json gravado pelo CLI (--progress).
+# on_start(job) é chamado quando um job sai da fila (métricas: tempo de espera).
+import json, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+STATES = ("queued", "running", "done", "error")
+
+def read_progress(out_dir:Path)->Dict[str,Any]:
+    """Lê runs/<id>/progress.json (gravado de forma atômica pelo CLI); {} se ainda não existe."""
+    try:
+        return json.loads((out_dir/"progress.json").read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+class JobQueue:
+    """Pool de `max_workers` jobs simultâneos com no máximo `max_queue` jobs aguardando."""
+    def __init__(self, max_workers:int=2, max_queue:int=32, max_history:int=1000,
+                 on_start:Optional[Callable[[Dict[str,Any]],None]]=None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self.max_history = max(1, int(max_history))
+        self.on_start = on_start
+        self.rejected = 0
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="jobs")
+        self._lock = threading.Lock()
+        self.jobs: Dict[str, Dict[str,Any]] = {}
+
+    def pending(self)->int:
+        with self._lock:
+            return sum(1 for j in self.jobs.values() if j["state"] == "queued")
+
+    def running(self)->int:
+        with self._lock:
+            return sum(1 for j in self.jobs.values() if j["state"] == "running")
+
+    def submit(self, run_id:str, fn:Callable[...,Dict[str,Any]], *args)->Optional[Future]:
+        """Enfileira fn(*args); retorna None se a fila está cheia. O dict retornado por fn
+        vira o resultado do job (campo "ok" decide done/error)."""
+        with self._lock:
+            waiting = sum(1 for j in self.jobs.values() if j["state"] == "queued")
+            if waiting >= self.max_queue + max(0, self.max_workers - self._running_unlocked()):
+                self.rejected += 1
+                return None
+            self._prune_unlocked()
+            self.jobs[run_id] = {"run_id": run_id, "state": "queued", "created": time.time(),
+                                 "started": None, "finished": None, "result": None}
+        return self._pool.submit(self._run, run_id, fn, *args)
+
+    def _running_unlocked(self)->int:
+        return sum(1 for j in self.jobs.values() if j["state"] == "running")
+
+    def _prune_unlocked(self):
+        # esquece os jobs finalizados mais antigos (o run continua em disco)
+        finished = [k for k, j in self.jobs.items() if j["state"] in ("done", "error")]
+        for k in finished[:max(0, len(self.jobs) - self.max_history + 1)]:
+            del self.jobs[k]
+
+    def _run(self, run_id:str, fn, *args):
+        job = self.jobs[run_id]
+        with self._lock:
+            job["state"] = "running"; job["started"] = time.time()
+        if self.on_start is not None:
+            try:
+                self.on_start(dict(job))
+            except Exception:
+                pass  # métrica não derruba o job
+        try:
+            res = fn(*args)
+        except Exception as e:
+            res = {"ok": False, "run_id": run_id, "stderr": f"job_error: {e}"}
+        with self._lock:
+            job["result"] = res
+            job["state"] = "done" if res.get("ok") else "error"
+            job["finished"] = time.time()
+        return res
+
+    def position(self, run_id:str)->Optional[int]:
+        """Posição na fila (0 = próximo a rodar) para jobs "queued"."""
+        with self._lock:
+            queued = sorted((j for j in self.jobs.values() if j["state"] == "queued"), key=lambda j: j["created"])
+            for i, j in enumerate(queued):
+                if j["run_id"] == run_id:
+                    return i
+        return None
+
+    def status(self, run_id:str, out_dir:Path)->Optional[Dict[str,Any]]:
+        """Estado + progresso (frames processados/total, ETA) + resultado final, se houver."""
+        job = self.jobs.get(run_id)
+        if job is None:
+            return None
+        prog = read_progress(out_dir)
+        done, total = int(prog.get("frames_done", 0)), int(prog.get("frames_total", 0))
+        st = {"run_id": run_id, "state": job["state"], "frames_done": done, "frames_total": total,
+              "progress": round(done/total, 4) if total else None, "eta_s": prog.get("eta_s"),
+              "occ": prog.get("occ"), "queue_position": self.position(run_id),
+              "elapsed_s": round((job["finished"] or time.time()) - job["started"], 2) if job["started"] else 0.0}
+        if job["state"] in ("done", "error"):
+            st["progress"] = 1.0 if job["state"] == "done" else st["progress"]
+            st["eta_s"] = 0.0
+            st.update({k: v for k, v in (job["result"] or {}).items() if k not in st})
+        return st
+
+    def state(self, run_id:str)->Optional[str]:
+        """queued/running/done/error, ou None se o job não está no registro em memória."""
+        job = self.jobs.get(run_id)
+        return job["state"] if job else None
+
+    def list(self)->List[Dict[str,Any]]:
+        with self._lock:
+            return [{"run_id": j["run_id"], "state": j["state"], "created": j["created"]} for j in self.jobs.values()]
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# metrics_utils.py — v0.7d
+# Instrumentação sem dependências externas:
+# - CLI: Lap (tempos das etapas de um frame, inclusive dentro dos workers de --workers) e
+#   StageTimer (acumula por run; timings.json com p50/p95/... por etapa, contagens e bytes).
+# - API: métricas no formato texto do Prometheus (0.0.4) servidas em /metrics — Counter, Gauge
+#   e Histogram com rótulos, MetricsRegistry.render() e HttpMetrics (middleware ASGI: latência
+#   por rota, medida até o último byte da resposta). Valores lidos na hora da coleta (fila,
+#   modelo) entram como funções (Gauge/Counter com `fn`).
+import json, math, os, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+TIMINGS_NAME = "timings.json"
+
+def latency(samples:Sequence[float])->Dict[str,Any]:
+    """Resumo de durações (segundos) em ms: n, média, p50/p90/p95/p99, máx e total (s)."""
+    ms = np.asarray(samples, np.float64) * 1000.0
+    if not ms.size:
+        return {"n": 0}
+    out = {"n": int(ms.size), "mean_ms": float(ms.mean())}
+    out.update({f"p{q}_ms": float(np.percentile(ms, q)) for q in (50, 90, 95, 99)})
+    out["max_ms"] = float(ms.max()); out["total_s"] = float(ms.sum() / 1000.0)
+    return {k: round(v, 3) if isinstance(v, float) else v for k, v in out.items()}
+
+# --- CLI ---
+
+class Lap:
+    """Cronômetro de voltas: lap("etapa") soma o tempo desde a volta anterior à etapa.
+    result() é picklável (volta dos workers junto com o resultado do frame)."""
+    def __init__(self):
+        self.t = time.perf_counter()
+        self.times: Dict[str,float] = {}
+        self.counts: Dict[str,int] = {}
+
+    def __call__(self, stage:str):
+        now = time.perf_counter()
+        self.times[stage] = self.times.get(stage, 0.0) + (now - self.t)
+        self.t = now
+
+    def count(self, name:str, n:int=1):
+        self.counts[name] = self.counts.get(name, 0) + int(n)
+
+    def result(self)->Dict[str,Dict]:
+        return {"t": self.times, "n": self.counts}
+
+class StageTimer:
+    """Durações por etapa (uma amostra por frame ou por chamada) e contagens de um run."""
+    def __init__(self):
+        self.samples: Dict[str,List[float]] = {}
+        self.counts: Dict[str,int] = {}
+        self.t0 = time.perf_counter()
+
+    def add(self, stage:str, seconds:float):
+        self.samples.setdefault(stage, []).append(float(seconds))
+
+    def count(self, name:str, n:int=1):
+        self.counts[name] = self.counts.get(name, 0) + int(n)
+
+    def merge(self, lap:Optional[Dict[str,Dict]]):
+        """Soma o resultado de um Lap (frame analisado aqui ou num worker)."""
+        if not lap:
+            return
+        for stage, s in lap.get("t", {}).items():
+            self.add(stage, s)
+        for name, n in lap.get("n", {}).items():
+            self.count(name, n)
+
+    @contextmanager
+    def stage(self, name:str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t)
+
+    def timed(self, it:Iterable, name:str)->Iterator:
+        """Itera `it` medindo cada next() como uma amostra de `name` (ex.: decodificação)."""
+        it = iter(it)
+        while True:
+            t = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self.add(name, time.perf_counter() - t)
+            yield item
+
+    def summary(self)->Dict[str,Any]:
+        return {s: latency(v) for s, v in self.samples.items()}
+
+    def wall(self)->float:
+        return time.perf_counter() - self.t0
+
+def bytes_written(out_dir:Path, exclude:Iterable[Path]=())->Dict[str,int]:
+    """Bytes dos artefatos do run por tipo (thumbs, ocorrencias, candidatos, outros) + total."""
+    out_dir = Path(out_dir)
+    skip = {Path(p).resolve() for p in exclude}
+    acc = {"thumbs": 0, "ocorrencias": 0, "candidatos": 0, "outros": 0}
+    for root, _dirs, files in os.walk(out_dir):
+        for name in files:
+            p = Path(root) / name
+            if p.resolve() in skip:
+                continue
+            try:
+                size = p.stat().st_size
+            except OSError:
+                continue
+            rel = p.relative_to(out_dir).parts
+            kind = ("thumbs" if rel[0] == "thumbs" else "ocorrencias" if name.startswith("occurrences")
+                    else "candidatos" if name.startswith("candidates") else "outros")
+            acc[kind] += size
+    acc["total"] = sum(acc.values())
+    return acc
+
+def write_timings(path:Path, data:Dict[str,Any]):
+    tmp = Path(path).with_name(Path(path).name + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+def read_timings(out_dir:Path)->Optional[Dict[str,Any]]:
+    try:
+        return json.loads((Path(out_dir) / TIMINGS_NAME).read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+# --- Prometheus (formato texto) ---
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+WALL_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+def _fmt(v:float)->str:
+    v = float(v)
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return str(int(v)) if v.is_integer() and abs(v) < 1e15 else repr(v)
+
+def _esc(v:str)->str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names:Sequence[str], values:Sequence[str], extra:str="")->str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    kind = "untyped"
+    def __init__(self, name:str, help:str, labels:Sequence[str]=(), fn:Optional[Callable[[],Any]]=None):
+        self.name = name; self.help = help; self.labelnames = tuple(labels)
+        self.fn = fn  # valor lido na coleta: número ou {(rótulos...): número}
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str,...],float] = {}
+
+    def _key(self, labels:Dict[str,Any])->Tuple[str,...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def samples(self)->List[str]:
+        if self.fn is not None:
+            v = self.fn()
+            items = v.items() if isinstance(v, dict) else [((), v)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {_fmt(v)}" for k, v in items if v is not None]
+
+    def render(self)->str:
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples())
+
+class Counter(_Metric):
+    kind = "counter"
+    def inc(self, amount:float=1.0, **labels):
+        k = self._key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0.0) + float(amount)
+
+class Gauge(_Metric):
+    kind = "gauge"
+    def set(self, value:float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+class Histogram(_Metric):
+    kind = "histogram"
+    def __init__(self, name:str, help:str, labels:Sequence[str]=(), buckets:Sequence[float]=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._hist: Dict[Tuple[str,...],List[float]] = {}  # contagens por bucket + [soma, contagem]
+
+    def observe(self, value:float, **labels):
+        k = self._key(labels)
+        with self._lock:
+            h = self._hist.get(k)
+            if h is None:
+                h = self._hist[k] = [0.0] * (len(self.buckets) + 2)
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    h[i] += 1
+            h[-2] += float(value); h[-1] += 1
+
+    def samples(self)->List[str]:
+        with self._lock:
+            items = [(k, list(h)) for k, h in self._hist.items()]
+        out = []
+        les = [f'le="{_fmt(b)}"' for b in self.buckets] + ['le="+Inf"']
+        for k, h in items:
+            for i, le in enumerate(les):
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, k, le)} {_fmt(h[i] if i < len(self.buckets) else h[-1])}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, k)} {_fmt(h[-2])}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, k)} {_fmt(h[-1])}")
+        return out
+
+class MetricsRegistry:
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def _add(self, m:_Metric)->_Metric:
+        self._metrics.append(m)
+        return m
+
+    def counter(self, name:str, help:str, labels:Sequence[str]=(), fn=None)->Counter:
+        return self._add(Counter(name, help, labels, fn))
+
+    def gauge(self, name:str, help:str, labels:Sequence[str]=(), fn=None)->Gauge:
+        return self._add(Gauge(name, help, labels, fn))
+
+    def histogram(self, name:str, help:str, labels:Sequence[str]=(), buckets:Sequence[float]=LATENCY_BUCKETS)->Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self)->str:
+        parts = []
+        for m in self._metrics:
+            try:
+                parts.append(m.render())
+            except Exception:
+                continue  # uma leitura com erro (fn) não derruba o /metrics inteiro
+        return "\n".join(parts) + "\n"
+
+class HttpMetrics:
+    """Middleware ASGI: duração de cada requisição HTTP (até o último byte) por rota (o modelo
+    do caminho, ex. /download/{run_id}/{path:path}), método e status. Rotas em `skip` (streams
+    de longa duração) ficam de fora."""
+    def __init__(self, app, histogram:Histogram, skip:Iterable[str]=()):
+        self.app = app; self.histogram = histogram; self.skip = set(skip)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter(); status = [500]
+
+        async def _send(msg):
+            if msg["type"] == "http.response.start":
+                status[0] = msg["status"]
+            await send(msg)
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "desconhecida"
+            if route not in self.skip:
+                self.histogram.observe(time.perf_counter() - t0, route=route, method=scope.get("method", ""),
+                                       code=str(status[0]))
@@ -1,8 +1,8 @@
 # model_utils.py — v0.7
 # Treino e inferência leves a partir de rótulos enviados pelo relatório/painel.
 from pathlib import Path
-import json, csv, math
-from typing import List, Dict, Any, Tuple
+import json, csv, math, os
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 import numpy as np
 
 try:
@@ -12,35 +12,33 @@ except Exception:  # fallback para ambientes sem sklearn
     LogisticRegression = None
     joblib = None
 
-FEATURES = ["vari","ngrdi","ifv","zmin","roi_ratio","near_veg_ratio","area_px","aspect"]
+from scorer_utils import FEATURES, occ_features, apply_model  # reexportados (inferência só NumPy)
 
-def _occ_aspect(occ:Dict[str,Any])->float:
-    try:
-        x,y,w,h = occ.get("bbox")[:4]
-        return float(w)/float(h) if h else 1.0
-    except Exception:
-        return 1.0
+def label_value(label:Any)->int:
+    """1 para 'confirm' (e sinônimos), 0 para o resto ('fp')."""
+    return 1 if (label or "").strip().lower() in ("confirm","confirmed","positivo","pos") else 0
 
-def occ_features(occ:Dict[str,Any])->List[float]:
-    ev = occ.get("evidence",{}) or {}
-    vals = [
-        ev.get("vari",0.0),
-        ev.get("ngrdi",0.0),
-        ev.get("ifv",0.0),
-        ev.get("zmin",0.0),
-        ev.get("roi_ratio",1.0),
-        ev.get("near_veg_ratio",0.0),
-        float(occ.get("area_px",0)),
-        _occ_aspect(occ),
-    ]
-    # normalização simples de área (log1p) para escala comparável
-    vals[6] = float(np.log1p(max(0.0, vals[6])))
-    return [float(v) for v in vals]
+def occurrences_by_frame(occs:List[Dict[str,Any]])->Dict[int,List[Dict[str,Any]]]:
+    by_frame = {}
+    for i,occ in enumerate(occs):
+        by_frame.setdefault(int(occ.get("frame", occ.get("idx", occ.get("id", i)))), []).append(occ)
+    return by_frame
 
-def collect_labels_and_features(runs_dir:Path)->Tuple[np.ndarray,np.ndarray,int]:
-    """Lê todos labels.csv em runs/*/, casa com occurrences_v2.json pelo frame (mais simples), 
-    extrai features e retorna X,y. y=1 para 'confirm', 0 para 'fp'."""
-    X=[]; y=[]; n_rows=0
+def occurrence_key(run_id:str, occ:Dict[str,Any], i:int)->str:
+    """occ_id da ocorrência; runs anteriores ao occ_id usam run:frame:#posição no arquivo."""
+    return occ.get("occ_id") or f"{run_id}:{int(occ.get('frame', occ.get('idx', i)))}:#{i}"
+
+def match_occurrence(by_frame:Dict[int,List[Dict[str,Any]]], frame:int):
+    """Ocorrência usada como exemplo do rótulo: a de maior área do frame (ou None)."""
+    cands = by_frame.get(frame, [])
+    if not cands:
+        return None
+    return max(cands, key=lambda o: float(o.get("area_px",0)))
+
+def iter_labeled_occurrences(runs_dir:Path)->Iterator[Tuple[str,int,int,Optional[Dict[str,Any]]]]:
+    """Percorre todos labels.csv em runs/*/ e gera (run_id, frame, y, ocorrência casada ou None),
+    casando com occurrences_v2.json pelo occ_id do rótulo ou, sem ele, pelo frame (maior área).
+    Linhas com occ_id que não está no relatório são puladas."""
     for labels_path in runs_dir.glob("*/labels.csv"):
         run_id = labels_path.parent.name
         occ_path = labels_path.parent/"occurrences_v2.json"
@@ -53,27 +51,40 @@ def collect_labels_and_features(runs_dir:Path)->Tuple[np.ndarray,np.ndarray,int]
             occs = json.loads(occ_path.read_text(encoding="utf-8"))
         except Exception:
             continue
-        by_frame = {}
-        for i,occ in enumerate(occs):
-            by_frame.setdefault(int(occ.get("frame", occ.get("idx", occ.get("id", i)))), []).append(occ)
+        by_frame = occurrences_by_frame(occs)
+        by_id = {o["occ_id"]: o for o in occs if o.get("occ_id")}
 
         with labels_path.open(newline="", encoding="utf-8") as f:
             rdr = csv.DictReader(f)
             for row in rdr:
-                n_rows += 1
                 try:
                     frame = int(float(row.get("frame", 0)))
                 except Exception:
                     frame = 0
-                label = (row.get("label") or "").strip().lower()
-                y_val = 1 if label in ("confirm","confirmed","positivo","pos") else 0
-                cands = by_frame.get(frame, [])
-                if not cands:
-                    continue
-                # pega a maior área do frame como candidata (simples e robusto)
-                occ = max(cands, key=lambda o: float(o.get("area_px",0)))
-                X.append(occ_features(occ))
-                y.append(y_val)
+                occ_id = row.get("occ_id") or ""
+                if occ_id:
+                    occ = by_id.get(occ_id)
+                    if occ is None:
+                        # occ_id que não está no relatório atual: rótulo descartado
+                        continue
+                else:
+                    # rótulo sem occ_id (relatório antigo): pega a maior área do frame como candidata
+                    occ = match_occurrence(by_frame, frame)
+                yield run_id, frame, label_value(row.get("label")), occ
+
+def collect_labels_and_features(runs_dir:Path)->Tuple[np.ndarray,np.ndarray,int]:
+    """Lê todos labels.csv em runs/*/ (iter_labeled_occurrences), extrai as features da ocorrência
+    rotulada e retorna X, y, nº de linhas. O rótulo casa com occurrences_v2.json pelo occ_id estável
+    gravado nele; só linhas antigas, sem occ_id, caem no frame (maior área do frame). Linhas com
+    occ_id desconhecido são puladas; as sem ocorrência no frame contam nas linhas mas ficam fora
+    de X. y=1 para 'confirm', 0 para 'fp'."""
+    X=[]; y=[]; n_rows=0
+    for _run_id, _frame, y_val, occ in iter_labeled_occurrences(runs_dir):
+        n_rows += 1
+        if occ is None:
+            continue
+        X.append(occ_features(occ))
+        y.append(y_val)
     if not X:
         return np.zeros((0,len(FEATURES))), np.zeros((0,)), n_rows
     return np.array(X, dtype=np.float32), np.array(y, dtype=np.float32), n_rows
@@ -86,7 +97,10 @@ def fit_and_save(runs_dir:Path, out_path:Path)->Dict[str,Any]:
     clf = LogisticRegression(max_iter=500, n_jobs=None)
     clf.fit(X,y)
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    joblib.dump({"model": clf, "features": FEATURES}, out_path)
+    # grava ao lado e renomeia: quem lê model.joblib nunca pega o arquivo pela metade
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    joblib.dump({"model": clf, "features": FEATURES}, tmp)
+    os.replace(tmp, out_path)
     return {"ok": True, "n": int(X.shape[0]), "pos_frac": float(y.mean())}
 
 def load_model(model_path:Path):
@@ -97,28 +111,3 @@ def load_model(model_path:Path):
         return obj.get("model")
     except Exception:
         return None
-
-def apply_model(model, occs:List[Dict[str,Any]], boost:bool=True)->List[Dict[str,Any]]:
-    """Aplica o modelo e, se boost=True, ajusta confiança e tipo final por cima das regras."""
-    if model is None or not occs:
-        return occs
-    import numpy as np
-    X = np.array([occ_features(o) for o in occs], dtype=np.float32)
-    proba = model.predict_proba(X)[:,1]  # prob de 'confirmado'
-    for i,o in enumerate(occs):
-        score = float(proba[i])
-        o.setdefault("ml", {})["score"] = round(score,3)
-        if not boost:
-            continue
-        # Ajuste de confiança/tipo:
-        orig_conf = int(o.get("confidence", 70))
-        # confiança final = max(orig_conf, prob*100 arredondado)
-        new_conf = max(orig_conf, int(round(score*100)))
-        o["confidence"] = new_conf
-        # Se modelo contraria (score baixo), marcar como possível FP
-        if score < 0.35 and orig_conf < 90:
-            o["type"] = o.get("type","ocorrencia") + "|possivel_fp"
-        # Se modelo reforça (alto), promover a tipo mais crítico (se aplicável)
-        if score > 0.75 and "baixo_sinal" in o.get("type",""):
-            o["type"] = "sinal_critico"
-    return occs
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+# mosaic_utils.py — v0.7d
+# Mosaico do talhão (CLI --mosaic): VARI/NGRDI/IFV de todos os frames amostrados num raster só,
+# de tamanho fixo, em vez de centenas de thumbs em resolução cheia.
+# - Registro incremental: cada frame reduzido (lado maior `edge` px) é alinhado ao anterior por
+#   correlação de fase (translação); com resposta fraca (rotação, textura pobre), ORB + RANSAC
+#   (estimateAffinePartial2D: translação, rotação e escala); sem pontos ORB suficientes (textura
+#   lisa), vale a fase se a resposta passar de track_utils.MIN_RESPONSE. Sem registro o frame fica fora do
+#   raster e a cadeia recomeça nele, na posição do anterior ("sem_registro" em mosaic.json).
+# - Acúmulo: os índices do frame reduzido são projetados (warpAffine só na bbox da pegada) em
+#   somas por célula + peso (cobertura com borda suavizada); o valor da célula é a média
+#   (soma/peso) de todos os frames que passaram por ela.
+# - Memória limitada: o raster tem `size` x `size` células. Quando o voo sai da área coberta, a
+#   grade é deslocada (passo inteiro de célula) e, se preciso, a célula dobra de lado: blocos 2x2
+#   somados (a média por célula é preservada). memmap=True mantém os acumuladores em arquivos na
+#   pasta do run (página em disco) e a reamostragem é feita por faixas de linhas.
+# - Saída (finish): mosaic.tif (float32, 3 bandas VARI/NGRDI/IFV, NaN sem cobertura, recortado na
+#   área coberta) + mosaic.tfw (world file no sistema de pixels do 1º frame registrado, em
+#   resolução cheia: troque pelos pontos de controle/GPS para georreferenciar) + mosaic.json
+#   (transformação raster -> pixels do frame de referência e pose de cada frame: pixel do frame
+#   -> pixel do raster) + mosaic_<índice>.png (prévia colorida com transparência).
+import json, os, time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+import cv2
+
+from index_utils import IndexEngine
+from track_utils import MIN_RESPONSE
+
+MOSAIC_EDGE = 320
+MOSAIC_SIZE = 1024
+MARGIN = 0.1            # folga ao recentralizar a grade (fração do lado)
+PHASE_TRUST = 0.3       # resposta da correlação de fase aceita sem conferir (translação pura ~0.8)
+ORB_FEATURES = 800
+ORB_MIN_INLIERS = 12
+STRIP_ROWS = 256        # linhas por faixa na reamostragem
+INDEX_NAMES = ("vari", "ngrdi", "ifv")
+PREVIEW_RANGES = {"vari": (-0.5, 0.5), "ngrdi": (-0.5, 0.5), "ifv": (0.2, 0.6)}  # vermelho -> amarelo -> verde
+
+def _h(m:np.ndarray)->np.ndarray:
+    """2x3 -> 3x3."""
+    return np.vstack([m, [0.0, 0.0, 1.0]])
+
+def _rdylgn()->np.ndarray:
+    """LUT 256x1x3 (BGR) vermelho -> amarelo -> verde para cv2.applyColorMap."""
+    t = np.linspace(0.0, 1.0, 256)
+    r = np.where(t < 0.5, 215, 215 - (t - 0.5) * 2 * (215 - 26))
+    g = np.where(t < 0.5, 48 + t * 2 * (255 - 48), 255 - (t - 0.5) * 2 * (255 - 150))
+    b = np.where(t < 0.5, 39 + t * 2 * (191 - 39), 191 - (t - 0.5) * 2 * (191 - 65))
+    return np.stack([b, g, r], axis=-1).astype(np.uint8).reshape(256, 1, 3)
+
+class Registrar:
+    """Movimento entre frames reduzidos consecutivos (matriz 3x3 anterior -> atual)."""
+    def __init__(self):
+        self.prev: Optional[np.ndarray] = None
+        self.prev_feat = None           # keypoints/descritores ORB do anterior (só se já calculados)
+        self._orb = None
+        self._window = None
+        self.stats = {"fase": 0, "orb": 0, "fase_fraca": 0, "falhas": 0}
+
+    def _features(self, grey:np.ndarray):
+        if self._orb is None:
+            self._orb = cv2.ORB_create(ORB_FEATURES)
+        return self._orb.detectAndCompute(grey, None)
+
+    def _orb_motion(self, prev_feat, cur_feat)->Optional[np.ndarray]:
+        (kp0, d0), (kp1, d1) = prev_feat, cur_feat
+        if d0 is None or d1 is None or len(kp0) < ORB_MIN_INLIERS or len(kp1) < ORB_MIN_INLIERS:
+            return None
+        matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(d0, d1)
+        if len(matches) < ORB_MIN_INLIERS:
+            return None
+        p0 = np.float32([kp0[m.queryIdx].pt for m in matches]); p1 = np.float32([kp1[m.trainIdx].pt for m in matches])
+        m, inl = cv2.estimateAffinePartial2D(p0, p1, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+        if m is None or inl is None or int(inl.sum()) < ORB_MIN_INLIERS:
+            return None
+        return _h(m.astype(np.float64))
+
+    def update(self, grey:np.ndarray)->Optional[np.ndarray]:
+        """Movimento do frame anterior para `grey` (conteúdo em p no anterior está em M p): identidade
+        no primeiro frame, None se não registrou. `grey` passa a ser o anterior de qualquer forma."""
+        prev, prev_feat = self.prev, self.prev_feat
+        self.prev, self.prev_feat = grey, None
+        if prev is None:
+            return np.eye(3)
+        if prev.shape != grey.shape:
+            self.stats["falhas"] += 1
+            return None
+        if self._window is None or self._window.shape != grey.shape:
+            self._window = cv2.createHanningWindow(grey.shape[::-1], cv2.CV_32F)
+        # cópias float32: o phaseCorrelate do OpenCV 5 altera as entradas
+        (dx, dy), resp = cv2.phaseCorrelate(prev.astype(np.float32), grey.astype(np.float32), self._window)
+        shift = np.array([[1.0, 0.0, dx], [0.0, 1.0, dy], [0.0, 0.0, 1.0]])
+        if resp >= PHASE_TRUST:
+            self.stats["fase"] += 1
+            return shift
+        self.prev_feat = self._features(grey)
+        m = self._orb_motion(prev_feat or self._features(prev), self.prev_feat)
+        if m is not None:
+            self.stats["orb"] += 1
+            return m
+        if resp >= MIN_RESPONSE:
+            self.stats["fase_fraca"] += 1
+            return shift
+        self.stats["falhas"] += 1
+        return None
+
+class Mosaic:
+    """Raster de índices de tamanho fixo, alimentado frame a frame (em ordem) por add() ou tap()."""
+    def __init__(self, out_dir:Path, size:int=MOSAIC_SIZE, edge:int=MOSAIC_EDGE, memmap:bool=False,
+                 precision:str="float32"):
+        self.out_dir = Path(out_dir)
+        self.size = max(64, int(size)); self.edge = max(32, int(edge))
+        self.memmap = bool(memmap)
+        self.engine = IndexEngine(precision)  # motor próprio: buffers no tamanho do frame reduzido
+        self.reg = Registrar()
+        self.cell = 1.0                 # lado da célula em pixels do frame reduzido de referência
+        self.origin = np.zeros(2)       # canto da grade (x, y) nessas mesmas unidades
+        self.bbox: Optional[List[float]] = None   # área coberta (x0, y0, x1, y1), unidades do mundo
+        self.pose = np.eye(3)           # frame reduzido atual -> mundo
+        self.scale_full = None          # pixels do frame reduzido -> pixels do frame cheio
+        self.frames: List[Tuple[int, List[float]]] = []  # (idx, pose 2x3 frame cheio -> mundo)
+        self.times: List[float] = []
+        self.stats = {"frames": 0, "sem_registro": 0, "reamostragens": 0}
+        self._gen = 0
+        self.acc = self._alloc()
+
+    # --- acumuladores ---
+
+    def _alloc(self)->np.ndarray:
+        """(4, size, size) float32: somas VARI/NGRDI/IFV + peso. Em memória ou memmap na pasta do run."""
+        shape = (4, self.size, self.size)
+        if not self.memmap:
+            return np.zeros(shape, np.float32)
+        self._gen += 1
+        path = self.out_dir / f"mosaic_acc{self._gen % 2}.dat"
+        return np.memmap(path, np.float32, mode="w+", shape=shape)  # arquivo novo = zeros
+
+    def _release(self, acc:np.ndarray):
+        if isinstance(acc, np.memmap):
+            try:
+                os.unlink(acc.filename)  # o mapeamento some junto com a última referência
+            except OSError:
+                pass
+
+    def _rebin(self, src:np.ndarray, dst:np.ndarray, ky:int, kx:int, f:int):
+        """dst[(i-ky)//f, (j-kx)//f] += src[i, j] por faixas de linhas (f = fator da célula nova)."""
+        C = self.size
+        for i0 in range(0, C, STRIP_ROWS):
+            i1 = min(C, i0 + STRIP_ROWS)
+            block = np.asarray(src[:, i0:i1])
+            if not block[3].any():
+                continue
+            r0 = i0 - ky; c0 = -kx
+            pt, pl = r0 % f, c0 % f
+            h = pt + (i1 - i0); w = pl + C
+            H = -(-h // f) * f; W = -(-w // f) * f
+            pad = np.zeros((4, H, W), np.float32)
+            pad[:, pt:pt + (i1 - i0), pl:pl + C] = block
+            small = pad.reshape(4, H // f, f, W // f, f).sum(axis=(2, 4))
+            nr, nc = (r0 - pt) // f, (c0 - pl) // f
+            y0, x0 = max(0, nr), max(0, nc)
+            y1, x1 = min(C, nr + small.shape[1]), min(C, nc + small.shape[2])
+            if y1 > y0 and x1 > x0:
+                dst[:, y0:y1, x0:x1] += small[:, y0 - nr:y1 - nr, x0 - nc:x1 - nc]
+
+    def _fit(self, fp:Tuple[float,float,float,float]):
+        """Garante que a pegada `fp` (mundo) cabe na grade: desloca e/ou dobra a célula."""
+        span = self.size * self.cell
+        x0, y0, x1, y1 = fp
+        if self.bbox is not None:
+            x0, y0 = min(x0, self.bbox[0]), min(y0, self.bbox[1]); x1, y1 = max(x1, self.bbox[2]), max(y1, self.bbox[3])
+        ox, oy = self.origin
+        if x0 >= ox and y0 >= oy and x1 <= ox + span and y1 <= oy + span:
+            return
+        f = 1
+        while max(x1 - x0, y1 - y0) > (1 - 2 * MARGIN) * self.size * self.cell * f:
+            f *= 2
+        new_cell = self.cell * f
+        # nova origem centrada na área, presa à grade antiga (deslocamento inteiro de células)
+        cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+        kx = int(np.floor((cx - self.size * new_cell / 2 - ox) / self.cell))
+        ky = int(np.floor((cy - self.size * new_cell / 2 - oy) / self.cell))
+        if self.bbox is not None:
+            dst = self._alloc()
+            self._rebin(self.acc, dst, ky, kx, f)
+            self._release(self.acc)
+            self.acc = dst
+            self.stats["reamostragens"] += 1
+        self.origin = np.array([ox + kx * self.cell, oy + ky * self.cell])
+        self.cell = new_cell
+
+    # --- frames ---
+
+    def _small(self, frame:np.ndarray)->np.ndarray:
+        h, w = frame.shape[:2]
+        s = min(1.0, self.edge / float(max(h, w)))
+        if s >= 1.0:
+            return frame
+        step = max(1, int(max(h, w) // (2 * self.edge)))  # decimação barata; INTER_AREA no resto
+        return cv2.resize(frame[::step, ::step], (max(8, int(w * s)), max(8, int(h * s))), interpolation=cv2.INTER_AREA)
+
+    def add(self, idx:int, frame:np.ndarray):
+        t = time.perf_counter()
+        small = self._small(frame)
+        if self.scale_full is None:
+            self.scale_full = frame.shape[1] / float(small.shape[1])
+        grey = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        m = self.reg.update(grey)
+        if m is None:
+            self.stats["sem_registro"] += 1  # cadeia recomeça neste frame, na pose do anterior
+        else:
+            self.pose = self.pose @ np.linalg.inv(m)
+            self._accumulate(small)
+            full = self.pose @ np.diag([1.0 / self.scale_full, 1.0 / self.scale_full, 1.0])
+            self.frames.append((int(idx), [round(float(v), 4) for v in full[:2].ravel()]))
+            self.stats["frames"] += 1
+        self.times.append(time.perf_counter() - t)
+
+    def _accumulate(self, small:np.ndarray):
+        h, w = small.shape[:2]
+        corners = (self.pose @ np.array([[0, w, w, 0], [0, 0, h, h], [1, 1, 1, 1]], np.float64))[:2]
+        fp = (corners[0].min(), corners[1].min(), corners[0].max(), corners[1].max())
+        self._fit(fp)
+        self.bbox = list(fp) if self.bbox is None else [min(self.bbox[0], fp[0]), min(self.bbox[1], fp[1]),
+                                                         max(self.bbox[2], fp[2]), max(self.bbox[3], fp[3])]
+        # frame reduzido -> células da grade
+        to_grid = np.array([[1 / self.cell, 0, -self.origin[0] / self.cell], [0, 1 / self.cell, -self.origin[1] / self.cell], [0, 0, 1]])
+        a = to_grid @ self.pose
+        vari, ngrdi, ifv, _mask = self.engine.compute(small)
+        maps = [vari, ngrdi, ifv]
+        s = float(np.sqrt(abs(np.linalg.det(a[:2, :2]))))
+        if s < 0.5:  # célula maior que o pixel: média por área antes de projetar (sem serrilhado)
+            sw, sh = max(2, int(round(w * s))), max(2, int(round(h * s)))
+            maps = [cv2.resize(np.asarray(mp, np.float32), (sw, sh), interpolation=cv2.INTER_AREA) for mp in maps]
+            a = a @ np.diag([w / float(sw), h / float(sh), 1.0])
+            h, w = sh, sw
+        gc = (a @ np.array([[0, w, w, 0], [0, 0, h, h], [1, 1, 1, 1]], np.float64))[:2]
+        x0, y0 = max(0, int(np.floor(gc[0].min()))), max(0, int(np.floor(gc[1].min())))
+        x1, y1 = min(self.size, int(np.ceil(gc[0].max())) + 1), min(self.size, int(np.ceil(gc[1].max())) + 1)
+        if x1 <= x0 or y1 <= y0:
+            return
+        m = (np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], np.float64) @ a)[:2]
+        size = (x1 - x0, y1 - y0)
+        # cobertura com borda suavizada: os índices projetados já saem multiplicados por ela na borda
+        weight = cv2.warpAffine(np.ones((h, w), np.float32), m, size, flags=cv2.INTER_LINEAR, borderValue=0)
+        roi = self.acc[:, y0:y1, x0:x1]
+        for i, mp in enumerate(maps):
+            roi[i] += cv2.warpAffine(np.asarray(mp, np.float32), m, size, flags=cv2.INTER_LINEAR, borderValue=0)
+        roi[3] += weight
+
+    def tap(self, frames:Iterable[Tuple[int,np.ndarray]])->Iterator[Tuple[int,np.ndarray]]:
+        """Repassa (idx, frame) sem alterar, acumulando cada frame no mosaico (processo principal)."""
+        for idx, frame in frames:
+            self.add(idx, frame)
+            yield idx, frame
+
+    # --- saída ---
+
+    def finish(self)->Dict[str,Any]:
+        """Grava mosaic.tif/.tfw/.json e as prévias; libera os acumuladores. Retorna o resumo."""
+        info = {"frames": self.stats["frames"], "sem_registro": self.stats["sem_registro"],
+                "reamostragens": self.stats["reamostragens"], "registro": dict(self.reg.stats)}
+        weight = np.asarray(self.acc[3])
+        ys, xs = np.nonzero(weight > 1e-3)
+        if not len(ys):
+            self._release(self.acc); self.acc = None
+            info["raster"] = None
+            self._write_json(info)
+            return info
+        r0, r1, c0, c1 = int(ys.min()), int(ys.max()) + 1, int(xs.min()), int(xs.max()) + 1
+        w = weight[r0:r1, c0:c1]
+        covered = w > 1e-3
+        bands = np.full((r1 - r0, c1 - c0, 3), np.nan, np.float32)
+        for i in range(3):
+            band = bands[..., i]
+            band[covered] = np.asarray(self.acc[i, r0:r1, c0:c1])[covered] / w[covered]
+        self._release(self.acc); self.acc = None
+        cv2.imwrite(str(self.out_dir / "mosaic.tif"), bands)
+        lut = _rdylgn()
+        alpha = (covered * 255).astype(np.uint8)
+        for i, name in enumerate(INDEX_NAMES):
+            lo, hi = PREVIEW_RANGES[name]
+            v = np.nan_to_num((bands[..., i] - lo) / (hi - lo), nan=0.0)
+            img = cv2.applyColorMap((np.clip(v, 0, 1) * 255).astype(np.uint8), lut)
+            cv2.imwrite(str(self.out_dir / f"mosaic_{name}.png"), np.dstack([img, alpha]))
+        # pixel do raster (col, lin) -> pixel do frame de referência em resolução cheia
+        px = self.cell * self.scale_full
+        x0 = (self.origin[0] + c0 * self.cell) * self.scale_full; y0 = (self.origin[1] + r0 * self.cell) * self.scale_full
+        geo = [float(x0), px, 0.0, float(y0), 0.0, px]  # ordem do GDAL (GeoTransform)
+        (self.out_dir / "mosaic.tfw").write_text("\n".join(f"{v:.6f}" for v in (px, 0.0, 0.0, px, x0 + px / 2, y0 + px / 2)) + "\n",
+                                                  encoding="utf-8")
+        to_raster = np.array([[1 / px, 0, -x0 / px], [0, 1 / px, -y0 / px], [0, 0, 1]])
+        info["raster"] = {"arquivo": "mosaic.tif", "largura": c1 - c0, "altura": r1 - r0, "bandas": list(INDEX_NAMES),
+                          "pixel_ref_px": round(px, 4), "geotransform": [round(v, 4) for v in geo],
+                          "cobertura": round(float(covered.mean()), 4), "previas": [f"mosaic_{n}.png" for n in INDEX_NAMES]}
+        ref_scale = np.diag([self.scale_full, self.scale_full, 1.0])
+        info["poses"] = [{"frame": idx, "para_raster": [round(float(v), 4) for v in (to_raster @ ref_scale @ _h(np.array(p).reshape(2, 3)))[:2].ravel()]}
+                         for idx, p in self.frames]
+        self._write_json(info)
+        return info
+
+    def _write_json(self, info:Dict[str,Any]):
+        tmp = self.out_dir / "mosaic.json.tmp"
+        tmp.write_text(json.dumps(info, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.out_dir / "mosaic.json")
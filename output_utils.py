@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+# output_utils.py — v0.7d
+# Saídas de ocorrências do CLI/API:
+# - occurrences.ndjson: uma ocorrência por linha, gravada (e descarregada) a cada frame concluído —
+#   voos longos não acumulam a lista na memória e um crash preserva o que já foi analisado.
+# - occurrences_v2.json: compatibilidade (painel/relatório/treino); montado no fim a partir do
+#   NDJSON, em streaming, com uma ocorrência por linha (sem indent=2).
+# - occurrences.npz (opcional): colunar para análise (NumPy; colunas em COLUMNS).
+# - NdjsonTail: acompanha o NDJSON enquanto o CLI escreve (stream SSE /jobs/<id>/stream).
+# Também: negociação de Content-Encoding (br/gzip) e compressão em streaming para /download.
+import json, mimetypes, os, zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+
+try:
+    import brotli  # opcional: Content-Encoding br
+except ImportError:
+    brotli = None
+
+OUTPUT_FORMATS = ("json", "ndjson", "npz")
+JSON_NAME = "occurrences_v2.json"
+NDJSON_NAME = "occurrences.ndjson"
+NPZ_NAME = "occurrences.npz"
+# coluna -> (dtype, extrator)
+COLUMNS = {
+    "frame":      (np.int64,   lambda o: o.get("frame", 0)),
+    "time_s":     (np.float64, lambda o: o.get("time_s", 0.0)),
+    "x":          (np.int32,   lambda o: o["bbox"][0]),
+    "y":          (np.int32,   lambda o: o["bbox"][1]),
+    "w":          (np.int32,   lambda o: o["bbox"][2]),
+    "h":          (np.int32,   lambda o: o["bbox"][3]),
+    "area_px":    (np.int64,   lambda o: o.get("area_px", 0)),
+    "confidence": (np.int16,   lambda o: o.get("confidence", 0)),
+    "vari":       (np.float32, lambda o: (o.get("evidence") or {}).get("vari", np.nan)),
+    "ngrdi":      (np.float32, lambda o: (o.get("evidence") or {}).get("ngrdi", np.nan)),
+    "ifv":        (np.float32, lambda o: (o.get("evidence") or {}).get("ifv", np.nan)),
+    "severity":   (np.float32, lambda o: (o.get("evidence") or {}).get("severity", np.nan)),
+    "ml_score":   (np.float32, lambda o: (o.get("ml") or {}).get("score", np.nan)),
+    "type":       (str,        lambda o: o.get("type", "")),
+    "occ_id":     (str,        lambda o: o.get("occ_id", "")),
+}
+
+mimetypes.add_type("application/x-ndjson", ".ndjson")
+
+def parse_formats(value:Optional[str])->List[str]:
+    """'ndjson,npz' -> ['json', 'ndjson', 'npz']; json sempre incluído. ValueError se desconhecido."""
+    fmts = {f.strip().lower() for f in (value or "").split(",") if f.strip()}
+    bad = fmts - set(OUTPUT_FORMATS)
+    if bad:
+        raise ValueError(f"formato de saída desconhecido: {', '.join(sorted(bad))}")
+    return [f for f in OUTPUT_FORMATS if f in fmts or f == "json"]
+
+def _line(occ:Dict[str,Any])->str:
+    return json.dumps(occ, ensure_ascii=False, separators=(",", ":"))
+
+class OccurrenceWriter:
+    """Recebe as ocorrências frame a frame (add) e grava os formatos pedidos; close() fecha o
+    NDJSON e produz occurrences_v2.json (e .npz). O NDJSON é sempre o arquivo de trabalho; sem
+    'ndjson' nos formatos ele é removido no fim. `work_name` diferente de NDJSON_NAME grava num
+    arquivo de trabalho renomeado no close() (regravação atômica pela API)."""
+    def __init__(self, out_dir:Path, formats:Iterable[str]=("json", "ndjson"), work_name:str=NDJSON_NAME):
+        self.out_dir = Path(out_dir); self.formats = list(formats)
+        self.count = 0
+        self.path = self.out_dir / work_name
+        self._f = self.path.open("w", encoding="utf-8")
+        self._cols: Optional[Dict[str,List]] = {c: [] for c in COLUMNS} if "npz" in self.formats else None
+
+    def add(self, occs:List[Dict[str,Any]]):
+        if not occs:
+            return
+        self._f.write("".join(_line(o) + "\n" for o in occs))
+        self._f.flush()  # o frame concluído fica visível para quem lê o arquivo
+        if self._cols is not None:
+            for c, (_dt, get) in COLUMNS.items():
+                self._cols[c].extend(get(o) for o in occs)
+        self.count += len(occs)
+
+    def close(self):
+        self._f.close()
+        write_json_from_ndjson(self.path, self.out_dir / JSON_NAME)
+        if self._cols is not None:
+            save_columns(self._cols, self.out_dir / NPZ_NAME)
+        if "ndjson" not in self.formats:
+            self.path.unlink(missing_ok=True)
+        elif self.path.name != NDJSON_NAME:
+            os.replace(self.path, self.out_dir / NDJSON_NAME)
+
+def write_json_from_ndjson(src:Path, dest:Path):
+    """Lista JSON com uma ocorrência por linha, sem carregar o NDJSON inteiro."""
+    tmp = dest.with_name(dest.name + ".tmp")
+    with src.open(encoding="utf-8") as f, tmp.open("w", encoding="utf-8") as out:
+        sep = "[\n"
+        for line in f:
+            line = line.rstrip("\n")
+            if line:
+                out.write(sep + line); sep = ",\n"
+        out.write("[]\n" if sep == "[\n" else "\n]\n")
+    os.replace(tmp, dest)
+
+def save_columns(cols:Dict[str,List], path:Path):
+    arrays = {}
+    for c, vals in cols.items():
+        dt = COLUMNS[c][0]
+        arrays[c] = np.array(vals, dtype=dt) if vals else np.zeros(0, "U1" if dt is str else dt)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, path)
+
+def existing_formats(out_dir:Path)->List[str]:
+    """Formatos presentes num run (para regravar os mesmos depois de um refiltro)."""
+    return ["json"] + [f for f, name in (("ndjson", NDJSON_NAME), ("npz", NPZ_NAME)) if (Path(out_dir)/name).exists()]
+
+def write_occurrences(out_dir:Path, occs:List[Dict[str,Any]], formats:Optional[Iterable[str]]=None):
+    """Regrava a lista inteira (API: pós-processamento/refiltro) nos formatos do run."""
+    w = OccurrenceWriter(out_dir, existing_formats(out_dir) if formats is None else formats,
+                         work_name=NDJSON_NAME + ".tmp")
+    w.add(occs)
+    w.close()
+
+class NdjsonTail:
+    """Linhas completas acrescentadas a um NDJSON desde `offset` (bytes). Se o arquivo for
+    substituído (regravação pela API após o modelo/refiltro), deixa de seguir: stale=True."""
+    def __init__(self, path:Path, offset:int=0):
+        self.path = Path(path); self.offset = max(0, int(offset))
+        self.ino: Optional[int] = None; self.stale = False
+
+    def read(self)->List[Tuple[int, Dict[str,Any]]]:
+        """[(offset após a linha, ocorrência)] das linhas novas; a última linha incompleta fica para depois."""
+        if self.stale:
+            return []
+        try:
+            f = self.path.open("rb")
+        except FileNotFoundError:
+            return []
+        with f:
+            ino = os.fstat(f.fileno()).st_ino
+            if self.ino is not None and ino != self.ino:
+                self.stale = True
+                return []
+            self.ino = ino
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b"\n")
+        if end < 0:
+            return []
+        out = []; pos = self.offset
+        try:
+            for line in data[:end+1].splitlines(keepends=True):
+                pos += len(line)
+                if line.strip():
+                    out.append((pos, json.loads(line)))
+        except ValueError:
+            self.stale = True  # offset no meio de uma linha (arquivo regravado antes da reconexão)
+            return out
+        self.offset = pos
+        return out
+
+# --- /download: compressão ---
+COMPRESSIBLE = {".json", ".ndjson", ".html", ".txt", ".csv", ".svg"}
+MIN_COMPRESS = 1024
+CHUNK = 1 << 16
+
+def negotiate_encoding(accept:Optional[str], path:Path)->Optional[str]:
+    """'br' ou 'gzip' se o cliente aceita e o arquivo compensa; None = servir como está."""
+    if path.suffix.lower() not in COMPRESSIBLE or path.stat().st_size < MIN_COMPRESS:
+        return None
+    accepted = {}
+    for part in (accept or "").split(","):
+        name, _, q = part.strip().partition(";")
+        try:
+            accepted[name.strip().lower()] = float(q.split("=")[1]) if "=" in q else 1.0
+        except ValueError:
+            continue
+    for enc in (("br",) if brotli is not None else ()) + ("gzip",):
+        if accepted.get(enc, accepted.get("*", 0.0)) > 0:
+            return enc
+    return None
+
+def iter_compressed(path:Path, encoding:str)->Iterator[bytes]:
+    """Lê o arquivo em blocos e devolve os bytes comprimidos (sem o arquivo inteiro na memória)."""
+    comp = brotli.Compressor(quality=5) if encoding == "br" else zlib.compressobj(6, zlib.DEFLATED, 31)
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            out = comp.process(chunk) if encoding == "br" else comp.compress(chunk)
+            if out:
+                yield out
+    yield comp.finish() if encoding == "br" else comp.flush()
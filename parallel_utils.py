@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# parallel_utils.py — v0.7d
+# Pipeline multi-processo do CLI: o processo principal decodifica (FrameSampler) e copia
+# cada frame amostrado para um slot de um anel em memória compartilhada; um pool de
+# workers analisa os slots e os resultados voltam na ordem dos frames.
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import get_context, shared_memory
+from typing import Any, Callable, Dict, Iterable, Iterator, Tuple
+import numpy as np
+import cv2
+
+# Estado por worker (preenchido no initializer)
+_W: Dict[str, Any] = {}
+
+def _init_worker(shm_name:str, shape:Tuple[int,...], fn:Callable, kwargs:Dict[str,Any]):
+    cv2.setNumThreads(1)  # paralelismo vem dos processos; evita oversubscription
+    shm = shared_memory.SharedMemory(name=shm_name)
+    n_slots = shm.size // int(np.prod(shape))
+    _W.update(shm=shm, ring=np.ndarray((n_slots,)+tuple(shape), dtype=np.uint8, buffer=shm.buf), fn=fn, kwargs=kwargs)
+
+def _run_slot(slot:int, idx:int):
+    return _W["fn"](_W["ring"][slot], idx, **_W["kwargs"])
+
+def _run_frame(frame:np.ndarray, idx:int):
+    # frame fora do formato do anel (resolução variável): vai por pickle
+    return _W["fn"](frame, idx, **_W["kwargs"])
+
+def run_parallel(frames:Iterable[Tuple[int,np.ndarray]], shape:Tuple[int,...], fn:Callable,
+                 kwargs:Dict[str,Any], workers:int, slots_per_worker:int=2)->Iterator[Tuple[int,Any]]:
+    """Aplica fn(frame, idx, **kwargs) em paralelo e gera (idx, resultado) na ordem de entrada.
+
+    fn precisa ser importável no nível de módulo (start method "spawn"). O anel tem
+    workers*slots_per_worker slots: o decodificador bloqueia quando todos estão ocupados,
+    limitando a memória a esse número de frames."""
+    workers = max(1, int(workers))
+    n_slots = workers * max(1, int(slots_per_worker))
+    nbytes = int(np.prod(shape))
+    shm = shared_memory.SharedMemory(create=True, size=max(1, nbytes * n_slots))
+    ring = None
+    try:
+        ring = np.ndarray((n_slots,)+tuple(shape), dtype=np.uint8, buffer=shm.buf)
+        free = list(range(n_slots))
+        order = deque()   # futures na ordem dos frames
+        slot_of = {}      # future -> slot em uso
+        ctx = get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(shm.name, tuple(shape), fn, kwargs)) as ex:
+            def release(done):
+                for fut in done:
+                    slot = slot_of.pop(fut, None)
+                    if slot is not None:
+                        free.append(slot)
+
+            for idx, frame in frames:
+                if frame.shape != tuple(shape) or frame.dtype != np.uint8:
+                    fut = ex.submit(_run_frame, frame, idx)
+                else:
+                    while not free:
+                        done, _ = wait(list(slot_of), return_when=FIRST_COMPLETED)
+                        release(done)
+                    slot = free.pop()
+                    np.copyto(ring[slot], frame)
+                    fut = ex.submit(_run_slot, slot, idx)
+                    slot_of[fut] = slot
+                order.append((idx, fut))
+                # entrega o prefixo já concluído, mantendo a ordem dos frames
+                while order and order[0][1].done():
+                    i, f = order.popleft()
+                    release([f])
+                    yield i, f.result()
+            while order:
+                i, f = order.popleft()
+                res = f.result()
+                release([f])
+                yield i, res
+    finally:
+        ring = None  # solta a view antes de fechar o segmento
+        shm.close()
+        shm.unlink()
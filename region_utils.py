@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# region_utils.py — v0.7d
+# Estatísticas por região em um passo vetorizado: connectedComponentsWithStats dá
+# área/bbox de todas as manchas; as médias dos índices vêm de imagens integrais
+# (média na bbox) ou de np.bincount ponderado (média exata só nos pixels da mancha).
+# O custo é O(pixels) por frame, independente do número de manchas candidatas.
+from typing import Dict
+import numpy as np
+import cv2
+
+def severity(mV, mN, mF):
+    """Severidade heurística a partir das médias de VARI/NGRDI/IFV (escalares ou arrays)."""
+    return (np.maximum(0.0, (0.15 - mV)*4) + np.maximum(0.0, (0.12 - mN)*3)
+            + np.maximum(0.0, (0.40 - mF)*2))
+
+def _bbox_means(img:np.ndarray, x, y, w, h)->np.ndarray:
+    ii = cv2.integral(np.ascontiguousarray(img, dtype=np.float32), sdepth=cv2.CV_64F)
+    s = ii[y+h, x+w] - ii[y, x+w] - ii[y+h, x] + ii[y, x]
+    return s / np.maximum(1, w*h)
+
+def _masked_means(img:np.ndarray, labels:np.ndarray, n:int, area:np.ndarray)->np.ndarray:
+    s = np.bincount(labels.ravel(), weights=img.ravel(), minlength=n)[1:n]
+    return s / np.maximum(1, area)
+
+def region_stats(mask:np.ndarray, vari:np.ndarray, ngrdi:np.ndarray, ifv:np.ndarray,
+                 exact:bool=False, connectivity:int=8)->Dict[str,np.ndarray]:
+    """Rotula a máscara (uint8 0/255) e retorna colunas por região (fundo excluído):
+    x, y, w, h, area (px), vari, ngrdi, ifv, severity, além de "labels" (imagem de rótulos,
+    região i -> rótulo i+1). exact=False: médias na bbox (como o CLI fazia); exact=True:
+    médias só nos pixels da mancha."""
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=connectivity, ltype=cv2.CV_32S)
+    st = stats[1:]
+    x, y = st[:, cv2.CC_STAT_LEFT], st[:, cv2.CC_STAT_TOP]
+    w, h = st[:, cv2.CC_STAT_WIDTH], st[:, cv2.CC_STAT_HEIGHT]
+    area = st[:, cv2.CC_STAT_AREA]
+    if n <= 1:
+        means = [np.zeros(0)] * 3
+    elif exact:
+        means = [_masked_means(img, labels, n, area) for img in (vari, ngrdi, ifv)]
+    else:
+        means = [_bbox_means(img, x, y, w, h) for img in (vari, ngrdi, ifv)]
+    return {"labels": labels, "x": x, "y": y, "w": w, "h": h, "area": area,
+            "vari": means[0], "ngrdi": means[1], "ifv": means[2],
+            "severity": severity(means[0], means[1], means[2])}
+
+def contours_of(labels:np.ndarray, keep:np.ndarray):
+    """Contornos externos apenas das regiões selecionadas (keep: bool por região)."""
+    if not keep.any():
+        return []
+    lut = np.concatenate([[0], keep.astype(np.uint8) * 255]).astype(np.uint8)
+    cnts, _ = cv2.findContours(lut[labels], cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return cnts
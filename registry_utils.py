@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# registry_utils.py — v0.7d
+# Registro de modelos da API: versões em runs/_models/model_v####.joblib + registry.json, com a
+# versão ativa espelhada em runs/model.joblib (o caminho que o CLI e a API v07b leem).
+# - publish(): grava a versão nova num .tmp e renomeia (os.replace); a troca da ativa é feita do
+#   mesmo jeito — quem lê model.joblib nunca vê um joblib pela metade.
+# - get(): modelo em memória. Cada chamada só faz um stat() de model.joblib; o joblib.load roda
+#   de novo apenas quando o arquivo ativo mudou (inode/mtime/tamanho: nova versão, rollback ou
+#   escrita externa). A troca do modelo carregado é uma atribuição única sob lock.
+# - rollback(): reativa uma versão anterior (padrão: a imediatamente anterior à ativa).
+# - Cada versão logística também é exportada em coeficientes (model_v####.npz ->
+#   runs/model.npz, scorer_utils.LinearScorer): o CLI (--model) pontua sem sklearn/joblib.
+# Mantém as últimas `keep` versões; a ativa nunca é apagada.
+import json, os, shutil, threading, time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from model_utils import joblib
+from scorer_utils import LinearScorer
+
+def atomic_dump(obj:Any, path:Path):
+    """joblib.dump em path.tmp + os.replace."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    joblib.dump(obj, tmp)
+    os.replace(tmp, path)
+
+def _atomic_copy(src:Path, dst:Path):
+    tmp = dst.with_name(dst.name + ".tmp")
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+class ModelRegistry:
+    def __init__(self, models_dir:Path, active_path:Path, keep:int=10):
+        self.dir = Path(models_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.active_path = Path(active_path)
+        self.scorer_path = self.active_path.with_suffix(".npz")
+        self.reg_path = self.dir / "registry.json"
+        self.keep = max(1, int(keep))
+        self._lock = threading.Lock()     # carga/troca do modelo em memória
+        self._wlock = threading.Lock()    # publish/rollback (registry.json + arquivos)
+        # (assinatura do arquivo ativo, modelo, metadados da carga)
+        self._loaded: Tuple[Optional[tuple], Any, Dict[str,Any]] = (None, None, {})
+        self.reloads = 0
+        if not self.reg_path.exists() and self.active_path.exists() and joblib is not None:
+            self._import_active()
+
+    # --- registry.json ---
+    def _read(self)->Dict[str,Any]:
+        try:
+            return json.loads(self.reg_path.read_text(encoding="utf-8"))
+        except Exception:
+            return {"active": None, "next": 1, "versions": []}
+
+    def _write(self, reg:Dict[str,Any]):
+        tmp = self.reg_path.with_name(self.reg_path.name + ".tmp")
+        tmp.write_text(json.dumps(reg, indent=2), encoding="utf-8")
+        os.replace(tmp, self.reg_path)
+
+    def _import_active(self):
+        """model.joblib anterior ao registro vira a versão 1."""
+        try:
+            obj = joblib.load(self.active_path)
+        except Exception:
+            return
+        if isinstance(obj, dict) and obj.get("model") is not None:
+            self.publish({k: v for k, v in obj.items() if k not in ("version", "n", "pos_frac", "trained_at")},
+                         {"n": obj.get("n"), "pos_frac": obj.get("pos_frac"), "imported": True})
+
+    # --- escrita ---
+    def publish(self, bundle:Dict[str,Any], info:Optional[Dict[str,Any]]=None)->int:
+        """Grava `bundle` ({"model", "features"}) como nova versão e a ativa. Retorna o nº da versão."""
+        info = dict(info or {})
+        with self._wlock:
+            reg = self._read()
+            version = int(reg["next"])
+            path = self.dir / f"model_v{version:04d}.joblib"
+            meta = {"version": version, "trained_at": time.time(), **info}
+            atomic_dump({**bundle, **meta}, path)
+            ent = {**meta, "file": path.name}
+            try:
+                LinearScorer.from_model(bundle["model"], version).save(path.with_suffix(".npz"))
+                ent["scorer"] = path.with_suffix(".npz").name
+            except ValueError:
+                pass  # modelo sem coeficientes lineares: só o joblib
+            reg["versions"].append(ent)
+            reg["next"] = version + 1
+            self._activate(reg, version)
+            self._prune(reg)
+            self._write(reg)
+        return version
+
+    def _activate(self, reg:Dict[str,Any], version:int):
+        ent = next((v for v in reg["versions"] if v["version"] == version), None)
+        if ent is None or not (self.dir / ent["file"]).exists():
+            raise KeyError(version)
+        if ent.get("scorer") and (self.dir / ent["scorer"]).exists():
+            _atomic_copy(self.dir / ent["scorer"], self.scorer_path)
+        else:
+            self.scorer_path.unlink(missing_ok=True)  # nunca um .npz de outra versão
+        _atomic_copy(self.dir / ent["file"], self.active_path)
+        reg["active"] = version
+
+    def _prune(self, reg:Dict[str,Any]):
+        extra = len(reg["versions"]) - self.keep
+        if extra <= 0:
+            return
+        old = [v for v in reg["versions"] if v["version"] != reg["active"]][:extra]
+        for ent in old:
+            (self.dir / ent["file"]).unlink(missing_ok=True)
+            if ent.get("scorer"):
+                (self.dir / ent["scorer"]).unlink(missing_ok=True)
+        gone = {v["version"] for v in old}
+        reg["versions"] = [v for v in reg["versions"] if v["version"] not in gone]
+
+    def rollback(self, version:Optional[int]=None)->Dict[str,Any]:
+        """Reativa `version` (padrão: a anterior à ativa). KeyError se não existir."""
+        with self._wlock:
+            reg = self._read()
+            if version is None:
+                prev = [v["version"] for v in reg["versions"] if reg["active"] is None or v["version"] < reg["active"]]
+                if not prev:
+                    raise KeyError("sem versão anterior")
+                version = max(prev)
+            self._activate(reg, int(version))
+            self._write(reg)
+        self.get()
+        return self.info()
+
+    # --- leitura ---
+    def _signature(self)->Optional[tuple]:
+        try:
+            st = os.stat(self.active_path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def get(self):
+        """Modelo ativo (ou None). Recarrega só se model.joblib mudou desde a última carga."""
+        sig = self._signature()
+        loaded = self._loaded
+        if sig == loaded[0]:
+            return loaded[1]
+        with self._lock:
+            if sig != self._loaded[0]:
+                self._loaded = self._load(sig)
+            return self._loaded[1]
+
+    def _load(self, sig:Optional[tuple]):
+        if sig is None or joblib is None:
+            return (sig, None, {})
+        t0 = time.perf_counter()
+        try:
+            obj = joblib.load(self.active_path)
+        except Exception as e:
+            # arquivo trocado por fora no meio da leitura: tenta de novo na próxima chamada
+            return (None, self._loaded[1], {**self._loaded[2], "load_error": str(e)})
+        self.reloads += 1
+        meta = {k: obj.get(k) for k in ("version", "n", "pos_frac", "trained_at", "features")}
+        meta.update(load_ms=round((time.perf_counter() - t0) * 1000, 2), loaded_at=time.time())
+        return (sig, obj.get("model"), meta)
+
+    def meta(self)->Dict[str,Any]:
+        self.get()
+        return dict(self._loaded[2])
+
+    def tag(self)->Optional[Any]:
+        """Identificador da versão ativa (chave de cache): nº da versão ou, para um
+        model.joblib gravado por fora do registro, o mtime."""
+        self.get()
+        sig, _model, meta = self._loaded
+        return meta.get("version") or (sig[1] if sig else None)
+
+    def scorer_for_cli(self)->Optional[Path]:
+        """runs/model.npz se corresponde à versão ativa (senão a API pontua no pós-processamento)."""
+        version = self.meta().get("version")
+        if version is None or not self.scorer_path.exists():
+            return None
+        try:
+            return self.scorer_path if LinearScorer.load(self.scorer_path).version == version else None
+        except Exception:
+            return None
+
+    def versions(self)->List[Dict[str,Any]]:
+        reg = self._read()
+        return [{**v, "active": v["version"] == reg["active"]} for v in reg["versions"]]
+
+    def info(self)->Dict[str,Any]:
+        meta = self.meta()
+        meta.pop("features", None)
+        return {**meta, "reloads": self.reloads, "versions": [v["version"] for v in self._read()["versions"]]}
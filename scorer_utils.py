@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# scorer_utils.py — v0.7d
+# Inferência do modelo leve só com NumPy (sem sklearn/joblib no import):
+# - feature_matrix(): matriz de features de um lote de ocorrências (colunas de model_utils.FEATURES).
+# - LinearScorer: a regressão logística exportada em coeficientes (runs/model.npz); predict_proba
+#   é um produto escalar + sigmoide, com a mesma interface do modelo do sklearn.
+# - apply_model(): score + ajuste de confiança/tipo sobre o lote inteiro (usado pela API e pelo CLI --model).
+# model_utils reexporta FEATURES/occ_features/apply_model daqui.
+import json, os
+from pathlib import Path
+from typing import Any, Dict, List, Union
+import numpy as np
+
+FEATURES = ["vari","ngrdi","ifv","zmin","roi_ratio","near_veg_ratio","area_px","aspect"]
+# (chave em evidence, valor padrão) das 6 primeiras features
+_EVIDENCE = (("vari", 0.0), ("ngrdi", 0.0), ("ifv", 0.0), ("zmin", 0.0), ("roi_ratio", 1.0), ("near_veg_ratio", 0.0))
+
+def _occ_aspect(occ:Dict[str,Any])->float:
+    try:
+        x,y,w,h = occ.get("bbox")[:4]
+        return float(w)/float(h) if h else 1.0
+    except Exception:
+        return 1.0
+
+def occ_features(occ:Dict[str,Any])->List[float]:
+    ev = occ.get("evidence",{}) or {}
+    vals = [ev.get(k, d) for k, d in _EVIDENCE] + [float(occ.get("area_px",0)), _occ_aspect(occ)]
+    # normalização simples de área (log1p) para escala comparável
+    vals[6] = float(np.log1p(max(0.0, vals[6])))
+    return [float(v) for v in vals]
+
+def feature_matrix(occs:List[Dict[str,Any]])->np.ndarray:
+    """Features de todas as ocorrências (n x len(FEATURES), float32); mesmas linhas que occ_features()."""
+    X = np.empty((len(occs), len(FEATURES)), np.float64)
+    evs = [o.get("evidence",{}) or {} for o in occs]
+    for j, (k, d) in enumerate(_EVIDENCE):
+        X[:, j] = [e.get(k, d) for e in evs]
+    X[:, 6] = np.log1p(np.maximum(0.0, [float(o.get("area_px",0)) for o in occs]))
+    X[:, 7] = [_occ_aspect(o) for o in occs]
+    return X.astype(np.float32)
+
+class LinearScorer:
+    """predict_proba de uma regressão logística binária (coef_/intercept_ do sklearn) em NumPy.
+    Calcula no dtype dos coeficientes (float32 quando o ajuste foi em float32, como no sklearn)."""
+    def __init__(self, coef, intercept, features:List[str]=FEATURES, version:Any=None):
+        self.coef = np.asarray(coef).ravel()
+        self.intercept = np.asarray(intercept, self.coef.dtype).reshape(())
+        self.features = list(features)
+        self.version = version
+        if self.features != FEATURES or self.coef.shape != (len(FEATURES),):
+            raise ValueError("modelo com features diferentes de FEATURES")
+
+    @classmethod
+    def from_model(cls, model, version:Any=None)->"LinearScorer":
+        if getattr(model, "coef_", None) is None or len(getattr(model, "classes_", ())) != 2:
+            raise ValueError("modelo não é uma regressão logística binária")
+        return cls(model.coef_[0], model.intercept_[0], FEATURES, version)
+
+    def predict_proba(self, X:np.ndarray)->np.ndarray:
+        z = np.asarray(X, self.coef.dtype) @ self.coef + self.intercept
+        p = 1 / (1 + np.exp(-z))
+        return np.column_stack([1 - p, p])
+
+    def save(self, path:Path):
+        """Grava .npz (coef, intercept, meta) via tmp + rename."""
+        tmp = path.with_name(path.name + ".tmp")
+        with tmp.open("wb") as f:
+            np.savez(f, coef=self.coef, intercept=self.intercept,
+                     meta=np.array(json.dumps({"features": self.features, "version": self.version})))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path:Path)->"LinearScorer":
+        with np.load(path, allow_pickle=False) as z:
+            meta = json.loads(str(z["meta"]))
+            return cls(z["coef"], z["intercept"], meta["features"], meta.get("version"))
+
+_LAST: Dict[str,Any] = {}  # último modelo carregado no processo (lote / workers quentes da API)
+
+def load_scorer(path:Union[str,Path]):
+    """Modelo para --model: .npz (LinearScorer) ou .joblib (joblib importado só aqui;
+    regressão logística vira LinearScorer). Levanta IOError se não carregar.
+    O mesmo arquivo (caminho + mtime + tamanho) não é relido: vários vídeos no mesmo processo
+    compartilham o modelo carregado."""
+    path = Path(path)
+    try:
+        st = path.stat()
+        key = (str(path.resolve()), st.st_mtime_ns, st.st_size)
+    except OSError:
+        key = None
+    if key is not None and _LAST.get("key") == key:
+        return _LAST["model"]
+    scorer = _load_scorer(path)
+    _LAST.update(key=key, model=scorer)
+    return scorer
+
+def _load_scorer(path:Path):
+    try:
+        if path.suffix == ".npz":
+            return LinearScorer.load(path)
+        from model_utils import load_model
+        model = load_model(path)
+    except Exception as e:
+        raise IOError(f"modelo não carregou ({path.name}): {e}")
+    if model is None:
+        raise IOError(f"modelo não carregou ({path.name})")
+    try:
+        return LinearScorer.from_model(model)
+    except ValueError:
+        return model
+
+def apply_model(model, occs:List[Dict[str,Any]], boost:bool=True)->List[Dict[str,Any]]:
+    """Aplica o modelo e, se boost=True, ajusta confiança e tipo final por cima das regras.
+    Uma chamada de predict_proba para o lote; as decisões são vetorizadas."""
+    if model is None or not occs:
+        return occs
+    proba = model.predict_proba(feature_matrix(occs))[:,1]  # prob de 'confirmado'
+    # confiança final = max(orig_conf, prob*100 arredondado)
+    orig = np.array([int(o.get("confidence", 70)) for o in occs])
+    conf = np.maximum(orig, np.rint(proba*100).astype(int))
+    # modelo contraria (score baixo) -> possível FP; reforça (alto) -> tipo mais crítico
+    fp = (proba < 0.35) & (orig < 90)
+    crit = proba > 0.75
+    for o, score, c, is_fp, is_crit in zip(occs, proba.tolist(), conf.tolist(), fp.tolist(), crit.tolist()):
+        o.setdefault("ml", {})["score"] = round(score,3)
+        if not boost:
+            continue
+        o["confidence"] = c
+        if is_fp:
+            o["type"] = o.get("type","ocorrencia") + "|possivel_fp"
+        elif is_crit and "baixo_sinal" in o.get("type",""):
+            o["type"] = "sinal_critico"
+    return occs
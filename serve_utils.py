@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# serve_utils.py — v0.7d
+# Entrega dos artefatos de runs/ pelo /download:
+# - ETag forte (inode + mtime_ns + tamanho: todo artefato é regravado via tmp + rename, então
+#   conteúdo novo = inode novo) e Last-Modified; If-None-Match / If-Modified-Since -> 304.
+#   Variantes comprimidas (br/gzip, output_utils) têm ETag próprio.
+# - Cache-Control: "immutable" para arquivos de runs concluídos que não mudam mais (thumbs,
+#   vídeo, relatório...); "no-cache" (revalida pelo ETag) para os que /rethreshold, /train ou o
+#   modelo regravam e para runs em andamento.
+# - Range (bytes=a-b, bytes=a-, bytes=-n; If-Range) para o vídeo de origem e qualquer arquivo
+#   servido sem compressão; várias faixas -> resposta inteira (200), como permite a RFC 9110.
+# - Listagem de diretório em cache pelo mtime do diretório.
+# - iter_tar(): pacote .tar em streaming (thumbs do run numa requisição só).
+import html, io, os, tarfile, threading
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+CHUNK = 1 << 16
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# regravados depois do fim do run (refiltro, pós-processamento do modelo, rótulos, logs)
+MUTABLE_NAMES = {"occurrences_v2.json", "occurrences.json", "occurrences.ndjson", "occurrences.npz",
+                 "labels.csv", "error.txt", "progress.json", "input.json"}
+
+def etag_of(st:os.stat_result, variant:str="")->str:
+    tag = f"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"
+    return f'"{tag}-{variant}"' if variant else f'"{tag}"'
+
+def cache_control(rel_path:str, finished:bool)->str:
+    return IMMUTABLE if finished and Path(rel_path).name not in MUTABLE_NAMES else REVALIDATE
+
+def validators(st:os.stat_result, variant:str="", cache:str=REVALIDATE)->Dict[str,str]:
+    return {"ETag": etag_of(st, variant), "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+            "Cache-Control": cache}
+
+def _etags(value:str)->List[str]:
+    return [t.strip().removeprefix("W/") for t in value.split(",") if t.strip()]
+
+def not_modified(headers, st:os.stat_result, variant:str="")->bool:
+    """If-None-Match (tem prioridade) ou If-Modified-Since."""
+    inm = headers.get("if-none-match")
+    if inm is not None:
+        tags = _etags(inm)
+        return "*" in tags or etag_of(st, variant) in tags
+    ims = headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(st.st_mtime) <= int(parsedate_to_datetime(ims).timestamp())
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def parse_range(value:Optional[str], size:int)->Optional[Tuple[int,int]]:
+    """(início, fim inclusivo) de um Range de uma faixa; None = ignorar (sem Range ou várias faixas).
+    ValueError = faixa não satisfazível (416)."""
+    if not value or not value.startswith("bytes=") or "," in value:
+        return None
+    first, _, last = value[6:].strip().partition("-")
+    try:
+        if first == "":
+            n = int(last)
+            if n <= 0:
+                raise ValueError(value)
+            start, end = max(0, size - n), size - 1
+        else:
+            start = int(first); end = int(last) if last else size - 1
+    except ValueError:
+        raise ValueError(value)
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise ValueError(value)
+    return start, end
+
+def if_range_ok(headers, st:os.stat_result)->bool:
+    """If-Range: a faixa só vale se o arquivo ainda é o mesmo (ETag ou data)."""
+    ir = headers.get("if-range")
+    if not ir:
+        return True
+    if ir.startswith('"') or ir.startswith("W/"):
+        return ir == etag_of(st)
+    try:
+        return int(st.st_mtime) <= int(parsedate_to_datetime(ir).timestamp())
+    except (TypeError, ValueError):
+        return False
+
+def iter_file_range(path:Path, start:int, end:int)->Iterator[bytes]:
+    with path.open("rb") as f:
+        f.seek(start)
+        left = end - start + 1
+        while left > 0:
+            chunk = f.read(min(CHUNK, left))
+            if not chunk:
+                break
+            left -= len(chunk)
+            yield chunk
+
+_LISTINGS: Dict[str, Tuple[int, str]] = {}
+_LISTINGS_LOCK = threading.Lock()
+MAX_LISTINGS = 256
+
+def dir_listing(base:Path, target:Path, url_prefix:str)->str:
+    """HTML da listagem de target; refeito só quando o mtime do diretório muda."""
+    mtime = target.stat().st_mtime_ns
+    key = str(target)
+    with _LISTINGS_LOCK:
+        hit = _LISTINGS.get(key)
+        if hit and hit[0] == mtime:
+            return hit[1]
+    with os.scandir(target) as it:
+        names = sorted(e.name for e in it)
+    rel = target.relative_to(base).as_posix()
+    prefix = f"{url_prefix}/{rel}/" if rel != "." else f"{url_prefix}/"
+    body = "<ul>" + "\n".join(f"<li><a href='{prefix}{html.escape(n)}'>{html.escape(n)}</a></li>" for n in names) + "</ul>"
+    with _LISTINGS_LOCK:
+        if len(_LISTINGS) >= MAX_LISTINGS:
+            _LISTINGS.pop(next(iter(_LISTINGS)))
+        _LISTINGS[key] = (mtime, body)
+    return body
+
+class _Sink(io.RawIOBase):
+    def __init__(self):
+        self.parts: List[bytes] = []
+    def writable(self):
+        return True
+    def write(self, b):
+        self.parts.append(bytes(b)); return len(b)
+    def drain(self)->bytes:
+        out = b"".join(self.parts); self.parts.clear(); return out
+
+def iter_tar(files:Iterable[Tuple[Path,str]])->Iterator[bytes]:
+    """Tar (sem compressão: thumbs já são jpg/png/webp) gerado em streaming de (caminho, nome no pacote)."""
+    sink = _Sink()
+    with tarfile.open(fileobj=sink, mode="w|", format=tarfile.PAX_FORMAT) as tf:
+        for path, arcname in files:
+            try:
+                tf.add(str(path), arcname=arcname, recursive=False)
+            except OSError:
+                continue  # sumiu entre a listagem e a leitura
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data
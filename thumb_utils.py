@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# thumb_utils.py — v0.7d
+# Gravação de thumbs do CLI: codificação em threads de fundo (cv2.imencode libera o GIL)
+# com fila limitada — submit() bloqueia quando a fila enche (backpressure) em vez de
+# acumular frames 4K na memória. Formato/qualidade, redução por lado máximo, "só frames
+# com ocorrência" e overlay como camada de contornos (PNG transparente) são configuráveis.
+#
+# thumbs/manifest.json descreve o formato para o painel/relatório:
+#   {"ext": ".jpg", "overlay": "full"|"layer", "max_edge": 0}
+#
+# Sprite (build_sprites): os overlays dos frames com ocorrência recortados no tamanho do card
+# (SPRITE_CELL) e colados em folhas JPEG (thumbs/sprite_<p>.jpg) + thumbs/sprite.json
+#   {"cell": [w, h], "cols": C, "pages": [...], "frames": {"<frame>": [página, x, y]}}
+# — o relatório/painel carrega os cards com 1–2 imagens em vez de uma por ocorrência.
+import json, math, os, shutil, threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+import cv2
+
+THUMB_FORMATS = {
+    "png":  (".png",  cv2.IMWRITE_PNG_COMPRESSION),
+    "jpg":  (".jpg",  cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+OVERLAY_MODES = ("full", "layer")
+OVERLAY_COLOR = (0, 0, 255)
+SPRITE_CELL = (220, 110)      # tamanho do card (.thumb/.thumbbox) no relatório e no painel
+SPRITE_COLS = 16
+SPRITE_PER_PAGE = 1024        # 16 x 64 células = 3520 x 7040 px por folha
+SPRITE_QUALITY = 80
+
+def thumb_frame(occ:dict)->int:
+    """Frame cujas thumbs mostram a ocorrência (o frame fonte, se ela foi reaproveitada de um frame parado)."""
+    return int(occ.get("reused_from", occ["frame"]))
+
+def _encode_params(fmt:str, quality:int)->List[int]:
+    ext, flag = THUMB_FORMATS[fmt]
+    if fmt == "png":
+        return []  # padrão do OpenCV; qualidade não se aplica a PNG
+    return [flag, int(max(1, min(100, quality)))]
+
+class ThumbWriter:
+    """Grava frame{idx}<ext> e frame{idx}_overlay<ext|.png> em thumbs_dir.
+
+    threads=0 grava de forma síncrona (usado nos workers de --workers, que já paralelizam).
+    O objeto é picklável: o pool de threads é criado sob demanda em cada processo."""
+    def __init__(self, thumbs_dir:Path, fmt:str="png", quality:int=90, max_edge:int=0,
+                 only_occ:bool=False, overlay:str="full", threads:int=2, queue:int=8):
+        if fmt not in THUMB_FORMATS:
+            raise ValueError(f"formato de thumb inválido: {fmt}")
+        if overlay not in OVERLAY_MODES:
+            raise ValueError(f"modo de overlay inválido: {overlay}")
+        self.thumbs_dir = Path(thumbs_dir)
+        self.fmt = fmt; self.ext = THUMB_FORMATS[fmt][0]
+        self.params = _encode_params(fmt, quality)
+        self.max_edge = int(max_edge or 0)
+        self.only_occ = bool(only_occ)
+        self.overlay = overlay
+        self.threads = max(0, int(threads)); self.queue = max(1, int(queue))
+        self._pool = None; self._slots = None; self._errors = []
+
+    def __getstate__(self):
+        st = self.__dict__.copy()
+        st["_pool"] = None; st["_slots"] = None; st["_errors"] = []
+        return st
+
+    def manifest(self)->dict:
+        return {"ext": self.ext, "overlay": self.overlay, "max_edge": self.max_edge}
+
+    def write_manifest(self):
+        """manifest.json já no início do run: o painel monta os nomes das thumbs durante o stream."""
+        (self.thumbs_dir/"manifest.json").write_text(json.dumps(self.manifest()), encoding="utf-8")
+
+    def _scale(self, shape)->float:
+        h, w = shape[:2]
+        m = max(h, w)
+        return self.max_edge / float(m) if self.max_edge and m > self.max_edge else 1.0
+
+    def submit(self, idx:int, frame:np.ndarray, contours:Optional[list]=None, has_occ:bool=False):
+        """Agenda as thumbs do frame. contours: contornos já na escala do frame (podem ser vazios)."""
+        if self.only_occ and not has_occ:
+            return
+        s = self._scale(frame.shape)
+        if s < 1.0:
+            small = cv2.resize(frame, (max(1, int(frame.shape[1]*s)), max(1, int(frame.shape[0]*s))), interpolation=cv2.INTER_AREA)
+            cnts = [(c.astype(np.float32) * s).astype(np.int32) for c in (contours or [])]
+        else:
+            small = frame.copy() if self.threads else frame  # o frame pode ser reutilizado (anel/decoder)
+            cnts = list(contours or [])
+        if self.threads == 0:
+            self._write(idx, small, cnts)
+            return
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="thumbs")
+            self._slots = threading.BoundedSemaphore(self.threads + self.queue)
+        self._slots.acquire()  # backpressure: espera vaga na fila
+        fut = self._pool.submit(self._write, idx, small, cnts)
+        fut.add_done_callback(self._done)
+
+    def _done(self, fut):
+        self._slots.release()
+        if fut.exception() is not None:
+            self._errors.append(fut.exception())
+
+    def _imwrite(self, path:Path, img:np.ndarray, params:List[int]):
+        ok, buf = cv2.imencode(path.suffix, img, params)
+        if not ok:
+            raise IOError(f"falha ao codificar {path.name}")
+        path.write_bytes(buf.tobytes())
+
+    def _write(self, idx:int, img:np.ndarray, cnts:list):
+        fpath = self.thumbs_dir / f"frame{idx}{self.ext}"
+        self._imwrite(fpath, img, self.params)
+        if self.overlay == "layer":
+            # camada de contornos: PNG BGRA transparente, sobreposto ao frame pelo painel
+            layer = np.zeros(img.shape[:2] + (4,), np.uint8)
+            if cnts:
+                cv2.drawContours(layer, cnts, -1, OVERLAY_COLOR + (255,), 2)
+            self._imwrite(self.thumbs_dir / f"frame{idx}_overlay.png", layer, _encode_params("png", 0))
+            return
+        opath = self.thumbs_dir / f"frame{idx}_overlay{self.ext}"
+        if not cnts:
+            # overlay idêntico ao frame: link/cópia do arquivo, sem codificar de novo
+            try:
+                if opath.exists(): opath.unlink()
+                os.link(fpath, opath)
+            except OSError:
+                shutil.copyfile(fpath, opath)
+            return
+        ov = img.copy()
+        cv2.drawContours(ov, cnts, -1, OVERLAY_COLOR, 2)
+        self._imwrite(opath, ov, self.params)
+
+    def close(self, write_manifest:bool=True):
+        """Espera a fila esvaziar; levanta o primeiro erro de gravação, se houver."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        if write_manifest:
+            self.write_manifest()
+        if self._errors:
+            raise self._errors[0]
+
+def _cover(img:np.ndarray, w:int, h:int)->np.ndarray:
+    """Redimensiona cobrindo w x h e corta o centro (object-fit: cover)."""
+    ih, iw = img.shape[:2]
+    s = max(w/iw, h/ih)
+    r = cv2.resize(img, (max(w, int(round(iw*s))), max(h, int(round(ih*s)))), interpolation=cv2.INTER_AREA)
+    y0 = (r.shape[0]-h)//2; x0 = (r.shape[1]-w)//2
+    return r[y0:y0+h, x0:x0+w]
+
+def _imread(path:Path, flags:int=cv2.IMREAD_COLOR)->Optional[np.ndarray]:
+    return cv2.imread(str(path), flags) if path.exists() else None
+
+def _card_image(thumbs_dir:Path, frame:int, man:dict)->Optional[np.ndarray]:
+    ext = man.get("ext", ".png")
+    base = _imread(thumbs_dir/f"frame{frame}{ext}")
+    if man.get("overlay") == "layer":
+        layer = _imread(thumbs_dir/f"frame{frame}_overlay.png", cv2.IMREAD_UNCHANGED)
+        if base is None or layer is None or layer.ndim != 3 or layer.shape[2] != 4 or layer.shape[:2] != base.shape[:2]:
+            return base
+        a = layer[..., 3:4].astype(np.float32) / 255.0
+        return (base*(1-a) + layer[..., :3]*a).astype(np.uint8)
+    ov = _imread(thumbs_dir/f"frame{frame}_overlay{ext}")
+    return ov if ov is not None else base
+
+def build_sprites(thumbs_dir:Path, frames:Iterable[int], cell=SPRITE_CELL, cols:int=SPRITE_COLS,
+                  per_page:int=SPRITE_PER_PAGE, quality:int=SPRITE_QUALITY)->Dict[str,object]:
+    """Folhas de sprite dos frames (em ordem, sem repetição) cujas thumbs existem; grava sprite.json."""
+    thumbs_dir = Path(thumbs_dir)
+    try:
+        man = json.loads((thumbs_dir/"manifest.json").read_text(encoding="utf-8"))
+    except Exception:
+        man = {}
+    w, h = cell
+    cells = []
+    for fr in dict.fromkeys(int(f) for f in frames):
+        img = _card_image(thumbs_dir, fr, man)
+        if img is not None:
+            cells.append((fr, _cover(img, w, h)))
+    info = {"cell": [w, h], "cols": cols, "pages": [], "frames": {}}
+    for p in range(math.ceil(len(cells)/per_page)):
+        chunk = cells[p*per_page:(p+1)*per_page]
+        rows = math.ceil(len(chunk)/cols)
+        sheet = np.zeros((rows*h, min(cols, len(chunk))*w, 3), np.uint8)
+        for i, (fr, img) in enumerate(chunk):
+            x, y = (i % cols)*w, (i // cols)*h
+            sheet[y:y+h, x:x+w] = img
+            info["frames"][str(fr)] = [p, x, y]
+        name = f"sprite_{p}.jpg"
+        ok, buf = cv2.imencode(".jpg", sheet, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+        if not ok:
+            raise IOError(f"falha ao codificar {name}")
+        tmp = thumbs_dir/(name + ".tmp")
+        tmp.write_bytes(buf.tobytes()); os.replace(tmp, thumbs_dir/name)
+        info["pages"].append(name)
+    (thumbs_dir/"sprite.json").write_text(json.dumps(info), encoding="utf-8")
+    return info
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# tile_utils.py — v0.7d
+# Análise em resolução cheia por blocos (CLI --tile-size), em vez da redução 2x dos frames > 1280 px.
+# - O frame é dividido em blocos de `tile` px; cada bloco é lido com `overlap` px de margem e
+#   processado numa thread (ufuncs do NumPy e morphologyEx do OpenCV liberam o GIL): índices,
+#   contagem de concordância e abertura morfológica da máscara de cada agree_k.
+# - Só o miolo (sem a margem) de cada bloco é copiado para os buffers do frame inteiro. Com margem
+#   >= alcance da abertura (erosão + dilatação), a máscara costurada é idêntica à do frame inteiro;
+#   a rotulação (region_utils.region_stats) roda uma vez sobre ela, então uma mancha que cruza a
+#   costura entre blocos sai como uma região só.
+# - pyramid=True: passada grosseira na metade da resolução (o custo do modo antigo); só os blocos
+#   com pixel candidato nessa passada (dilatada por `overlap`) são refeitos em resolução cheia. Os
+#   demais recebem os índices da passada grosseira ampliados (médias na bbox) e máscara vazia.
+# Os arrays retornados por compute() são buffers reutilizados: valem até a próxima chamada.
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+import cv2
+
+from index_utils import IndexEngine
+
+TILE_DEFAULT = 512
+OVERLAP_DEFAULT = 8
+OPEN_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+COARSE_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))  # abertura na escala 1/2
+
+def open_reach(kernel:np.ndarray)->int:
+    """Pixels de contexto que a abertura (erosão + dilatação) usa em cada direção."""
+    return 2 * (max(kernel.shape) // 2)
+
+def tile_grid(h:int, w:int, tile:int)->List[Tuple[int,int,int,int]]:
+    """Miolos (y0, y1, x0, x1) dos blocos, cobrindo o frame sem sobreposição."""
+    return [(y, min(y + tile, h), x, min(x + tile, w)) for y in range(0, h, tile) for x in range(0, w, tile)]
+
+class TiledAnalyzer:
+    """Índices + máscaras abertas por agree_k de um frame em resolução cheia, bloco a bloco.
+    Um IndexEngine por thread (o motor não é thread-safe)."""
+    def __init__(self, precision:str="float32", tile:int=TILE_DEFAULT, overlap:int=OVERLAP_DEFAULT,
+                 threads:int=4, pyramid:bool=False, kernel:np.ndarray=OPEN_KERNEL):
+        self.precision = precision
+        self.tile = max(64, int(tile))
+        self.kernel = kernel
+        self.overlap = max(int(overlap), open_reach(kernel))
+        self.threads = max(1, int(threads))
+        self.pyramid = bool(pyramid)
+        self.dtype = np.float16 if precision == "float16" else np.float32  # = IndexEngine.dtype
+        self._local = threading.local()
+        self._coarse = IndexEngine(precision) if self.pyramid else None  # só na thread que chama compute()
+        self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix="tile") if self.threads > 1 else None
+        self._bufs: Dict[Tuple[int,int,Tuple[int,...]], Dict[str,np.ndarray]] = {}
+        self.stats = {"tiles": 0, "refined": 0}
+
+    def _engine(self)->IndexEngine:
+        eng = getattr(self._local, "engine", None)
+        if eng is None:
+            eng = self._local.engine = IndexEngine(self.precision)
+        return eng
+
+    def _buffers(self, h:int, w:int, ks:Tuple[int,...])->Dict[str,np.ndarray]:
+        bufs = self._bufs.get((h, w, ks))
+        if bufs is None:
+            self._bufs.clear()  # uma resolução por vídeo
+            bufs = {n: np.empty((h, w), self.dtype) for n in ("vari", "ngrdi", "ifv")}
+            bufs.update({f"mask{k}": np.empty((h, w), np.uint8) for k in ks})
+            self._bufs[(h, w, ks)] = bufs
+        return bufs
+
+    def _run_tile(self, bgr:np.ndarray, core:Tuple[int,int,int,int], ks:Tuple[int,...], bufs:Dict[str,np.ndarray]):
+        y0, y1, x0, x1 = core
+        H, W = bgr.shape[:2]; ov = self.overlap
+        ey0, ey1, ex0, ex1 = max(0, y0 - ov), min(H, y1 + ov), max(0, x0 - ov), min(W, x1 + ov)
+        eng = self._engine()
+        vari, ngrdi, ifv, mask = eng.compute(bgr[ey0:ey1, ex0:ex1], ks[0])
+        inner = (slice(y0 - ey0, y1 - ey0), slice(x0 - ex0, x1 - ex0))
+        dst = (slice(y0, y1), slice(x0, x1))
+        bufs["vari"][dst] = vari[inner]; bufs["ngrdi"][dst] = ngrdi[inner]; bufs["ifv"][dst] = ifv[inner]
+        for k in ks:
+            m = mask if k == ks[0] else eng.consensus(mask.shape, k)
+            bufs[f"mask{k}"][dst] = cv2.morphologyEx(m, cv2.MORPH_OPEN, self.kernel, iterations=1)[inner]
+
+    def _fill_coarse(self, core:Tuple[int,int,int,int], coarse:Tuple[np.ndarray,...], ks:Tuple[int,...],
+                     bufs:Dict[str,np.ndarray]):
+        """Bloco não refinado: índices da passada grosseira ampliados, máscara vazia."""
+        y0, y1, x0, x1 = core
+        dst = (slice(y0, y1), slice(x0, x1))
+        ch, cw = coarse[0].shape
+        src = (slice(min(y0 // 2, ch - 1), (y1 + 1) // 2), slice(min(x0 // 2, cw - 1), (x1 + 1) // 2))
+        for name, img in zip(("vari", "ngrdi", "ifv"), coarse):
+            bufs[name][dst] = cv2.resize(np.ascontiguousarray(img[src], np.float32), (x1 - x0, y1 - y0),
+                                         interpolation=cv2.INTER_NEAREST)
+        for k in ks:
+            bufs[f"mask{k}"][dst] = 0
+
+    def _select(self, bgr:np.ndarray, cores:List[Tuple[int,int,int,int]], k_min:int):
+        """Passada grosseira: (blocos a refinar, índices grosseiros, médias IFV/NGRDI do frame)."""
+        H, W = bgr.shape[:2]
+        work = cv2.resize(bgr, (W // 2, H // 2))
+        vari, ngrdi, ifv, mask = self._coarse.compute(work, k_min)
+        means = (float(ifv.mean()), float(ngrdi.mean()))
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, COARSE_KERNEL, iterations=1)
+        r = max(1, self.overlap // 2)
+        mask = cv2.dilate(mask, cv2.getStructuringElement(cv2.MORPH_RECT, (2 * r + 1, 2 * r + 1)))
+        hit = [bool(mask[y0 // 2:(y1 + 1) // 2, x0 // 2:(x1 + 1) // 2].any()) for y0, y1, x0, x1 in cores]
+        return hit, (vari, ngrdi, ifv), means
+
+    def compute(self, bgr:np.ndarray, ks:Sequence[int])->Tuple[np.ndarray,np.ndarray,np.ndarray,Dict[int,np.ndarray],Tuple[float,float]]:
+        """(vari, ngrdi, ifv, {k: máscara uint8 0/255 já aberta}, (IFV médio, NGRDI médio)) do frame
+        em resolução cheia. ks[0] é o agree_k principal; os demais só para o armazém de candidatos."""
+        ks = tuple(int(k) for k in ks)
+        H, W = bgr.shape[:2]
+        bufs = self._buffers(H, W, ks)
+        cores = tile_grid(H, W, self.tile)
+        if self.pyramid:
+            hit, coarse, means = self._select(bgr, cores, min(ks))
+        else:
+            hit, coarse, means = [True] * len(cores), None, None
+        refine = [c for c, h in zip(cores, hit) if h]
+        for c, h in zip(cores, hit):
+            if not h:
+                self._fill_coarse(c, coarse, ks, bufs)
+        if self._pool is not None and len(refine) > 1:
+            for f in [self._pool.submit(self._run_tile, bgr, c, ks, bufs) for c in refine]:
+                f.result()
+        else:
+            for c in refine:
+                self._run_tile(bgr, c, ks, bufs)
+        self.stats["tiles"] += len(cores); self.stats["refined"] += len(refine)
+        if means is None:
+            means = (float(bufs["ifv"].mean()), float(bufs["ngrdi"].mean()))
+        return bufs["vari"], bufs["ngrdi"], bufs["ifv"], {k: bufs[f"mask{k}"] for k in ks}, means
+
+_TILERS: Dict[tuple, TiledAnalyzer] = {}
+
+def get_tiler(precision:str="float32", tile:int=TILE_DEFAULT, overlap:int=OVERLAP_DEFAULT,
+              threads:int=4, pyramid:bool=False)->TiledAnalyzer:
+    """Analisador compartilhado por processo (um por configuração), como index_utils.get_engine."""
+    key = (precision, int(tile), int(overlap), int(threads), bool(pyramid))
+    t = _TILERS.get(key)
+    if t is None:
+        t = _TILERS[key] = TiledAnalyzer(precision, tile, overlap, threads, pyramid)
+    return t
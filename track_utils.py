@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# track_utils.py — v0.7d
+# Agregação temporal (CLI --track): a mesma mancha vista em frames amostrados consecutivos vira
+# uma ocorrência só.
+# - Movimento entre frames: correlação de fase (cv2.phaseCorrelate) entre assinaturas pequenas em
+#   cinza (frame_signature, lado maior SIG_EDGE px); a bbox de cada trilha é deslocada por ele antes
+#   da associação. Resposta fraca (textura pobre, mudança de cena) -> deslocamento zero.
+# - Associação gulosa por IoU (>= iou_min) ou, sem sobreposição, por distância entre centros
+#   (<= dist_frac x maior lado); a trilha fecha após `max_gap` frames amostrados sem detecção.
+# - Cada trilha fechada emite a detecção representativa (maior área = vista mais completa da
+#   mancha, não cortada pela borda; empate -> maior severidade),
+#   com occ_id/bbox/evidence dela, mais "track": {n, frames, time_s, severity_max, severity_mean,
+#   area_max, evidence_mean}. O modelo é aplicado sobre as representativas.
+# - RepresentativeThumbs: no modo serial as thumbs dos frames com detecção esperam a trilha
+#   decidir; só frames representativos ganham overlay (os demais: thumb simples ou nada com
+#   --thumbs-only-occ).
+# track_occurrences() refaz o mesmo agrupamento sobre uma lista (refiltro pelo candidates.npz).
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import numpy as np
+import cv2
+
+from thumb_utils import thumb_frame
+
+SIG_EDGE = 256
+MIN_RESPONSE = 0.05
+IOU_MIN = 0.3
+DIST_FRAC = 0.5
+MAX_GAP = 1
+MOTIONS = ("phase", "none")
+
+def frame_signature(frame:np.ndarray, edge:int=SIG_EDGE)->np.ndarray:
+    """Frame reduzido (lado maior = edge) em cinza uint8, para estimar o deslocamento."""
+    h, w = frame.shape[:2]
+    s = min(1.0, edge / float(max(h, w)))
+    step = max(1, max(h, w) // (2 * edge))  # decimação barata até ~2x o alvo; INTER_AREA no resto
+    small = cv2.resize(frame[::step, ::step], (max(8, int(w*s)), max(8, int(h*s))), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+def estimate_shift(prev:Optional[np.ndarray], cur:Optional[np.ndarray], full_width:int)->Tuple[float,float]:
+    """(dx, dy) em pixels do frame original: o conteúdo em p no frame anterior está em p + (dx, dy)."""
+    if prev is None or cur is None or prev.shape != cur.shape:
+        return 0.0, 0.0
+    a = prev.astype(np.float32); b = cur.astype(np.float32)
+    win = cv2.createHanningWindow(a.shape[::-1], cv2.CV_32F)
+    (dx, dy), resp = cv2.phaseCorrelate(a, b, win)
+    if resp < MIN_RESPONSE:
+        return 0.0, 0.0
+    s = full_width / float(a.shape[1])
+    return float(dx * s), float(dy * s)
+
+def _iou(a:np.ndarray, b:np.ndarray)->np.ndarray:
+    """IoU entre bboxes (x, y, w, h): matriz len(a) x len(b)."""
+    ax2 = a[:, None, 0] + a[:, None, 2]; ay2 = a[:, None, 1] + a[:, None, 3]
+    bx2 = b[None, :, 0] + b[None, :, 2]; by2 = b[None, :, 1] + b[None, :, 3]
+    iw = np.clip(np.minimum(ax2, bx2) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    ih = np.clip(np.minimum(ay2, by2) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    inter = iw * ih
+    union = (a[:, None, 2] * a[:, None, 3]) + (b[None, :, 2] * b[None, :, 3]) - inter
+    return inter / np.maximum(union, 1e-9)
+
+def _rank(occ:Dict[str,Any])->Tuple[int,float]:
+    return int(occ.get("area_px", 0)), float((occ.get("evidence") or {}).get("severity", 0.0))
+
+class _Track:
+    __slots__ = ("box", "last", "members", "best")
+    def __init__(self, occ:Dict[str,Any], step:int):
+        self.box = np.asarray(occ["bbox"][:4], np.float64)
+        self.last = step; self.members = [occ]; self.best = occ
+
+    def add(self, occ:Dict[str,Any], step:int):
+        self.box = np.asarray(occ["bbox"][:4], np.float64)
+        self.last = step; self.members.append(occ)
+        if _rank(occ) > _rank(self.best):
+            self.best = occ
+
+    def summary(self)->Dict[str,Any]:
+        m = self.members
+        ev = [o.get("evidence") or {} for o in m]
+        sev = [float(e.get("severity", 0.0)) for e in ev]
+        out = dict(self.best)
+        out["track"] = {
+            "n": len(m),
+            "frames": [int(m[0]["frame"]), int(m[-1]["frame"])],
+            "time_s": [m[0].get("time_s", 0.0), m[-1].get("time_s", 0.0)],
+            "severity_max": round(max(sev), 2), "severity_mean": round(float(np.mean(sev)), 2),
+            "area_max": max(int(o.get("area_px", 0)) for o in m),
+            "evidence_mean": {k: round(float(np.mean([e.get(k, 0.0) for e in ev])), 3) for k in ("vari", "ngrdi", "ifv")},
+        }
+        return out
+
+class Tracker:
+    """update() por frame amostrado (em ordem, inclusive os sem detecção); devolve as trilhas
+    fechadas já agregadas. flush() fecha as restantes no fim."""
+    def __init__(self, iou_min:float=IOU_MIN, max_gap:int=MAX_GAP, dist_frac:float=DIST_FRAC):
+        self.iou_min = float(iou_min); self.max_gap = max(0, int(max_gap)); self.dist_frac = float(dist_frac)
+        self.active: List[_Track] = []
+        self.step = 0
+        self.n_in = 0; self.n_out = 0
+
+    def _match(self, dets:List[Dict[str,Any]])->List[Tuple[int,int]]:
+        if not self.active or not dets:
+            return []
+        T = np.array([t.box for t in self.active]); D = np.array([d["bbox"][:4] for d in dets], np.float64)
+        score = _iou(T, D)
+        tc = T[:, :2] + T[:, 2:] / 2; dc = D[:, :2] + D[:, 2:] / 2
+        dist = np.hypot(tc[:, None, 0] - dc[None, :, 0], tc[:, None, 1] - dc[None, :, 1])
+        size = np.maximum(T[:, None, 2:].max(axis=2), D[None, :, 2:].max(axis=2))
+        near = dist <= self.dist_frac * size
+        score = np.where(score >= self.iou_min, score, np.where(near, 1e-6, -1.0))
+        pairs = []; used_t = set(); used_d = set()
+        for flat in np.argsort(-score, axis=None, kind="stable"):
+            ti, di = divmod(int(flat), score.shape[1])
+            if score[ti, di] < 0:
+                break
+            if ti in used_t or di in used_d:
+                continue
+            pairs.append((ti, di)); used_t.add(ti); used_d.add(di)
+        return pairs
+
+    def update(self, occs:List[Dict[str,Any]], shift:Tuple[float,float]=(0.0, 0.0))->List[Dict[str,Any]]:
+        self.step += 1; self.n_in += len(occs)
+        if shift[0] or shift[1]:
+            for t in self.active:
+                t.box[0] += shift[0]; t.box[1] += shift[1]
+        pairs = self._match(occs)
+        matched = set()
+        for ti, di in pairs:
+            self.active[ti].add(occs[di], self.step); matched.add(di)
+        self.active += [_Track(o, self.step) for i, o in enumerate(occs) if i not in matched]
+        done = [t for t in self.active if self.step - t.last > self.max_gap]
+        self.active = [t for t in self.active if self.step - t.last <= self.max_gap]
+        return self._emit(done)
+
+    def flush(self)->List[Dict[str,Any]]:
+        done, self.active = self.active, []
+        return self._emit(done)
+
+    def _emit(self, done:List[_Track])->List[Dict[str,Any]]:
+        out = [t.summary() for t in done]  # ordem de criação das trilhas (frame, região)
+        self.n_out += len(out)
+        return out
+
+    def held_frames(self)->Set[int]:
+        """Frames que ainda podem virar representativos (melhor detecção de uma trilha ativa)."""
+        return {thumb_frame(t.best) for t in self.active}
+
+class RepresentativeThumbs:
+    """Fachada de ThumbWriter para --track: frames sem detecção passam direto; os com detecção
+    ficam guardados até nenhuma trilha ativa os ter como melhor (settle)."""
+    def __init__(self, writer):
+        self.writer = writer
+        self.pending: Dict[int, Tuple[np.ndarray, list]] = {}
+        self.reps: Set[int] = set()  # frames representativos ainda pendentes
+
+    def submit(self, idx:int, frame:np.ndarray, contours:Optional[list]=None, has_occ:bool=False):
+        if not has_occ:
+            self.writer.submit(idx, frame, contours, has_occ=False)
+        else:
+            self.pending[idx] = (frame.copy(), list(contours or []))
+
+    def settle(self, held:Set[int], emitted:Iterable[Dict[str,Any]]):
+        """Grava os frames pendentes que não são mais candidatos a representativo."""
+        self.reps.update(thumb_frame(o) for o in emitted)
+        for idx in sorted(i for i in self.pending if i not in held):
+            frame, cnts = self.pending.pop(idx)
+            if idx in self.reps:
+                self.reps.discard(idx)
+                self.writer.submit(idx, frame, cnts, has_occ=True)
+            else:
+                self.writer.submit(idx, frame, [], has_occ=False)
+
+def track_occurrences(occs:List[Dict[str,Any]], frames:Sequence[int], shifts:Optional[np.ndarray]=None,
+                      iou_min:float=IOU_MIN, max_gap:int=MAX_GAP, dist_frac:float=DIST_FRAC)->List[Dict[str,Any]]:
+    """Mesmo agrupamento do CLI sobre uma lista: `frames` = frames amostrados em ordem; shifts (n x 2)
+    = deslocamento de cada frame em relação ao anterior (None = sem compensação)."""
+    by_frame: Dict[int, List[Dict[str,Any]]] = {}
+    for o in occs:
+        by_frame.setdefault(int(o["frame"]), []).append(o)
+    tr = Tracker(iou_min, max_gap, dist_frac); out = []
+    for j, f in enumerate(frames):
+        sh = (float(shifts[j][0]), float(shifts[j][1])) if shifts is not None else (0.0, 0.0)
+        out += tr.update(by_frame.get(int(f), []), sh)
+    return out + tr.flush()
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+# train_utils.py — v0.7d
+# Treino incremental para /train. Índice em disco (runs/_train/index.sqlite):
+# - occurrences: occ_id -> run_id, frame, vetor de features (model_utils.FEATURES); preenchido
+#   uma vez por run (fim da análise / refiltro), não a cada ajuste.
+# - labels: occ_id -> y (o último rótulo de cada ocorrência vale).
+# Um rótulo é uma busca por occ_id (ou, sem ele, pela maior área do frame) e um INSERT; o
+# conjunto de treino é um JOIN — nada de reler labels.csv/occurrences_v2.json do histórico.
+# O re-treino roda numa thread de fundo com debounce: cliques em sequência viram um único
+# ajuste (no máximo a cada max_wait_s sob clique contínuo). O ajuste é LogisticRegression com
+# warm start a partir do modelo ativo e vira uma nova versão em registry_utils.ModelRegistry.
+import copy, csv, json, sqlite3, threading, time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+from model_utils import FEATURES, LogisticRegression, joblib, label_value, occ_features, occurrence_key
+from registry_utils import ModelRegistry
+from output_utils import NDJSON_NAME, NdjsonTail
+
+MIN_SAMPLES = 5
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS occurrences (
+    occ_id TEXT PRIMARY KEY, run_id TEXT NOT NULL, frame INTEGER NOT NULL, pos INTEGER NOT NULL,
+    {", ".join(f"{c} REAL" for c in FEATURES)});
+CREATE INDEX IF NOT EXISTS occurrences_run_frame ON occurrences(run_id, frame);
+CREATE TABLE IF NOT EXISTS labels (
+    occ_id TEXT PRIMARY KEY, run_id TEXT NOT NULL, frame INTEGER NOT NULL, y INTEGER NOT NULL, ts REAL);
+"""
+
+def read_occurrences(run_dir:Path)->Optional[List[Dict[str,Any]]]:
+    for name in ("occurrences_v2.json", "occurrences.json"):
+        path = run_dir / name
+        if path.exists():
+            try:
+                return json.loads(path.read_text(encoding="utf-8"))
+            except Exception:
+                return None
+    # run ainda em andamento: o que o CLI já gravou no NDJSON (rótulos vindos do stream)
+    path = run_dir / NDJSON_NAME
+    if path.exists():
+        return [occ for _end, occ in NdjsonTail(path).read()]
+    return None
+
+class FeatureIndex:
+    """Índice SQLite occ_id -> features + rótulos. Uma conexão compartilhada, serializada por lock."""
+    def __init__(self, path:Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def n_labels(self)->int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+
+    def has_run(self, run_id:str)->bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM occurrences WHERE run_id=? LIMIT 1", (run_id,)).fetchone() is not None
+
+    def index_run(self, run_id:str, occs:List[Dict[str,Any]]):
+        """Grava/atualiza as features das ocorrências de um run (O(ocorrências do run))."""
+        rows = [(occurrence_key(run_id, o, i), run_id, int(o.get("frame", o.get("idx", i))), i, *occ_features(o))
+                for i, o in enumerate(occs)]
+        marks = ",".join("?" * (4 + len(FEATURES)))
+        with self._lock, self._db:
+            self._db.executemany(f"INSERT OR REPLACE INTO occurrences VALUES ({marks})", rows)
+
+    def index_run_dir(self, run_dir:Path)->bool:
+        occs = read_occurrences(run_dir)
+        if occs is None:
+            return False
+        self.index_run(run_dir.name, occs)
+        return True
+
+    def _resolve(self, run_id:str, occ_id:Optional[str], frame:int):
+        if occ_id:
+            # occ_id desconhecido não cai no frame: None (rótulo não entra no treino)
+            return self._db.execute("SELECT occ_id, run_id, frame FROM occurrences WHERE occ_id=?", (occ_id,)).fetchone()
+        # rótulo sem occ_id (relatório antigo): maior área do frame, como no treino anterior
+        return self._db.execute("SELECT occ_id, run_id, frame FROM occurrences WHERE run_id=? AND frame=? "
+                                "ORDER BY area_px DESC, pos ASC LIMIT 1", (run_id, int(frame))).fetchone()
+
+    def add_label(self, run_id:str, occ_id:Optional[str], frame:int, y:int,
+                  run_dir:Optional[Path]=None, ts:Optional[float]=None)->Optional[str]:
+        """Registra o rótulo; retorna o occ_id casado (None se a ocorrência não existe).
+        Com run_dir, (re)indexa o run na hora se a ocorrência ainda não está no índice
+        (run novo, ou ainda em andamento e rotulado pelo stream)."""
+        if run_dir is not None and (not self._known(occ_id) if occ_id else not self.has_run(run_id)):
+            self.index_run_dir(run_dir)
+        with self._lock, self._db:
+            row = self._resolve(run_id, occ_id, frame)
+            if row is None:
+                return None
+            self._db.execute("INSERT OR REPLACE INTO labels VALUES (?,?,?,?,?)",
+                             (row[0], row[1], row[2], int(y), time.time() if ts is None else ts))
+        return row[0]
+
+    def _known(self, occ_id:str)->bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM occurrences WHERE occ_id=?", (occ_id,)).fetchone() is not None
+
+    def load(self)->Tuple[np.ndarray,np.ndarray]:
+        """Conjunto de treino (X, y): rótulos JOIN features."""
+        cols = ", ".join(f"o.{c}" for c in FEATURES)
+        with self._lock:
+            rows = self._db.execute(f"SELECT {cols}, l.y FROM labels l JOIN occurrences o USING (occ_id) "
+                                    "ORDER BY l.rowid").fetchall()
+        if not rows:
+            return np.zeros((0, len(FEATURES)), np.float32), np.zeros((0,), np.float32)
+        arr = np.array(rows, dtype=np.float32)
+        return arr[:, :-1], arr[:, -1]
+
+    def rebuild(self, runs_dir:Path)->int:
+        """Reindexa a partir de runs/*/labels.csv (migração/reparo). Retorna o nº de rótulos casados."""
+        n = 0
+        for labels_path in Path(runs_dir).glob("*/labels.csv"):
+            run_dir = labels_path.parent
+            if not self.index_run_dir(run_dir):
+                continue
+            with labels_path.open(newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    try:
+                        frame = int(float(row.get("frame") or 0)); ts = float(row.get("ts") or 0)
+                    except ValueError:
+                        frame = 0; ts = 0.0
+                    if self.add_label(run_dir.name, row.get("occ_id"), frame, label_value(row.get("label")), ts=ts):
+                        n += 1
+        return n
+
+def fit_index(index:FeatureIndex, registry:ModelRegistry)->Dict[str,Any]:
+    """Ajusta o modelo nos rótulos do índice (warm start a partir de uma cópia do modelo ativo)
+    e publica uma nova versão no registro."""
+    X, y = index.load()
+    if X.shape[0] < MIN_SAMPLES or len(np.unique(y)) < 2 or LogisticRegression is None or joblib is None:
+        return {"ok": False, "reason": "dados_insuficientes_ou_dependencias", "n": int(X.shape[0])}
+    prev = registry.get()
+    if isinstance(prev, LogisticRegression) and registry.meta().get("features") == FEATURES:
+        clf = copy.deepcopy(prev)  # o ativo continua servindo /analyze enquanto este ajusta
+    else:
+        clf = LogisticRegression(max_iter=500, n_jobs=None)
+    clf.set_params(warm_start=True)
+    clf.fit(X, y)
+    info = {"n": int(X.shape[0]), "pos_frac": float(y.mean())}
+    version = registry.publish({"model": clf, "features": FEATURES}, info)
+    return {"ok": True, "version": version, **info}
+
+class BackgroundTrainer:
+    """Re-treino em thread de fundo: notify() agenda; o ajuste roda `debounce_s` depois do
+    último rótulo, ou após `max_wait_s` desde o primeiro rótulo pendente."""
+    def __init__(self, index:FeatureIndex, registry:ModelRegistry, runs_dir:Optional[Path]=None,
+                 debounce_s:float=2.0, max_wait_s:float=30.0):
+        self.index = index; self.registry = registry; self.runs_dir = runs_dir
+        self.debounce_s = float(debounce_s); self.max_wait_s = float(max_wait_s)
+        self._cv = threading.Condition()
+        self._first = None; self._last = None; self._busy = False; self._rebuild = False
+        self.last: Dict[str,Any] = {"ok": False, "reason": "sem_treino", "n": 0}
+        self._thread = threading.Thread(target=self._loop, name="trainer", daemon=True)
+        self._thread.start()
+        if runs_dir is not None and index.n_labels() == 0 and any(Path(runs_dir).glob("*/labels.csv")):
+            self.notify(rebuild=True)  # migração: rótulos anteriores ao armazém
+
+    def notify(self, rebuild:bool=False):
+        with self._cv:
+            now = time.monotonic()
+            self._first = self._first or now
+            self._last = now
+            self._rebuild = self._rebuild or rebuild
+            self._cv.notify()
+
+    def pending(self)->bool:
+        with self._cv:
+            return self._first is not None or self._busy
+
+    def _due(self)->Optional[float]:
+        """Segundos até o próximo ajuste (0 = agora), ou None se nada pendente."""
+        if self._first is None:
+            return None
+        now = time.monotonic()
+        return max(0.0, min(self._last + self.debounce_s, self._first + self.max_wait_s) - now)
+
+    def _loop(self):
+        while True:
+            with self._cv:
+                while True:
+                    wait = self._due()
+                    if wait == 0.0:
+                        break
+                    self._cv.wait(wait)
+                self._first = self._last = None
+                rebuild, self._rebuild = self._rebuild, False
+                self._busy = True
+            t0 = time.perf_counter()
+            try:
+                if rebuild and self.runs_dir is not None:
+                    self.index.rebuild(self.runs_dir)
+                info = fit_index(self.index, self.registry)
+            except Exception as e:
+                info = {"ok": False, "reason": f"erro: {e}", "n": self.last.get("n", 0)}
+            info["trained_at"] = time.time(); info["fit_s"] = round(time.perf_counter() - t0, 3)
+            with self._cv:
+                self.last = info; self._busy = False
+                self._cv.notify_all()
+
+    def flush(self, timeout:float=30.0)->Dict[str,Any]:
+        """Antecipa o ajuste pendente e espera terminar (testes / encerramento)."""
+        deadline = time.monotonic() + timeout
+        with self._cv:
+            if self._first is not None:
+                self._first = self._last = time.monotonic() - max(self.debounce_s, self.max_wait_s)
+                self._cv.notify_all()
+            while (self._first is not None or self._busy) and time.monotonic() < deadline:
+                self._cv.wait(max(0.0, deadline - time.monotonic()))
+            return dict(self.last)
+
+    def info(self)->Dict[str,Any]:
+        with self._cv:
+            return {**self.last, "pending": self._first is not None or self._busy}
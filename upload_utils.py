@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# upload_utils.py — v0.7d
+# Upload de vídeos sem carregar o arquivo inteiro na memória:
+# - save_upload(): copia o UploadFile para o disco em blocos fixos, calculando o hash no caminho.
+# - UploadSessions: upload retomável em partes (POST /uploads, PUT /uploads/<id>?offset=N,
+#   GET /uploads/<id>); uma conexão que cai no campo retoma do último offset gravado.
+#   Estado em runs/_uploads/<id>/{session.json,data.part}. Com `size` declarado, nenhuma parte
+#   passa dele (SizeExceeded) e a sessão só fecha com exatamente `size` bytes.
+# - Escritas em disco numa thread (asyncio.to_thread): o event loop segue servindo /jobs e os
+#   streams enquanto um upload grande grava.
+import asyncio, hashlib, json, os, re, shutil, threading, time, uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+CHUNK_SIZE = 1 << 20         # 1 MiB por leitura/escrita
+SESSION_CHUNK = 8 << 20      # tamanho de parte sugerido ao cliente
+HASH_ALGO = "sha256"
+
+class SizeExceeded(ValueError):
+    """Parte que passaria do tamanho declarado na sessão; args = (offset atual, size)."""
+
+def safe_name(name:Optional[str], default:str="video.mp4")->str:
+    """Nome de arquivo sem diretórios nem caracteres problemáticos."""
+    base = Path(name or "").name.strip()
+    base = re.sub(r"[^\w.\-]+", "_", base)
+    return base if base and base not in (".", "..") else default
+
+def file_hash(path:Path, algo:str=HASH_ALGO)->str:
+    h = hashlib.new(algo)
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+async def save_upload(upload, dest:Path, algo:Optional[str]=HASH_ALGO)->Tuple[int, Optional[str]]:
+    """Grava um UploadFile em dest em blocos de CHUNK_SIZE; retorna (bytes, hash hex ou None)."""
+    h = hashlib.new(algo) if algo else None
+    n = 0
+    with dest.open("wb") as f:
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            await asyncio.to_thread(f.write, chunk); n += len(chunk)
+            if h: h.update(chunk)
+    return n, (h.hexdigest() if h else None)
+
+def write_input_info(out_dir:Path, filename:str, nbytes:int, digest:Optional[str]):
+    (out_dir/"input.json").write_text(json.dumps({"filename": filename, "bytes": int(nbytes), HASH_ALGO: digest}), encoding="utf-8")
+
+class UploadSessions:
+    """Sessões de upload retomável. Partes devem chegar em ordem (offset == bytes já gravados)."""
+    def __init__(self, base_dir:Path, ttl_s:float=48*3600):
+        self.base = Path(base_dir)
+        self.base.mkdir(parents=True, exist_ok=True)
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._alocks: Dict[str, asyncio.Lock] = {}
+
+    def _dir(self, upload_id:str)->Path:
+        if not re.fullmatch(r"[0-9a-f]{16}", upload_id or ""):
+            raise KeyError(upload_id)
+        return self.base / upload_id
+
+    def _meta(self, upload_id:str)->Dict[str,Any]:
+        d = self._dir(upload_id)
+        try:
+            meta = json.loads((d/"session.json").read_text(encoding="utf-8"))
+        except Exception:
+            raise KeyError(upload_id)
+        part = d/"data.part"
+        meta["offset"] = part.stat().st_size if part.exists() else 0
+        meta["complete"] = meta.get("size") is not None and meta["offset"] == int(meta["size"])
+        return meta
+
+    def create(self, filename:str, size:Optional[int]=None, sha256:Optional[str]=None)->Dict[str,Any]:
+        self.cleanup()
+        upload_id = uuid.uuid4().hex[:16]
+        d = self.base / upload_id
+        d.mkdir(parents=True)
+        meta = {"upload_id": upload_id, "filename": safe_name(filename), "size": int(size) if size is not None else None,
+                "sha256": sha256, "created": time.time()}
+        (d/"session.json").write_text(json.dumps(meta), encoding="utf-8")
+        (d/"data.part").touch()
+        return self.status(upload_id)
+
+    def status(self, upload_id:str)->Dict[str,Any]:
+        meta = self._meta(upload_id)
+        meta["chunk_size"] = SESSION_CHUNK
+        return meta
+
+    async def append(self, upload_id:str, offset:int, stream:AsyncIterator[bytes])->Dict[str,Any]:
+        """Acrescenta o corpo da requisição a partir de `offset`. Se offset != bytes gravados,
+        levanta ValueError com o offset atual (o cliente retoma dali); um bloco que passaria do
+        `size` declarado não é gravado e levanta SizeExceeded(offset atual, size)."""
+        d = self._dir(upload_id)
+        async with self._alocks.setdefault(upload_id, asyncio.Lock()):
+            meta = self._meta(upload_id)
+            if int(offset) != meta["offset"]:
+                raise ValueError(meta["offset"])
+            size = meta.get("size")
+            pos = meta["offset"]
+            with (d/"data.part").open("ab") as f:
+                async for chunk in stream:
+                    if not chunk:
+                        continue
+                    if size is not None and pos + len(chunk) > int(size):
+                        raise SizeExceeded(pos, int(size))
+                    await asyncio.to_thread(f.write, chunk); pos += len(chunk)
+            return self.status(upload_id)
+
+    def finalize(self, upload_id:str, dest_dir:Path)->Tuple[Path, int, str]:
+        """Move o arquivo completo para dest_dir; confere tamanho e hash (se informados)."""
+        with self._lock:
+            meta = self._meta(upload_id)
+            if meta.get("size") is not None and meta["offset"] != int(meta["size"]):
+                raise ValueError(f"upload incompleto: {meta['offset']}/{meta['size']} bytes")
+            d = self._dir(upload_id)
+            digest = file_hash(d/"data.part")
+            if meta.get("sha256") and meta["sha256"].lower() != digest:
+                raise ValueError("sha256 não confere com o informado na criação da sessão")
+            dest = Path(dest_dir) / meta["filename"]
+            shutil.move(str(d/"data.part"), str(dest))
+            shutil.rmtree(d, ignore_errors=True)
+            self._alocks.pop(upload_id, None)
+            return dest, meta["offset"], digest
+
+    def cleanup(self):
+        """Remove sessões abandonadas há mais de ttl_s (e os locks delas)."""
+        now = time.time()
+        for d in self.base.iterdir():
+            try:
+                if now - os.path.getmtime(d/"data.part") > self.ttl_s:
+                    shutil.rmtree(d, ignore_errors=True)
+                    self._alocks.pop(d.name, None)
+            except OSError:
+                continue
+        for upload_id in [u for u, lock in self._alocks.items() if not lock.locked() and not (self.base / u).exists()]:
+            self._alocks.pop(upload_id, None)  # sessão que sumiu por fora (pasta apagada)
@@ -3,19 +3,114 @@
 # - Lê options_json (flags para o CLI)
 # - Sempre retorna 200 com {"ok": true|false, ...} para facilitar tratamento no painel
 # - Salva stderr/stdout em runs/<id>/error.txt e add como artifact
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse, FileResponse, HTMLResponse
+# - /analyze enfileira um job (JobQueue) e responde com run_id; progresso em /jobs/<run_id>
+# - Upload gravado em disco por blocos (sha256 no caminho) ou por sessão retomável (/uploads)
+# - Cache por conteúdo: mesmo vídeo + mesmas opções + mesma versão -> devolve o run existente
+# - Análise no pool de processos quentes (engine_utils.EnginePool) em vez de um subprocesso por job
+# - /rethreshold/<run_id> refaz o filtro (min_area/agree_k/min_severity/soil_guard) a partir do candidates.npz
+# - /jobs/<run_id>/stream (SSE): ocorrências e progresso enquanto o CLI roda
+# - Ocorrências também em NDJSON (incremental) / .npz colunar; /download comprime (br/gzip) texto
+# - Modelo em memória (registry_utils.ModelRegistry): versões em runs/_models, troca atômica, rollback em /models
+# - /download com ETag/Last-Modified (304), Range (206) e Cache-Control (immutable em runs concluídos);
+#   thumbs em folhas de sprite (thumbs/sprite.json) e /bundle/<run_id>/thumbs.tar
+# - "track": true -> CLI --track (mesma mancha em frames consecutivos = uma ocorrência); /rethreshold liga/desliga
+# - "skip_static"/"static_threshold"/"adaptive" -> CLI --skip-static / --adaptive (voo parado, passo adaptativo)
+# - "mosaic": true (+ "mosaic_size"/"mosaic_edge") -> CLI --mosaic: mosaico de índices do voo (mosaic.tif/.tfw/.json,
+#   prévias mosaic_<índice>.png) no lugar das grades grid_*.png
+# - /analyze_batch: vários vídeos do mesmo voo (um run por clipe, o mais longo primeiro) + /batches/<id>
+#   com o índice combinado de ocorrências (occurrences_batch.json)
+# - /metrics no formato texto do Prometheus (metrics_utils): latência HTTP por rota, fila de jobs, tempo
+#   de parede do CLI, etapas/frames/bytes dos runs (timings.json) e carga do modelo
+# - Catálogo SQLite (catalog_utils.RunCatalog, runs/_catalog): runs, opções, etapas, ocorrências (R-tree de
+#   bbox x time_s) e rótulos, atualizado a cada job/refiltro/rótulo; /runs, /runs/<run_id> e /occurrences
+#   paginam por cursor sem ler as pastas de runs/
+from fastapi import FastAPI, UploadFile, File, Form, Request, Query
+from fastapi.responses import JSONResponse, FileResponse, HTMLResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn, subprocess, os, csv, time, json, sys, uuid
+import uvicorn, subprocess, os, csv, time, json, sys, uuid, asyncio, shutil, atexit, threading, mimetypes
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional, Tuple
 
-from model_utils import fit_and_save, load_model, apply_model
+from model_utils import label_value, apply_model
+from registry_utils import ModelRegistry
+from train_utils import BackgroundTrainer, FeatureIndex
+from job_utils import JobQueue
+from upload_utils import SizeExceeded, UploadSessions, save_upload, safe_name, write_input_info
+from cache_utils import RunCache, make_key
+from candidate_utils import load_candidates, apply_thresholds
+from engine_utils import EnginePool
+from output_utils import NDJSON_NAME, OUTPUT_FORMATS, NdjsonTail, iter_compressed, negotiate_encoding, write_occurrences
+from thumb_utils import thumb_frame
+from serve_utils import (cache_control, dir_listing, if_range_ok, iter_file_range, iter_tar, not_modified,
+                         parse_range, validators)
+from veg_product_cli import build_parser, analyze_video, warm_up, CLI_VERSION
+from metrics_utils import WALL_BUCKETS, HttpMetrics, MetricsRegistry, read_timings
+from batch_utils import BATCH_NAME, INDEX_NAME, longest_first, unique_names, write_index, write_json
+from catalog_utils import CATALOG_NAME, PAGE_MAX, RunCatalog
 
 APP_DIR = Path(__file__).resolve().parent
 RUNS_DIR = APP_DIR / "runs"
 RUNS_DIR.mkdir(parents=True, exist_ok=True)
 MODEL_PATH = RUNS_DIR / "model.joblib"
+# Jobs de análise simultâneos e fila máxima (variáveis de ambiente)
+MAX_JOBS = int(os.environ.get("AGV_MAX_JOBS", "2"))
+MAX_QUEUE = int(os.environ.get("AGV_MAX_QUEUE", "32"))
+# Métricas Prometheus (/metrics); os valores lidos na coleta (fila, modelo) ficam mais abaixo
+METRICS = MetricsRegistry()
+HTTP_SECONDS = METRICS.histogram("agv_http_request_duration_seconds", "Duração das requisições HTTP até o último byte",
+                                 ("route", "method", "code"))
+QUEUE_WAIT = METRICS.histogram("agv_job_queue_wait_seconds", "Espera dos jobs na fila até começar a rodar", buckets=WALL_BUCKETS)
+CLI_SECONDS = METRICS.histogram("agv_cli_wall_seconds", "Tempo de parede da análise de um job (motor ou subprocesso)",
+                                ("engine", "result"), buckets=WALL_BUCKETS)
+STAGE_SECONDS = METRICS.counter("agv_cli_stage_seconds_total", "Soma dos tempos por etapa do CLI (timings.json)", ("stage",))
+FRAMES = METRICS.counter("agv_cli_frames_total", "Frames dos runs por tipo (timings.json)", ("kind",))
+BYTES_WRITTEN = METRICS.counter("agv_cli_bytes_written_total", "Bytes gravados pelos runs por tipo de artefato", ("kind",))
+# Catálogo de runs (SQLite): listagens e consultas multi-run sem varrer runs/
+CATALOG = RunCatalog(RUNS_DIR / "_catalog" / CATALOG_NAME)
+
+def job_started(job:Dict[str,Any]):
+    QUEUE_WAIT.observe(job["started"] - job["created"])
+    CATALOG.register(job["run_id"], "running")
+
+JOBS = JobQueue(MAX_JOBS, MAX_QUEUE, on_start=job_started)
+UPLOADS = UploadSessions(RUNS_DIR / "_uploads")
+# Cache de resultados (sha256 do vídeo + opções + versão) e limites de runs/ (0 = sem limite)
+CACHE_ENABLED = os.environ.get("AGV_CACHE", "1") != "0"
+RUNS_MAX_BYTES = int(float(os.environ.get("AGV_RUNS_MAX_GB", "0")) * 2**30)
+RUNS_MAX = int(os.environ.get("AGV_RUNS_MAX", "0"))
+CACHE = RunCache(RUNS_DIR)
+# Motor: "pool" (workers pré-aquecidos, padrão) ou "subprocess" (um `python veg_product_cli.py` por job)
+ENGINE_MODE = os.environ.get("AGV_ENGINE", "pool")
+WORKER_MAX_JOBS = int(os.environ.get("AGV_WORKER_MAX_JOBS", "50"))
+WORKER_MEM_MB = int(os.environ.get("AGV_WORKER_MEM_MB", "0"))
+ENGINE: Optional[EnginePool] = None
+_ENGINE_LOCK = threading.Lock()
+_BATCH_LOCK = threading.Lock()  # índice combinado de um lote: uma regravação por vez
+# Modelos versionados (runs/_models); a versão ativa fica espelhada em MODEL_PATH
+MODELS = ModelRegistry(RUNS_DIR / "_models", MODEL_PATH, keep=int(os.environ.get("AGV_MODEL_KEEP", "10")))
+# Treino incremental: índice occ_id -> features (SQLite) + re-treino em segundo plano com debounce
+FEATURE_INDEX = FeatureIndex(RUNS_DIR / "_train" / "index.sqlite")
+TRAINER = BackgroundTrainer(FEATURE_INDEX, MODELS, RUNS_DIR,
+                            debounce_s=float(os.environ.get("AGV_TRAIN_DEBOUNCE_S", "2")),
+                            max_wait_s=float(os.environ.get("AGV_TRAIN_MAX_WAIT_S", "30")))
+METRICS.gauge("agv_jobs", "Jobs de análise por estado", ("state",),
+              fn=lambda: {("queued",): JOBS.pending(), ("running",): JOBS.running()})
+METRICS.gauge("agv_jobs_max", "Jobs de análise simultâneos (AGV_MAX_JOBS)", fn=lambda: JOBS.max_workers)
+METRICS.counter("agv_jobs_rejected_total", "Jobs recusados com a fila cheia", fn=lambda: JOBS.rejected)
+METRICS.gauge("agv_model_load_seconds", "Tempo da última carga do modelo ativo",
+              fn=lambda: (MODELS.meta().get("load_ms") or 0) / 1000.0 if MODELS.get() is not None else None)
+METRICS.counter("agv_model_reloads_total", "Cargas do modelo ativo (troca de versão)", fn=lambda: MODELS.reloads)
+METRICS.gauge("agv_catalog_runs", "Runs no catálogo", fn=CATALOG.count_runs)
+METRICS.gauge("agv_train_fit_seconds", "Duração do último re-treino em segundo plano", fn=lambda: TRAINER.info().get("fit_s"))
+# Stream SSE: intervalo de leitura do NDJSON/progresso, espera máx. pela thumb da ocorrência, keep-alive
+SSE_POLL_S = float(os.environ.get("AGV_SSE_POLL_S", "0.5"))
+SSE_THUMB_WAIT_S = 5.0
+SSE_KEEPALIVE_S = 15.0
+# Flags que não mudam o resultado (fora da chave do cache)
+# (o modelo entra na chave pela versão ativa, não pelo caminho de --model)
+NON_SEMANTIC_OPTS = {"input", "out", "progress", "workers", "thumb_threads", "thumb_queue", "tile_threads", "model",
+                     "input_dir", "manifest", "batch_jobs", "mosaic_memmap", "catalog"}
 
 app = FastAPI(title="AgroVision API v0.7c", version="0.7c")
 app.add_middleware(
@@ -25,6 +120,28 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# por fora do CORS: mede também as respostas dele; o SSE (conexão longa) fica fora do histograma
+app.add_middleware(HttpMetrics, histogram=HTTP_SECONDS, skip={"/jobs/{run_id}/stream"})
+
+def get_engine_pool()->Optional[EnginePool]:
+    """Cria o pool na primeira chamada (startup da API), nunca no import: os workers
+    reimportam este módulo como __mp_main__ e não podem abrir um pool próprio."""
+    global ENGINE
+    with _ENGINE_LOCK:
+        if ENGINE is None and ENGINE_MODE == "pool":
+            ENGINE = EnginePool(analyze_video, workers=MAX_JOBS, init=warm_up,
+                                max_jobs=WORKER_MAX_JOBS, mem_limit_mb=WORKER_MEM_MB)
+            atexit.register(ENGINE.close)
+    return ENGINE
+
+@app.on_event("startup")
+def start_engine():
+    get_engine_pool()  # pré-fork dos workers antes do primeiro job
+
+@app.on_event("startup")
+def start_catalog():
+    # migração: pastas de runs/ anteriores ao catálogo (só as que faltam; em segundo plano)
+    threading.Thread(target=CATALOG.sync, args=(RUNS_DIR,), name="catalog-sync", daemon=True).start()
 
 def add_artifact(arts:List[Dict[str,str]], out_dir:Path, name:str):
     p = out_dir / name
@@ -33,27 +150,59 @@ def add_artifact(arts:List[Dict[str,str]], out_dir:Path, name:str):
 
 @app.get("/status")
 def status():
-    return {"ok": True, "version": "0.7c", "has_model": MODEL_PATH.exists()}
+    return {"ok": True, "version": "0.7c", "has_model": MODEL_PATH.exists(),
+            "model": MODELS.info(), "training": TRAINER.info(),
+            "jobs": {"running": JOBS.running(), "queued": JOBS.pending(), "max_jobs": JOBS.max_workers},
+            "engine": {"mode": ENGINE_MODE, **(ENGINE.info() if ENGINE is not None else {})}}
 
-@app.post("/analyze")
-async def analyze(file: UploadFile = File(...), options_json: Optional[str] = Form(None)):
-    run_id = uuid.uuid4().hex[:8]
-    out_dir = RUNS_DIR / run_id
-    out_dir.mkdir(parents=True, exist_ok=True)
-    in_path = out_dir / file.filename
-    with in_path.open("wb") as f:
-        f.write(await file.read())
-
-    opts = {}
-    if options_json:
-        try: opts = json.loads(options_json)
-        except Exception: opts = {}
+def collect_artifacts(out_dir:Path)->List[Dict[str,str]]:
+    arts=[]
+    for name in ["report.html","report_v2.html","occurrences_v2.json","occurrences.json","occurrences.ndjson","occurrences.npz","resumo.txt","grid_vari.png","grid_ngrdi.png","grid_ifv.png",
+                 "mosaic.tif","mosaic.tfw","mosaic.json","mosaic_vari.png","mosaic_ngrdi.png","mosaic_ifv.png","candidates.npz","timings.json","error.txt"]:
+        add_artifact(arts, out_dir, name)
+    if (out_dir/"thumbs").exists():
+        arts.append({"name":"thumbs/","url":f"/download/{out_dir.name}/thumbs"})
+    return arts
 
+def build_cmd(in_path:Path, out_dir:Path, opts:Dict[str,Any])->List[str]:
+    """Traduz options_json em flags do CLI."""
     cli = APP_DIR / "veg_product_cli.py"
     py = sys.executable
-    cmd = [py, str(cli), "--input", str(in_path), "--out", str(out_dir)]
+    cmd = [py, str(cli), "--input", str(in_path), "--out", str(out_dir), "--progress"]
     if isinstance(opts.get("every"), (int, float)) and int(opts["every"])>0:
         cmd += ["--every", str(int(opts["every"]))]
+    if isinstance(opts.get("every_seconds"), (int, float)) and float(opts["every_seconds"])>0:
+        cmd += ["--every-seconds", str(float(opts["every_seconds"]))]
+    if opts.get("sampling") in ("auto","grab","seek"):
+        cmd += ["--sampling", opts["sampling"]]
+    if isinstance(opts.get("workers"), (int, float)) and int(opts["workers"])>1:
+        cmd += ["--workers", str(int(opts["workers"]))]
+    if opts.get("index_precision") in ("float32","float16","lut"):
+        cmd += ["--index-precision", opts["index_precision"]]
+    if opts.get("exact_means") is True:
+        cmd += ["--exact-means"]
+    if isinstance(opts.get("tile_size"), (int, float)) and int(opts["tile_size"])>0:
+        cmd += ["--tile-size", str(int(opts["tile_size"]))]
+    if isinstance(opts.get("tile_threads"), (int, float)) and int(opts["tile_threads"])>0:
+        cmd += ["--tile-threads", str(int(opts["tile_threads"]))]
+    if opts.get("pyramid") is True:
+        cmd += ["--pyramid"]
+    if opts.get("skip_static") is True:
+        cmd += ["--skip-static"]
+    if isinstance(opts.get("static_threshold"), (int, float)) and float(opts["static_threshold"])>0:
+        cmd += ["--static-threshold", str(float(opts["static_threshold"]))]
+    if opts.get("adaptive") is True:
+        cmd += ["--adaptive"]
+    if opts.get("thumb_format") in ("png","jpg","webp"):
+        cmd += ["--thumb-format", opts["thumb_format"]]
+    if isinstance(opts.get("thumb_quality"), (int, float)):
+        cmd += ["--thumb-quality", str(int(opts["thumb_quality"]))]
+    if isinstance(opts.get("thumb_max_edge"), (int, float)) and int(opts["thumb_max_edge"])>0:
+        cmd += ["--thumb-max-edge", str(int(opts["thumb_max_edge"]))]
+    if opts.get("thumbs_only_occ") is True:
+        cmd += ["--thumbs-only-occ"]
+    if opts.get("overlay") in ("full","layer"):
+        cmd += ["--overlay", opts["overlay"]]
     if isinstance(opts.get("min_area"), (int, float)) and int(opts["min_area"])>=0:
         cmd += ["--min-area", str(int(opts["min_area"]))]
     if int(opts.get("agree_k", 0)) in (2,3):
@@ -62,67 +211,543 @@ async def analyze(file: UploadFile = File(...), options_json: Optional[str] = Fo
         cmd += ["--min-severity", str(float(opts["min_severity"]))]
     if opts.get("soil_guard") is False:
         cmd += ["--disable-soil-guard"]
+    if isinstance(opts.get("output_format"), str) and set(opts["output_format"].split(",")) <= set(OUTPUT_FORMATS):
+        cmd += ["--output-format", opts["output_format"]]
+    if opts.get("candidates") is not False:
+        cmd += ["--candidates"]
+    if opts.get("track") is True:
+        cmd += ["--track"]
+    if opts.get("sprite") is not False:
+        cmd += ["--sprite"]
+    if opts.get("mosaic") is True:
+        cmd += ["--mosaic"]
+        if isinstance(opts.get("mosaic_size"), (int, float)) and int(opts["mosaic_size"])>0:
+            cmd += ["--mosaic-size", str(int(opts["mosaic_size"]))]
+        if isinstance(opts.get("mosaic_edge"), (int, float)) and int(opts["mosaic_edge"])>0:
+            cmd += ["--mosaic-edge", str(int(opts["mosaic_edge"]))]
+    return cmd
+
+def cli_options(cmd:List[str])->Dict[str,Any]:
+    """Opções efetivas do CLI (com defaults) para o comando de build_cmd()."""
+    return vars(build_parser().parse_args(cmd[2:]))
 
+def normalize_options(cmd:List[str])->Dict[str,Any]:
+    """Opções efetivas do CLI (com defaults) que afetam o resultado."""
+    return {k: v for k, v in sorted(cli_options(cmd).items()) if k not in NON_SEMANTIC_OPTS}
+
+def cache_key(digest:Optional[str], cmd:List[str])->Optional[str]:
+    if not CACHE_ENABLED or not digest:
+        return None
+    # o modelo aplicado no pós-processamento também muda o resultado
+    return make_key(digest, normalize_options(cmd), CLI_VERSION, {"model": MODELS.tag()})
+
+def apply_saved_model(occs:List[Dict[str,Any]])->List[Dict[str,Any]]:
+    """Aplica o modelo ativo (em memória; recarregado só quando muda), se existir."""
+    return apply_model(MODELS.get(), occs, boost=True)
+
+def observe_timings(out_dir:Path):
+    """Soma o timings.json do run (gravado pelo CLI no motor ou no subprocesso) nos contadores do /metrics."""
+    t = read_timings(out_dir)
+    if not t:
+        return
+    for stage, st in (t.get("etapas") or {}).items():
+        STAGE_SECONDS.inc(st.get("total_s", 0.0), stage=stage)
+    for kind, n in (t.get("frames") or {}).items():
+        FRAMES.inc(n, kind=kind)
+    for kind, n in (t.get("bytes") or {}).items():
+        if kind != "total":
+            BYTES_WRITTEN.inc(n, kind=kind)
+
+def run_analysis(run_id:str, in_path:Path, out_dir:Path, opts:Dict[str,Any], key:Optional[str]=None)->Dict[str,Any]:
+    """Executa a análise (bloqueante; roda numa thread do JobQueue) e o pós-processamento.
+    `cmd` no resultado é o comando de CLI equivalente, também no modo pool."""
+    cmd = build_cmd(in_path, out_dir, opts)
+    # modelo ativo exportado em coeficientes: o motor pontua no laço de frames (sem 2ª passada no JSON)
+    scorer = MODELS.scorer_for_cli()
+    if scorer is not None:
+        cmd += ["--model", str(scorer)]
     ok=True; err=""; out_text=""
-    try:
-        cp = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        out_text = cp.stdout or ""
-    except subprocess.CalledProcessError as e:
-        ok=False; err=e.stderr or e.stdout or str(e)
+    engine = get_engine_pool()
+    t0 = time.perf_counter()
+    if engine is not None:
+        try:
+            summary = engine.run(in_path, out_dir, cli_options(cmd))
+            out_text = f"[OK] Ocorrências: {summary['occ']}\n"
+        except RuntimeError as e:
+            ok=False; err=str(e)
+    else:
+        try:
+            cp = subprocess.run(cmd, capture_output=True, text=True, check=True)
+            out_text = cp.stdout or ""
+        except subprocess.CalledProcessError as e:
+            ok=False; err=e.stderr or e.stdout or str(e)
+    CLI_SECONDS.observe(time.perf_counter() - t0, engine="pool" if engine is not None else "subprocess",
+                        result="ok" if ok else "error")
+    if ok:
+        observe_timings(out_dir)
 
     # Salva logs
     (out_dir/"error.txt").write_text(f"CMD: {cmd}\n\nSTDOUT:\n{out_text}\n\nSTDERR/ERROR:\n{err}", encoding="utf-8")
 
-    # Pós-processamento com modelo (se existir)
+    # Pós-processamento com modelo (só quando o ativo não tem .npz, ex. model.joblib gravado por fora)
     occ_path = out_dir / "occurrences_v2.json"
-    if ok and occ_path.exists() and MODEL_PATH.exists():
+    if ok and scorer is None and occ_path.exists() and MODELS.get() is not None:
         try:
             occs = json.loads(occ_path.read_text(encoding="utf-8"))
-            model = load_model(MODEL_PATH)
-            occs2 = apply_model(model, occs, boost=True)
-            occ_path.write_text(json.dumps(occs2, ensure_ascii=False, indent=2), encoding="utf-8")
+            write_occurrences(out_dir, apply_saved_model(occs))
         except Exception as e:
             err += f" | model_apply_error: {e}"
             ok = False
 
-    arts=[]
-    for name in ["report.html","report_v2.html","occurrences_v2.json","occurrences.json","resumo.txt","grid_vari.png","grid_ngrdi.png","grid_ifv.png","error.txt"]:
-        add_artifact(arts, out_dir, name)
-    if (out_dir/"thumbs").exists():
-        arts.append({"name":"thumbs/","url":f"/download/{run_id}/thumbs"})
+    if ok:
+        FEATURE_INDEX.index_run_dir(out_dir)  # features das ocorrências para os rótulos futuros
+    if not (ok and CATALOG.index_run(out_dir, normalize_options(cmd), model=MODELS.tag() if MODELS.get() is not None else None)):
+        CATALOG.register(run_id, "error")
+    if ok and key:
+        CACHE.store(key, run_id)
+    if RUNS_MAX_BYTES or RUNS_MAX:
+        CATALOG.evicted(CACHE.evict(RUNS_MAX_BYTES, RUNS_MAX, protect=[run_id]), RUNS_DIR)
+    return {"ok": ok, "run_id": run_id, "artifacts": collect_artifacts(out_dir), "stderr": err, "stdout": out_text, "cmd": cmd}
+
+@app.post("/uploads")
+async def upload_create(payload: Dict[str,Any]):
+    """Abre uma sessão de upload retomável: {filename, size?, sha256?} -> {upload_id, offset, chunk_size}."""
+    return {"ok": True, **UPLOADS.create(payload.get("filename") or "video.mp4", payload.get("size"), payload.get("sha256"))}
+
+@app.get("/uploads/{upload_id}")
+def upload_status(upload_id:str):
+    try:
+        return {"ok": True, **UPLOADS.status(upload_id)}
+    except KeyError:
+        return JSONResponse({"ok": False, "detail": "sessão de upload não encontrada"}, status_code=404)
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id:str, request: Request, offset: int = 0):
+    """Recebe uma parte (corpo cru) a partir de `offset`; 409 devolve o offset atual para retomar;
+    413 se a parte passaria do `size` declarado (nada além do offset devolvido foi gravado)."""
+    try:
+        return {"ok": True, **(await UPLOADS.append(upload_id, offset, request.stream()))}
+    except KeyError:
+        return JSONResponse({"ok": False, "detail": "sessão de upload não encontrada"}, status_code=404)
+    except SizeExceeded as e:
+        return JSONResponse({"ok": False, "detail": "parte passa do tamanho declarado", "offset": e.args[0],
+                             "size": e.args[1]}, status_code=413)
+    except ValueError as e:
+        return JSONResponse({"ok": False, "detail": "offset fora de ordem", "offset": e.args[0]}, status_code=409)
 
+@app.post("/analyze")
+async def analyze(file: Optional[UploadFile] = File(None), options_json: Optional[str] = Form(None),
+                  upload_id: Optional[str] = Form(None), wait: bool = False):
+    """Enfileira a análise e responde na hora com o run_id (acompanhe em /jobs/<run_id>).
+    O vídeo vem em `file` (multipart, gravado em blocos) ou de uma sessão `upload_id` concluída.
+    ?wait=true mantém o comportamento antigo (resposta com artifacts), sem bloquear o event loop."""
+    if file is None and not upload_id:
+        return JSONResponse({"ok": False, "stderr": "envie `file` ou `upload_id`"})
+    run_id = uuid.uuid4().hex[:8]
+    out_dir = RUNS_DIR / run_id
+    try:
+        in_path, digest = await stage_video(out_dir, file, upload_id)
+    except (KeyError, ValueError) as e:
+        return JSONResponse({"ok": False, "run_id": run_id, "stderr": upload_error(e)})
+    resp, fut = enqueue_run(run_id, in_path, out_dir, parse_options(options_json), digest)
+    if fut is not None and wait:
+        return JSONResponse(await asyncio.wrap_future(fut))
     # Sempre 200; cliente usa ok/erro
-    return JSONResponse({"ok": ok, "run_id": run_id, "artifacts": arts, "stderr": err, "stdout": out_text, "cmd": cmd})
+    return JSONResponse(resp)
+
+async def stage_video(out_dir:Path, file:Optional[UploadFile], upload_id:Optional[str])->Tuple[Path, Optional[str]]:
+    """Grava o vídeo (multipart ou sessão de upload concluída) em out_dir + input.json; (caminho, sha256).
+    KeyError = sessão não encontrada; ValueError = sessão incompleta/inválida."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if upload_id:
+        in_path, nbytes, digest = await asyncio.to_thread(UPLOADS.finalize, upload_id, out_dir)
+    else:
+        in_path = out_dir / safe_name(file.filename)
+        nbytes, digest = await save_upload(file, in_path)
+    write_input_info(out_dir, in_path.name, nbytes, digest)
+    return in_path, digest
+
+def upload_error(e:Exception)->str:
+    return "sessão de upload não encontrada" if isinstance(e, KeyError) else str(e)
+
+def parse_options(options_json:Optional[str])->Dict[str,Any]:
+    if options_json:
+        try: return json.loads(options_json)
+        except Exception: pass
+    return {}
+
+def enqueue_run(run_id:str, in_path:Path, out_dir:Path, opts:Dict[str,Any], digest:Optional[str],
+                batch_id:Optional[str]=None)->Tuple[Dict[str,Any], Optional[Future]]:
+    """Cache ou fila: (resposta de /analyze, future do job ou None se veio do cache/foi recusado)."""
+    key = None if opts.get("cache") is False else cache_key(digest, build_cmd(in_path, out_dir, opts))
+    hit = CACHE.lookup(key) if key else None
+    if hit:
+        # mesmo vídeo + mesmas opções: descarta o upload e devolve o run existente
+        shutil.rmtree(out_dir, ignore_errors=True)
+        return {"ok": True, "run_id": hit, "state": "done", "cached": True, "job_url": f"/jobs/{hit}",
+                "artifacts": collect_artifacts(RUNS_DIR / hit)}, None
+    CATALOG.register(run_id, "queued", source="api", batch_id=batch_id, input_name=in_path.name, input_sha256=digest,
+                     out_dir=str(out_dir.resolve()))
+    fut = JOBS.submit(run_id, run_analysis, run_id, in_path, out_dir, opts, key)
+    if fut is None:
+        CATALOG.register(run_id, "rejected")
+        return {"ok": False, "run_id": run_id, "state": "rejected", "stderr": "fila de jobs cheia; tente novamente"}, None
+    return {"ok": True, "run_id": run_id, "state": "queued", "job_url": f"/jobs/{run_id}",
+            "queue_position": JOBS.position(run_id)}, fut
+
+@app.post("/analyze_batch")
+async def analyze_batch(files: Optional[List[UploadFile]] = File(None), options_json: Optional[str] = Form(None),
+                        upload_ids: Optional[str] = Form(None), wait: bool = False):
+    """Lote de vídeos do mesmo voo: cada clipe vira um run (runs/<run_id>, como em /analyze, com cache)
+    enfileirado do mais longo para o mais curto nos workers quentes; runs/<batch_id>/batch.json liga os
+    clipes e, quando todos terminam, occurrences_batch.json junta as ocorrências (com "clip"/"run_id").
+    `files` (multipart, vários) e/ou `upload_ids` (sessões concluídas, separadas por vírgula).
+    Acompanhe em /batches/<batch_id>; ?wait=true responde só no fim."""
+    ids = [u for u in (upload_ids or "").replace(",", " ").split() if u]
+    if not files and not ids:
+        return JSONResponse({"ok": False, "stderr": "envie `files` ou `upload_ids`"})
+    batch_id = uuid.uuid4().hex[:8]
+    batch_dir = RUNS_DIR / batch_id
+    batch_dir.mkdir(parents=True, exist_ok=True)
+    opts = parse_options(options_json)
+    clips = []
+    for f, uid in [(f, None) for f in (files or [])] + [(None, u) for u in ids]:
+        run_id = uuid.uuid4().hex[:8]
+        try:
+            in_path, digest = await stage_video(RUNS_DIR / run_id, f, uid)
+        except (KeyError, ValueError) as e:
+            shutil.rmtree(RUNS_DIR / run_id, ignore_errors=True)
+            clips.append({"input": uid, "run_id": None, "state": "error", "stderr": upload_error(e)})
+            continue
+        clips.append({"input": str(in_path), "run_id": run_id, "digest": digest})
+    for c, name in zip(clips, unique_names(Path(c["input"]) for c in clips)):
+        c["name"] = name
+    futs = []
+    for c in await asyncio.to_thread(longest_first, [c for c in clips if c["run_id"]]):
+        resp, fut = enqueue_run(c["run_id"], Path(c["input"]), RUNS_DIR / c["run_id"], opts, c.pop("digest"), batch_id)
+        c.update(run_id=resp["run_id"], cached=bool(resp.get("cached")))  # cache: run existente
+        if resp["state"] == "rejected":
+            c.update(state="rejected", stderr=resp["stderr"])
+        if fut is not None:
+            futs.append(fut)
+    for c in clips:
+        c["input"] = Path(c["input"]).name
+    write_json(batch_dir / BATCH_NAME, {"batch_id": batch_id, "created": time.time(), "options": opts, "clips": clips})
+    if wait and futs:
+        await asyncio.gather(*[asyncio.wrap_future(f) for f in futs])
+    return JSONResponse(batch_state(batch_id))
+
+def batch_state(batch_id:str)->Optional[Dict[str,Any]]:
+    """Estado do lote: situação de cada clipe (como /jobs/<run_id>) e, com todos encerrados, o índice
+    combinado (refeito se algum clipe foi regravado depois, p. ex. por /rethreshold)."""
+    batch_dir = RUNS_DIR / batch_id
+    try:
+        batch = json.loads((batch_dir / BATCH_NAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    clips = []; counts = {s: 0 for s in ("queued", "running", "done", "error", "rejected")}
+    for c in batch["clips"]:
+        st = (job_state(c["run_id"]) if c.get("run_id") and c.get("state") != "rejected" else None) or {}
+        state = st.get("state") or c.get("state") or "error"
+        counts[state] = counts.get(state, 0) + 1
+        clips.append({**c, "state": state, **{k: st.get(k) for k in ("progress", "eta_s", "occ") if k in st},
+                      **({"stderr": st["stderr"]} if state == "error" and st.get("stderr") else {})})
+    final = counts["queued"] == 0 and counts["running"] == 0
+    resp = {"ok": True, "batch_id": batch_id, "state": "done" if final else "running", "counts": counts, "clips": clips,
+            "options": batch.get("options", {})}
+    if final:
+        done = [{**c, "out": str(RUNS_DIR / c["run_id"])} for c in clips if c["state"] == "done"]
+        index = batch_dir / INDEX_NAME
+        newest = max([(Path(c["out"]) / "occurrences_v2.json").stat().st_mtime for c in done
+                      if (Path(c["out"]) / "occurrences_v2.json").exists()], default=0.0)
+        with _BATCH_LOCK:
+            if "occ" not in batch or not index.exists() or index.stat().st_mtime < newest:
+                batch["occ"] = write_index(batch_dir, done)
+                write_json(batch_dir / BATCH_NAME, batch)
+        resp["occ"] = batch["occ"]
+        resp["artifacts"] = [{"name": n, "url": f"/download/{batch_id}/{n}"} for n in (BATCH_NAME, INDEX_NAME)]
+    return resp
+
+@app.get("/batches/{batch_id}")
+def batch_status(batch_id:str):
+    if (RUNS_DIR / batch_id).resolve().parent != RUNS_DIR.resolve():
+        return JSONResponse({"ok": False, "batch_id": batch_id, "detail": "lote não encontrado"}, status_code=404)
+    st = batch_state(batch_id)
+    if st is None:
+        return JSONResponse({"ok": False, "batch_id": batch_id, "detail": "lote não encontrado"}, status_code=404)
+    return st
+
+@app.get("/runs")
+def runs_list(limit: int = 50, cursor: Optional[str] = None, state: Optional[str] = None, source: Optional[str] = None,
+              batch_id: Optional[str] = None, sha256: Optional[str] = None, since: Optional[float] = None,
+              until: Optional[float] = None, min_occ: Optional[int] = None, option: Optional[List[str]] = Query(None)):
+    """Runs do catálogo, do mais novo para o mais antigo (até PAGE_MAX por página; "next" = cursor da
+    próxima). Filtros: state, source (api|cli), batch_id, sha256 do vídeo, since/until (epoch s), min_occ
+    e option=nome:valor (flag efetiva do CLI, valor em JSON; repetível, ex. option=track:true)."""
+    opts = {}
+    for item in option or []:
+        name, _, value = item.partition(":")
+        try:
+            opts[name] = json.loads(value)
+        except ValueError:
+            opts[name] = value
+    try:
+        page = CATALOG.list_runs(limit, cursor, state, source, batch_id, sha256, since, until, min_occ, opts)
+    except (ValueError, IndexError, TypeError):
+        return JSONResponse({"ok": False, "detail": "cursor inválido"}, status_code=400)
+    return {"ok": True, "limit": max(1, min(limit, PAGE_MAX)), **page}
+
+@app.get("/runs/{run_id}")
+def run_detail(run_id:str):
+    """Registro do run no catálogo (opções, etapas, nº de rótulos) + artefatos, se a pasta ainda existe."""
+    run = CATALOG.get_run(run_id)
+    if run is None:
+        return JSONResponse({"ok": False, "run_id": run_id, "detail": "run não catalogado"}, status_code=404)
+    out_dir = RUNS_DIR / run_id
+    arts = collect_artifacts(out_dir) if out_dir.resolve().parent == RUNS_DIR.resolve() and out_dir.is_dir() else []
+    return {"ok": True, "run": run, "artifacts": arts, "job_url": f"/jobs/{run_id}"}
+
+@app.get("/occurrences")
+def occurrences_query(limit: int = 100, cursor: Optional[str] = None, run_id: Optional[str] = None,
+                      bbox: Optional[str] = None, t0: Optional[float] = None, t1: Optional[float] = None,
+                      type: Optional[str] = None, min_severity: Optional[float] = None,
+                      min_score: Optional[float] = None, labeled: Optional[bool] = None):
+    """Ocorrências de todos os runs do catálogo. bbox=x0,y0,x1,y1 (pixels do frame; as que cruzam a
+    região, via R-tree), t0/t1 (time_s), type, min_severity, min_score (ml.score), labeled=true|false.
+    Paginado por cursor ("next"); cada ocorrência traz run_id e, se rotulada, label (1/0)."""
+    box = None
+    if bbox:
+        try:
+            box = [float(v) for v in bbox.split(",")]
+        except ValueError:
+            box = []
+        if len(box) != 4:
+            return JSONResponse({"ok": False, "detail": "bbox = x0,y0,x1,y1"}, status_code=400)
+    try:
+        page = CATALOG.query_occurrences(limit, cursor, run_id, box, t0, t1, type, min_severity, min_score, labeled)
+    except (ValueError, IndexError, TypeError):
+        return JSONResponse({"ok": False, "detail": "cursor inválido"}, status_code=400)
+    return {"ok": True, "limit": max(1, min(limit, PAGE_MAX)), **page}
+
+@app.get("/metrics")
+def metrics():
+    """Métricas no formato texto do Prometheus (0.0.4)."""
+    return Response(METRICS.render(), media_type=METRICS.CONTENT_TYPE)
+
+@app.get("/jobs")
+def jobs():
+    return {"ok": True, "running": JOBS.running(), "queued": JOBS.pending(), "max_jobs": JOBS.max_workers, "jobs": JOBS.list()}
+
+def job_state(run_id:str)->Optional[Dict[str,Any]]:
+    """Resposta de /jobs/<run_id> (None se o job/run não existe)."""
+    out_dir = RUNS_DIR / run_id
+    st = JOBS.status(run_id, out_dir)
+    if st is None and (out_dir/"occurrences_v2.json").exists():
+        # run de uma execução anterior da API (fora do registro em memória)
+        return {"ok": True, "run_id": run_id, "state": "done", "progress": 1.0, "eta_s": 0.0, "artifacts": collect_artifacts(out_dir)}
+    if st is None:
+        return None
+    return {"ok": st["state"] != "error", **{k: v for k, v in st.items() if k != "ok"}}
+
+@app.get("/jobs/{run_id}")
+def job_status(run_id:str):
+    st = job_state(run_id)
+    if st is None:
+        return JSONResponse({"ok": False, "run_id": run_id, "detail": "job não encontrado"}, status_code=404)
+    return st
+
+def sse(event:str, data:Any, event_id:Optional[int]=None)->str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def thumb_paths(out_dir:Path, frame:int)->Optional[Dict[str,str]]:
+    """Nomes das thumbs do frame (thumbs/frame{N}<ext>, conforme manifest.json), ou None sem manifest."""
+    try:
+        man = json.loads((out_dir/"thumbs"/"manifest.json").read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    ext = man.get("ext", ".png")
+    return {"thumb": f"thumbs/frame{frame}{ext}",
+            "overlay": f"thumbs/frame{frame}_overlay{'.png' if man.get('overlay') == 'layer' else ext}"}
+
+@app.get("/jobs/{run_id}/stream")
+async def job_stream(run_id:str, request: Request, offset: int = 0):
+    """Server-sent events enquanto o job roda:
+    - `occurrence`: cada ocorrência (schema de occurrences_v2.json + `thumb`/`overlay`), assim que o CLI
+      grava o frame em occurrences.ndjson e a thumb do frame existe; `id` = offset no NDJSON
+      (reconexão retoma via Last-Event-ID ou ?offset=);
+    - `progress`: frames_done/frames_total/eta_s (como /jobs/<run_id>);
+    - `done`: resposta final de /jobs/<run_id> (artifacts); o stream termina."""
+    out_dir = RUNS_DIR / run_id
+    if out_dir.resolve().parent != RUNS_DIR.resolve() or job_state(run_id) is None:
+        return JSONResponse({"ok": False, "run_id": run_id, "detail": "job não encontrado"}, status_code=404)
+    last_id = request.headers.get("last-event-id", "")
+    tail = NdjsonTail(out_dir / NDJSON_NAME, int(last_id) if last_id.isdigit() else offset)
+
+    async def events():
+        pending = []; last_prog = None; last_sent = time.monotonic()
+        while not await request.is_disconnected():
+            st = job_state(run_id) or {"ok": False, "run_id": run_id, "state": "error", "detail": "job não encontrado"}
+            final = st["state"] in ("done", "error")
+            now = time.monotonic()
+            pending.extend((end, occ, now) for end, occ in tail.read())
+            while pending:
+                end, occ, seen = pending[0]
+                paths = thumb_paths(out_dir, thumb_frame(occ)) or {}
+                # thumbs gravadas em threads: segura a ocorrência até o overlay existir (ou o job acabar)
+                if not (final or now - seen > SSE_THUMB_WAIT_S or (paths and (out_dir/paths["overlay"]).exists())):
+                    break
+                pending.pop(0)
+                yield sse("occurrence", {**occ, **paths}, end); last_sent = now
+            prog = {k: st.get(k) for k in ("state", "frames_done", "frames_total", "progress", "eta_s", "occ", "queue_position")}
+            if prog != last_prog:
+                yield sse("progress", prog); last_prog = prog; last_sent = now
+            if final:
+                yield sse("done", st)
+                return
+            if now - last_sent > SSE_KEEPALIVE_S:
+                yield ": keep-alive\n\n"; last_sent = now
+            await asyncio.sleep(SSE_POLL_S)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/rethreshold/{run_id}")
+def rethreshold(run_id:str, payload:Dict[str,Any]):
+    """Refaz o filtro com novos limiares sobre runs/<id>/candidates.npz e regrava occurrences_v2.json.
+    Campos ausentes usam os valores da análise original. As thumbs/overlays não são redesenhadas."""
+    out_dir = RUNS_DIR / run_id
+    path = out_dir / "candidates.npz"
+    if out_dir.resolve().parent != RUNS_DIR.resolve() or not path.exists():
+        return JSONResponse({"ok": False, "run_id": run_id, "detail": "run sem candidates.npz"}, status_code=404)
+    job = JOBS.status(run_id, out_dir)
+    if job and job["state"] in ("queued", "running"):
+        return JSONResponse({"ok": False, "run_id": run_id, "detail": "análise ainda em andamento"}, status_code=409)
+    t0 = time.perf_counter()
+    cands = load_candidates(path)
+    try:
+        occs = apply_thresholds(cands, payload.get("min_area"), payload.get("agree_k"),
+                                payload.get("min_severity"), payload.get("soil_guard"), payload.get("track"))
+        occs = apply_saved_model(occs)
+    except (TypeError, ValueError) as e:
+        return JSONResponse({"ok": False, "run_id": run_id, "detail": str(e)}, status_code=400)
+    write_occurrences(out_dir, occs)
+    FEATURE_INDEX.index_run(run_id, occs)
+    CATALOG.set_occurrences(run_id, occs)
+    # o run não corresponde mais às opções da chave de cache original
+    CACHE.forget(run_id)
+    p = cands["params"]
+    thresholds = {k: payload.get(k) if payload.get(k) is not None else p[k] for k in ("min_area", "agree_k", "min_severity", "soil_guard")}
+    thresholds["track"] = bool(p.get("track")) if payload.get("track") is None else bool(payload["track"])
+    return {"ok": True, "run_id": run_id, "occ": len(occs), "thresholds": thresholds,
+            "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1), "artifacts": collect_artifacts(out_dir)}
 
 @app.post("/train")
-async def train(payload: Dict[str,Any]):
+def train(payload: Dict[str,Any], wait: bool = False):
+    """Grava o rótulo (labels.csv + armazém de features) e agenda o re-treino em segundo plano.
+    ?wait=true espera o ajuste terminar (scripts/testes)."""
     run_id = (payload.get("run_id") or "unknown")
     out_dir = RUNS_DIR / run_id
     out_dir.mkdir(parents=True, exist_ok=True)
     path = out_dir / "labels.csv"
     new = not path.exists()
-    hdr = ["ts","frame","time_s","type","label","bbox","evidence_json"]
+    hdr = ["ts","frame","time_s","type","label","bbox","evidence_json","occ_id"]
+    try:
+        frame = int(float(payload.get("frame") or 0))
+    except (TypeError, ValueError):
+        frame = 0  # mesmo fallback do FeatureIndex.rebuild
     with path.open("a", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
         if new: w.writerow(hdr)
-        w.writerow([time.time(), payload.get("frame"), payload.get("time_s"),
+        w.writerow([time.time(), frame, payload.get("time_s"),
                     payload.get("type"), payload.get("label"),
-                    json.dumps(payload.get("bbox")), json.dumps(payload.get("evidence"))])
-    info = fit_and_save(RUNS_DIR, MODEL_PATH)
-    return {"ok": True, "model": info, "model_path": str(MODEL_PATH)}
+                    json.dumps(payload.get("bbox")), json.dumps(payload.get("evidence")), payload.get("occ_id") or ""])
+    # busca por occ_id no índice (maior área do frame só sem occ_id; occ_id desconhecido → None); O(1) por rótulo
+    occ_id = FEATURE_INDEX.add_label(run_id, payload.get("occ_id"), frame,
+                                     label_value(payload.get("label")), run_dir=out_dir)
+    if occ_id is not None:
+        CATALOG.add_label(run_id, occ_id, frame, label_value(payload.get("label")), payload.get("label"))
+        TRAINER.notify()
+    info = TRAINER.flush() if wait else TRAINER.info()
+    return {"ok": True, "model": info, "queued": occ_id is not None, "occ_id": occ_id, "model_path": str(MODEL_PATH)}
 
-@app.get("/download/{run_id}/{path:path}")
-async def download(run_id:str, path:str):
-    base = RUNS_DIR / run_id
+@app.get("/models")
+def models():
+    """Versões guardadas em runs/_models (a ativa com active=true)."""
+    return {"ok": True, "active": MODELS.info(), "versions": MODELS.versions()}
+
+@app.post("/models/rollback")
+def models_rollback(payload: Optional[Dict[str,Any]] = None):
+    """Reativa `version` ({"version": N}; sem ela, a anterior à ativa). O próximo re-treino
+    parte (warm start) da versão reativada."""
+    version = (payload or {}).get("version")
+    try:
+        active = MODELS.rollback(int(version) if version is not None else None)
+    except (KeyError, TypeError, ValueError):
+        return JSONResponse({"ok": False, "detail": f"versão não encontrada: {version}"}, status_code=404)
+    return {"ok": True, "active": active}
+
+def run_finished(run_id:str)->bool:
+    """Run concluído (os artefatos não mudam mais, exceto os de serve_utils.MUTABLE_NAMES)."""
+    state = JOBS.state(run_id)
+    if state is not None:
+        return state in ("done", "error")
+    return (RUNS_DIR / run_id / "occurrences_v2.json").exists()
+
+def run_path(run_id:str, path:str="")->Optional[Path]:
+    """Caminho dentro de runs/<run_id> (None se escapa do run)."""
+    base = (RUNS_DIR / run_id).resolve()
     target = (base / path).resolve()
-    if base not in target.parents and base != target:
+    return target if target == base or base in target.parents else None
+
+@app.get("/download/{run_id}/{path:path}")
+async def download(run_id:str, path:str, request: Request):
+    """Arquivo do run. JSON/NDJSON/HTML/TXT/CSV vêm comprimidos (br ou gzip) conforme Accept-Encoding;
+    os demais aceitam Range. ETag/Last-Modified em todos (If-None-Match/If-Modified-Since -> 304)."""
+    target = run_path(run_id, path)
+    if target is None:
         return JSONResponse({"detail":"Invalid path"}, status_code=400)
     if target.is_dir():
-        items = [f"<li><a href='/download/{run_id}/{p.relative_to(base).as_posix()}'>{p.name}</a></li>" for p in sorted(target.iterdir())]
-        return HTMLResponse("<ul>"+ "\n".join(items) + "</ul>")
-    if not target.exists():
+        return HTMLResponse(dir_listing(RUNS_DIR.resolve(), target, "/download"))
+    try:
+        st = target.stat()
+    except OSError:
+        return JSONResponse({"detail":"Not Found"}, status_code=404)
+    media = mimetypes.guess_type(target.name)[0] or "application/octet-stream"
+    cache = cache_control(path, run_finished(run_id))
+    enc = negotiate_encoding(request.headers.get("accept-encoding"), target)
+    headers = {**validators(st, enc or "", cache), "Vary": "Accept-Encoding"}
+    if not_modified(request.headers, st, enc or ""):
+        return Response(status_code=304, headers=headers)
+    if enc:
+        return StreamingResponse(iter_compressed(target, enc), media_type=media,
+                                 headers={**headers, "Content-Encoding": enc})
+    headers["Accept-Ranges"] = "bytes"
+    try:
+        rng = parse_range(request.headers.get("range"), st.st_size) if if_range_ok(request.headers, st) else None
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{st.st_size}"})
+    if rng is None:
+        return FileResponse(str(target), media_type=media, headers=headers)
+    start, end = rng
+    return StreamingResponse(iter_file_range(target, start, end), status_code=206, media_type=media,
+                             headers={**headers, "Content-Range": f"bytes {start}-{end}/{st.st_size}",
+                                      "Content-Length": str(end - start + 1)})
+
+@app.get("/bundle/{run_id}/thumbs.tar")
+def thumbs_bundle(run_id:str, overlays: bool = True):
+    """Todas as thumbs do run num .tar em streaming (uma requisição em vez de uma por imagem)."""
+    thumbs_dir = run_path(run_id, "thumbs")
+    if thumbs_dir is None or not thumbs_dir.is_dir():
         return JSONResponse({"detail":"Not Found"}, status_code=404)
-    return FileResponse(str(target))
+    with os.scandir(thumbs_dir) as it:
+        names = sorted(e.name for e in it if e.is_file() and not e.name.endswith(".tmp"))
+    if not overlays:
+        names = [n for n in names if "_overlay" not in n]
+    files = [(thumbs_dir / n, f"thumbs/{n}") for n in names]
+    return StreamingResponse(iter_tar(files), media_type="application/x-tar",
+                             headers={"Content-Disposition": f'attachment; filename="{run_id}_thumbs.tar"',
+                                      "Cache-Control": cache_control("thumbs.tar", run_finished(run_id))})
 
 if __name__ == "__main__":
     uvicorn.run("veg_product_api_v07c:app", host="0.0.0.0", port=8000, reload=False)
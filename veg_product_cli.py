@@ -1,25 +1,119 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-veg_product_cli.py — v0.7c2
+veg_product_cli.py — v0.7d
 Compat:
 - aceita flags com hífen OU sublinhado:
   --min-area / --min_area
   --agree-k / --agree_k
   --min-severity / --min_severity
+Amostragem (video_utils.FrameSampler):
+  --every N | --every-seconds S, --sampling auto|grab|seek
+  contagens de frames decodificados vs analisados em resumo.txt
+Paralelismo (parallel_utils.run_parallel):
+  --workers N  decodificação no processo principal + N workers de análise
+               (memória compartilhada); occurrences_v2.json idêntico ao serial
+Índices (index_utils.IndexEngine):
+  --index-precision float32|float16|lut  (float32 = resultado idêntico a indices_from_bgr)
+Thumbs (thumb_utils.ThumbWriter):
+  --thumb-format png|jpg|webp, --thumb-quality, --thumb-max-edge, --thumbs-only-occ,
+  --overlay full|layer, --thumb-threads, --thumb-queue (fila limitada/backpressure)
+Progresso:
+  --progress  grava progress.json {state, frames_done, frames_total, occ, elapsed_s, eta_s}
+Resolução (tile_utils.TiledAnalyzer):
+  padrão: frames > 1280 px reduzidos 2x; --tile-size N analisa em resolução cheia em blocos NxN
+  (--tile-overlap, --tile-threads), com máscara idêntica à do frame inteiro; --pyramid refina em
+  resolução cheia só os blocos com candidatos na passada grosseira
+Trilhas (track_utils.Tracker):
+  --track  agrupa a mesma mancha em frames amostrados consecutivos (IoU/centro, --track-iou,
+           --track-gap) com compensação de movimento (--track-motion phase|none); uma ocorrência
+           por trilha (detecção representativa + "track") e, no modo serial, thumb com overlay só
+           do frame representativo
+Cena parada / amostragem adaptativa (change_utils.ChangeGate):
+  --skip-static  frame amostrado quase igual ao último analisado (diferença de luminância <
+                 --static-threshold, sem deslocamento) reaproveita o resultado dele: ocorrências
+                 copiadas com "reused_from" (thumbs do frame fonte), sem análise nem thumbs
+  --adaptive     passo entre every/--adaptive-range e every x --adaptive-range: mais longo com a
+                 cena parada, mais curto com mudança rápida (--fast-threshold ou deslocamento grande)
+Regiões (region_utils.region_stats):
+  componentes conexos + médias por imagem integral (bbox) ou --exact-means (pixels da mancha)
+Motor importável:
+  analyze_video(input, out_dir, options) faz o trabalho de main() sem subprocesso (API: engine_utils.EnginePool);
+  main() é só o invólucro de linha de comando, com as mesmas flags e saídas
+Candidatos (candidate_utils):
+  --candidates  grava candidates.npz com todas as manchas antes do filtro (agree_k 2 e 3) e as
+                stats do soil-guard por frame; a API refaz o filtro sem reprocessar o vídeo
+Saídas (output_utils):
+  occurrences.ndjson gravado a cada frame (crash preserva o parcial); occurrences_v2.json
+  (compatibilidade) montado no fim a partir dele; --output-format ndjson,npz escolhe o que fica
+  além do JSON (npz = colunar para análise)
+Modelo (scorer_utils):
+  --model runs/model.npz  pontua as ocorrências de cada frame no próprio laço (ml.score, boost de
+                confiança/tipo) com o produto escalar dos coeficientes — sem sklearn/joblib;
+                .joblib também é aceito (joblib importado só nesse caso)
+Tempos (metrics_utils):
+  timings.json no fim de todo run: tempos por etapa (n, média, p50..p99, máx), frames por tipo,
+  contornos e bytes gravados; etapas do analyze_frame medidas também dentro dos workers
+Lote (batch_utils):
+  --input-dir DIR | --manifest lista.txt|.json  (no lugar de --input) analisa vários vídeos do
+                mesmo voo em --out/<clipe>/ (saídas de um run avulso) + batch.json e
+                occurrences_batch.json (ocorrências de todos os clipes com "clip"/"run_id");
+                --batch-jobs N clipes ao mesmo tempo, o mais longo primeiro, em processos quentes
+                (modelo carregado uma vez por processo)
+Mosaico (mosaic_utils.Mosaic):
+  --mosaic      registra os frames analisados entre si (correlação de fase; ORB + RANSAC quando
+                falha) em versão reduzida (--mosaic-edge px) e acumula VARI/NGRDI/IFV num raster
+                único de --mosaic-size células (média por célula; a célula cresce com o voo, a
+                memória não): mosaic.tif (3 bandas float32) + mosaic.tfw + mosaic.json e prévias
+                mosaic_<índice>.png; --mosaic-memmap mantém os acumuladores em disco
+Catálogo (catalog_utils.RunCatalog):
+  --catalog runs/_catalog/catalog.sqlite  registra o run no fim (opções, etapas do timings.json,
+                ocorrências com índice espacial/temporal) numa transação; no lote, também o lote
+                (batch_id = --run-id ou nome da pasta --out). Mesmo arquivo que a API consulta
+Sprite (thumb_utils.build_sprites):
+  --sprite  no fim, cola os overlays dos frames com ocorrência em folhas JPEG do tamanho do card
+            (thumbs/sprite_<p>.jpg + sprite.json); relatório/painel usam em vez de uma imagem por card
 """
-import argparse, json, sys
+import argparse, copy, functools, json, os, sys, time
 from pathlib import Path
+from typing import Any, Dict, Optional, Union
 import numpy as np
 import cv2
 
+from video_utils import FrameSampler, STRATEGIES
+from parallel_utils import run_parallel
+from index_utils import get_engine, PRECISIONS
+from region_utils import region_stats, contours_of
+from tile_utils import TILE_DEFAULT, OVERLAP_DEFAULT, get_tiler
+from track_utils import IOU_MIN, MAX_GAP, MOTIONS, RepresentativeThumbs, Tracker, estimate_shift, frame_signature
+from change_utils import ADAPTIVE_RANGE, FAST_THRESHOLD, STATIC_THRESHOLD, ChangeGate, reuse_occurrences
+from thumb_utils import ThumbWriter, THUMB_FORMATS, OVERLAY_MODES, build_sprites, thumb_frame
+from candidate_utils import (AGREE_KS, MIN_BOX, REGION_COLS, CandidateStore, frame_candidates, is_soil,
+                             make_occurrence, occurrence_id)
+from scorer_utils import apply_model, load_scorer
+from output_utils import OccurrenceWriter, parse_formats
+from metrics_utils import TIMINGS_NAME, Lap, StageTimer, bytes_written, write_timings
+from batch_utils import list_clips, run_batch
+from mosaic_utils import MOSAIC_EDGE, MOSAIC_SIZE, Mosaic
+from catalog_utils import RunCatalog
+
+# Opções do lote (não vão para o analyze_video de cada clipe)
+BATCH_OPTS = ("input", "out", "input_dir", "manifest", "batch_jobs")
+# Fora das opções gravadas no catálogo (caminhos e flags de execução)
+CATALOG_SKIP_OPTS = {"input", "out", "catalog", "progress"} | set(BATCH_OPTS)
+
+# Versão da saída do CLI (entra na chave do cache de resultados da API)
+CLI_VERSION = "0.7d"
+
 def ensure_dir(p: Path):
     p.mkdir(parents=True, exist_ok=True)
 
 # Template inline de fallback (mantém funcionamento do relatório)
 REPORT_INLINE = "<!doctype html><meta charset='utf-8'><p>Relatório gerado (use report_backend_auto.html para layout completo).</p>"
 
+@functools.lru_cache(maxsize=1)
 def read_report_template():
+    # lido uma vez por processo (workers da API reutilizam entre jobs)
     here = Path(__file__).resolve().parent
     tpl = here / "report_backend_auto.html"
     if tpl.exists():
@@ -34,98 +128,359 @@ def indices_from_bgr(frame):
     ifv = g / (r + g + b + 1e-6)
     return np.clip(vari,-1,1), np.clip(ngrdi,-1,1), np.clip(ifv,0,1)
 
-def main():
+class ProgressFile:
+    """progress.json legível por máquina (API /jobs): gravado de forma atômica (tmp + rename)
+    no máximo a cada `interval` segundos."""
+    def __init__(self, path:Path, total:int, interval:float=0.5):
+        self.path = path; self.total = int(total); self.interval = interval
+        self.t0 = time.time(); self.last = 0.0
+
+    def update(self, done:int, occ:int, state:str="running", force:bool=False):
+        now = time.time()
+        if not force and now - self.last < self.interval:
+            return
+        self.last = now
+        el = now - self.t0
+        eta = (el / done) * max(0, self.total - done) if done and self.total else None
+        data = {"state": state, "frames_done": int(done), "frames_total": self.total, "occ": int(occ),
+                "elapsed_s": round(el, 2), "eta_s": round(eta, 1) if eta is not None else None}
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+def tiler_for(args):
+    """TiledAnalyzer do processo para as flags de bloco (None no modo antigo)."""
+    if args.tile_size <= 0 and not args.pyramid:
+        return None
+    return get_tiler(args.index_precision, args.tile_size or TILE_DEFAULT, args.tile_overlap, args.tile_threads, args.pyramid)
+
+def analyze_frame(frame, idx, fps, args, thumbs:ThumbWriter):
+    """Analisa um frame amostrado, agenda as thumbs e retorna (ocorrências, pulado_pelo_soil_guard,
+    candidatos do frame ou None sem --candidates, assinatura p/ movimento ou None, tempos das etapas
+    (metrics_utils.Lap.result(), para o timings.json))."""
+    lap = Lap()
+    H, W = frame.shape[:2]
+    # assinatura para o deslocamento entre frames (trilhas; guardado também no candidates.npz)
+    sig = frame_signature(frame) if args.track_motion == "phase" and (args.track or args.candidates) else None
+    if sig is not None: lap("signature")
+    # agree_k principal + os do armazém de candidatos
+    ks = [args.agree_k] + ([ak for ak in AGREE_KS if ak != args.agree_k] if args.candidates else [])
+    k = cv2.getStructuringElement(cv2.MORPH_ELLIPSE,(5,5))
+    tiler = tiler_for(args)
+    tiled = tiler is not None
+    if tiled:
+        # Resolução cheia em blocos (tile_utils): índices e máscaras abertas já costurados
+        vari, ngrdi, ifv, masks, (mF, mN) = tiler.compute(frame, ks)
+        sx = sy = 1.0
+    else:
+        work = cv2.resize(frame, (W//2, H//2)) if max(W,H) > 1280 else frame
+        sx = frame.shape[1]/work.shape[1]; sy = frame.shape[0]/work.shape[0]
+        # Índices + consenso num passo só, com buffers reutilizados (index_utils)
+        engine = get_engine(args.index_precision)
+        vari, ngrdi, ifv, agree = engine.compute(work, args.agree_k)
+        mF, mN = float(ifv.mean()), float(ngrdi.mean())
+    lap("indices")
+
+    # Soil-guard (ativado por padrão): se o frame é majoritariamente solo, não reporta.
+    # Com --candidates o frame segue para o armazém (o guard pode ser desligado depois).
+    soil = not args.disable_soil_guard and bool(is_soil(mF, mN))
+    if soil and not args.candidates:
+        thumbs.submit(idx, frame, [], has_occ=False); lap("thumbs")
+        return [], True, None, sig, lap.result()
+
+    # Máscara: consenso (agree_k) entre VARI<0.02, NGRDI<0.02 e IFV<0.30 (index_utils.THRESHOLDS)
+    if not tiled:
+        masks = {args.agree_k: cv2.morphologyEx(agree, cv2.MORPH_OPEN, k, iterations=1)}
+        for ak in ks[1:]:
+            masks[ak] = cv2.morphologyEx(engine.consensus(work.shape, ak), cv2.MORPH_OPEN, k, iterations=1)
+        lap("mask_morphology")
+
+    # Estatísticas de todas as manchas num passo (region_utils); filtro vetorizado
+    rs = region_stats(masks[args.agree_k], vari, ngrdi, ifv, exact=args.exact_means)
+    cands = None
+    if args.candidates:
+        by_k = {args.agree_k: rs}
+        for ak in ks[1:]:
+            by_k[ak] = region_stats(masks[ak], vari, ngrdi, ifv, exact=args.exact_means)
+        cands = frame_candidates(by_k, mF, mN, sx, sy)
+    lap("region_stats")
+    if soil:
+        thumbs.submit(idx, frame, [], has_occ=False); lap("thumbs")
+        return [], True, cands, sig, lap.result()
+
+    keep = (rs["area"] >= args.min_area) & (rs["w"]*rs["h"] >= MIN_BOX) & (rs["severity"] >= args.min_severity)
+    cnts = [(c.astype(np.float32) * [sx, sy]).astype(np.int32) for c in contours_of(rs["labels"], keep)]
+    occs = [make_occurrence(idx, fps, {c: rs[c][i] for c in REGION_COLS}, sx, sy, occurrence_id(args.run_id, idx, args.agree_k, i))
+            for i in np.flatnonzero(keep)]
+    lap("contours"); lap.count("contornos", len(cnts))
+
+    thumbs.submit(idx, frame, cnts, has_occ=bool(occs)); lap("thumbs")
+    return occs, False, cands, sig, lap.result()
+
+def build_parser()->argparse.ArgumentParser:
     ap = argparse.ArgumentParser()
-    ap.add_argument("--input", required=True)
+    ap.add_argument("--input", default=None, help="vídeo a analisar (ou --input-dir / --manifest para um lote)")
     ap.add_argument("--out", required=True)
     ap.add_argument("--every", type=int, default=30, help="processar a cada N frames (padrão 30)")
+    ap.add_argument("--every-seconds","--every_seconds", dest="every_seconds", type=float, default=None, help="amostrar por tempo (s); tem prioridade sobre --every")
+    ap.add_argument("--sampling", default="auto", choices=list(STRATEGIES), help="estratégia de amostragem: auto|grab|seek (padrão auto)")
     # aliases hífen/sublinhado
     ap.add_argument("--min-area","--min_area", dest="min_area", type=int, default=6000, help="área mínima (px)")
     ap.add_argument("--agree-k","--agree_k", dest="agree_k", type=int, default=2, choices=[2,3], help="concordância mínima entre índices (2 ou 3)")
     ap.add_argument("--min-severity","--min_severity", dest="min_severity", type=float, default=0.9, help="severidade mínima")
     ap.add_argument("--disable-soil-guard", action="store_true", help="desativar guard de solo (por padrão está ATIVO)")
-    args = ap.parse_args()
+    ap.add_argument("--index-precision","--index_precision", dest="index_precision", default="float32", choices=list(PRECISIONS), help="precisão dos índices: float32 (exata) | float16 | lut")
+    ap.add_argument("--tile-size","--tile_size", dest="tile_size", type=int, default=0, help="analisar em resolução cheia em blocos deste lado (px; 0 = modo antigo, reduz 2x frames > 1280 px)")
+    ap.add_argument("--tile-overlap","--tile_overlap", dest="tile_overlap", type=int, default=OVERLAP_DEFAULT, help="margem entre blocos (px; mínimo = alcance da abertura morfológica)")
+    ap.add_argument("--tile-threads","--tile_threads", dest="tile_threads", type=int, default=4, help="threads de análise dos blocos")
+    ap.add_argument("--pyramid", action="store_true", help="passada grosseira (1/2) e resolução cheia só nos blocos com candidatos (implica blocos de 512 px sem --tile-size)")
+    ap.add_argument("--exact-means","--exact_means", dest="exact_means", action="store_true", help="médias dos índices só nos pixels da mancha (padrão: na bbox)")
+    ap.add_argument("--thumb-format","--thumb_format", dest="thumb_format", default="png", choices=list(THUMB_FORMATS), help="formato das thumbs: png|jpg|webp")
+    ap.add_argument("--thumb-quality","--thumb_quality", dest="thumb_quality", type=int, default=90, help="qualidade JPEG/WebP (1–100)")
+    ap.add_argument("--thumb-max-edge","--thumb_max_edge", dest="thumb_max_edge", type=int, default=0, help="reduz thumbs para este lado máximo (px; 0 = resolução original)")
+    ap.add_argument("--thumbs-only-occ","--thumbs_only_occ", dest="thumbs_only_occ", action="store_true", help="gravar thumbs só de frames com ocorrências")
+    ap.add_argument("--overlay", default="full", choices=list(OVERLAY_MODES), help="overlay: full (imagem completa) | layer (camada PNG só com contornos)")
+    ap.add_argument("--thumb-threads","--thumb_threads", dest="thumb_threads", type=int, default=2, help="threads de gravação de thumbs (0 = síncrono)")
+    ap.add_argument("--thumb-queue","--thumb_queue", dest="thumb_queue", type=int, default=8, help="tamanho máximo da fila de thumbs pendentes")
+    ap.add_argument("--candidates", action="store_true", help="gravar candidates.npz (manchas antes do filtro) para refiltrar sem reprocessar")
+    ap.add_argument("--run-id","--run_id", dest="run_id", default=None, help="id do run nos occ_id das ocorrências (padrão: nome da pasta --out)")
+    ap.add_argument("--output-format","--output_format", dest="output_format", default="ndjson", help="saídas além de occurrences_v2.json, separadas por vírgula: ndjson, npz (ou json = só o JSON)")
+    ap.add_argument("--model", default=None, help="modelo leve (.npz de coeficientes ou .joblib) aplicado às ocorrências durante a análise")
+    ap.add_argument("--sprite", action="store_true", help="gerar folhas de sprite das thumbs dos frames com ocorrência (thumbs/sprite.json)")
+    ap.add_argument("--track", action="store_true", help="agrupar a mesma mancha em frames consecutivos numa ocorrência só (trilhas)")
+    ap.add_argument("--track-iou","--track_iou", dest="track_iou", type=float, default=IOU_MIN, help="IoU mínimo para associar uma detecção à trilha")
+    ap.add_argument("--track-gap","--track_gap", dest="track_gap", type=int, default=MAX_GAP, help="frames amostrados sem detecção antes de fechar a trilha")
+    ap.add_argument("--track-motion","--track_motion", dest="track_motion", default="phase", choices=list(MOTIONS), help="compensação de movimento entre frames: phase (correlação de fase) | none")
+    ap.add_argument("--skip-static","--skip_static", dest="skip_static", action="store_true", help="reaproveitar o resultado do último frame analisado quando a cena não mudou (sem análise nem thumbs)")
+    ap.add_argument("--static-threshold","--static_threshold", dest="static_threshold", type=float, default=STATIC_THRESHOLD, help="diferença média de luminância (0–255) abaixo da qual a cena é considerada parada")
+    ap.add_argument("--adaptive", action="store_true", help="amostragem adaptativa: passo maior com a cena parada, menor com mudança rápida")
+    ap.add_argument("--adaptive-range","--adaptive_range", dest="adaptive_range", type=int, default=ADAPTIVE_RANGE, help="fator máximo de variação do passo (every/R .. every*R)")
+    ap.add_argument("--fast-threshold","--fast_threshold", dest="fast_threshold", type=float, default=FAST_THRESHOLD, help="diferença de luminância acima da qual a amostragem fica mais densa")
+    ap.add_argument("--progress", action="store_true", help="gravar progress.json (frames processados/total, ETA) durante a execução")
+    ap.add_argument("--workers", type=int, default=1, help="processos de análise (1 = serial; >1 = pipeline com memória compartilhada)")
+    ap.add_argument("--mosaic", action="store_true", help="mosaico do talhão: VARI/NGRDI/IFV de todos os frames analisados num raster (mosaic.tif)")
+    ap.add_argument("--mosaic-size","--mosaic_size", dest="mosaic_size", type=int, default=MOSAIC_SIZE, help="lado do raster do mosaico em células (memória fixa: 16 bytes por célula)")
+    ap.add_argument("--mosaic-edge","--mosaic_edge", dest="mosaic_edge", type=int, default=MOSAIC_EDGE, help="lado maior do frame reduzido usado no registro/acúmulo do mosaico (px)")
+    ap.add_argument("--mosaic-memmap","--mosaic_memmap", dest="mosaic_memmap", action="store_true", help="acumuladores do mosaico em arquivo mapeado (disco) em vez de RAM")
+    ap.add_argument("--catalog", default=None, help="catálogo SQLite de runs a atualizar no fim (ex.: runs/_catalog/catalog.sqlite)")
+    ap.add_argument("--input-dir","--input_dir", dest="input_dir", default=None, help="lote: analisar todos os vídeos da pasta (saídas em --out/<clipe>/)")
+    ap.add_argument("--manifest", default=None, help="lote: lista de vídeos (texto, um por linha, ou JSON)")
+    ap.add_argument("--batch-jobs","--batch_jobs", dest="batch_jobs", type=int, default=1, help="lote: clipes analisados ao mesmo tempo (0 = um por CPU)")
+    return ap
 
-    in_path = Path(args.input).expanduser().resolve()
-    out_dir = Path(args.out).expanduser().resolve()
+def options_namespace(options:Union[None, Dict[str,Any], argparse.Namespace]=None)->argparse.Namespace:
+    """Opções do CLI como Namespace: defaults de build_parser() atualizados por `options`
+    (dict com os nomes `dest` das flags, ex. {"min_area": 4000, "disable_soil_guard": True})."""
+    ns = build_parser().parse_args(["--input", "", "--out", ""])
+    items = vars(options).items() if isinstance(options, argparse.Namespace) else (options or {}).items()
+    for k, v in items:
+        if k not in vars(ns):
+            raise ValueError(f"opção desconhecida: {k}")
+        setattr(ns, k, v)
+    return ns
+
+def warm_up():
+    """Pré-carrega o que a primeira análise pagaria (template do relatório, motor de índices)."""
+    read_report_template()
+    get_engine("float32")
+
+def analyze_video(input_path:Union[str,Path], out_dir:Union[str,Path],
+                  options:Union[None, Dict[str,Any], argparse.Namespace]=None)->Dict[str,Any]:
+    """Analisa o vídeo e grava as saídas do CLI em out_dir; retorna o resumo (as chaves de resumo.txt).
+    Levanta IOError se o vídeo (ou o --model) não abre e ValueError com --output-format inválido."""
+    args = options_namespace(options)
+    in_path = Path(input_path).expanduser().resolve()
+    out_dir = Path(out_dir).expanduser().resolve()
+    args.input, args.out = str(in_path), str(out_dir)
+    args.run_id = args.run_id or out_dir.name
+    formats = parse_formats(args.output_format)
     ensure_dir(out_dir); ensure_dir(out_dir/"thumbs")
+    timer = StageTimer()  # timings.json: tempos por etapa, contagens e bytes gravados
+    scorer = None
+    if args.model:
+        with timer.stage("model_load"):
+            scorer = load_scorer(args.model)
 
     cap = cv2.VideoCapture(str(in_path))
     if not cap.isOpened():
-        print("ERRO: não abriu vídeo", file=sys.stderr); sys.exit(2)
+        raise IOError("não abriu vídeo")
 
     fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
     W = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)); H=int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
-    all_occs = []
-    idx = 0
-    while True:
-        ok, frame = cap.read()
-        if not ok: break
-        if idx % args.every != 0:
-            idx += 1; continue
+    sampler = FrameSampler(cap, every=args.every, every_seconds=args.every_seconds, strategy=args.sampling, fps=fps)
+    # Thumbs: fila limitada em threads (serial) ou gravação síncrona nos workers (--workers)
+    thumbs = ThumbWriter(out_dir/"thumbs", fmt=args.thumb_format, quality=args.thumb_quality, max_edge=args.thumb_max_edge,
+                         only_occ=args.thumbs_only_occ, overlay=args.overlay, threads=0 if args.workers > 1 else args.thumb_threads,
+                         queue=args.thumb_queue)
+    thumbs.write_manifest()
+    # cena parada / passo adaptativo: filtra os frames antes da análise (também com --workers)
+    decoded = timer.timed(sampler, "decode")
+    gate = ChangeGate(sampler, args.static_threshold if args.skip_static else None,
+                      args.adaptive_range if args.adaptive else 1, args.fast_threshold, frames=decoded) if args.skip_static or args.adaptive else None
+    source = gate if gate is not None else decoded
+    mosaic = Mosaic(out_dir, args.mosaic_size, args.mosaic_edge, args.mosaic_memmap, args.index_precision) if args.mosaic else None
+    if mosaic is not None:
+        source = mosaic.tap(source)  # no processo principal, na ordem dos frames (também com --workers)
+    tracker = Tracker(args.track_iou, args.track_gap) if args.track else None
+    # trilhas no modo serial: thumb com overlay só no frame representativo de cada trilha
+    rep_thumbs = RepresentativeThumbs(thumbs) if tracker is not None and args.workers <= 1 else None
+    if args.workers > 1:
+        frames = run_parallel(source, (H, W, 3), analyze_frame, {"fps": fps, "args": args, "thumbs": thumbs}, args.workers)
+    else:
+        frames = ((idx, analyze_frame(frame, idx, fps, args, rep_thumbs or thumbs)) for idx, frame in source)
+    progress = ProgressFile(out_dir/"progress.json", sampler.expected()) if args.progress else None
+    store = CandidateStore(fps, {"min_area": args.min_area, "agree_k": args.agree_k, "min_severity": args.min_severity,
+                                 "soil_guard": not args.disable_soil_guard, "exact_means": args.exact_means,
+                                 "index_precision": args.index_precision, "version": CLI_VERSION,
+                                 "run_id": args.run_id,
+                                 "track": {"iou_min": args.track_iou, "max_gap": args.track_gap} if args.track else None}) if args.candidates else None
+    writer = OccurrenceWriter(out_dir, formats)
+    tiler = tiler_for(args) if args.workers <= 1 else None  # contagem de blocos (só no modo serial)
+    tiles0 = dict(tiler.stats) if tiler else None
+    n_sampled = 0; n_soil = 0; n_reused = 0; occ_frames = []; prev_sig = None
+    last = None  # (ocorrências, solo, candidatos) do último frame analisado, para os frames parados
 
-        work = cv2.resize(frame, (W//2, H//2)) if max(W,H) > 1280 else frame
-        vari, ngrdi, ifv = indices_from_bgr(work)
-
-        # Soil-guard (ativado por padrão): se o frame é majoritariamente solo, não reporta
-        if not args.disable_soil_guard:
-            if float(ifv.mean()) < 0.28 and float(ngrdi.mean()) < 0.02:
-                overlay = frame.copy()
-                cv2.imwrite(str(out_dir/"thumbs"/f"frame{idx}.png"), frame)
-                cv2.imwrite(str(out_dir/"thumbs"/f"frame{idx}_overlay.png"), overlay)
-                idx += 1; continue
-
-        # Máscara: consenso entre índices com thresholds conservadores
-        m1 = vari < 0.02        # VARI baixo
-        m2 = ngrdi < 0.02       # NGRDI baixo
-        m3 = ifv   < 0.30       # IFV baixo
-        agree = (m1.astype(np.uint8)+m2.astype(np.uint8)+m3.astype(np.uint8)) >= args.agree_k
-
-        k = cv2.getStructuringElement(cv2.MORPH_ELLIPSE,(5,5))
-        mask = cv2.morphologyEx(agree.astype(np.uint8)*255, cv2.MORPH_OPEN, k, iterations=1)
-        cnts,_ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        overlay = frame.copy()
-        sx = frame.shape[1]/work.shape[1]; sy = frame.shape[0]/work.shape[0]
+    def emit(occs):
+        if scorer is not None:
+            with timer.stage("model"):
+                apply_model(scorer, occs, boost=True)  # lote do frame / das trilhas fechadas
+        with timer.stage("output"):
+            writer.add(occs)  # uma linha NDJSON por ocorrência, já no disco
+            occ_frames.extend(dict.fromkeys(thumb_frame(o) for o in occs))
+            if rep_thumbs is not None: rep_thumbs.settle(tracker.held_frames(), occs)
+
+    def process(idx, occs, soil, cands, shift, src=None):
+        nonlocal n_sampled, n_soil, n_reused
+        n_sampled += 1
+        if src is None: n_soil += int(soil)
+        else: n_reused += 1
+        if tracker is not None:
+            with timer.stage("tracking"):
+                occs = tracker.update(occs, shift)
+        emit(occs)
+        if store is not None:
+            with timer.stage("candidates"):
+                store.add(idx, cands, shift, src)
+        if progress: progress.update(n_sampled, writer.count)
+
+    def reuse(static):
+        # frames parados: resultado do frame fonte, sem deslocamento
+        for idx, src in static:
+            occs, soil, cands = last
+            with timer.stage("reuse"):
+                occs = reuse_occurrences(occs, idx, fps)
+            process(idx, occs, soil, cands, (0.0, 0.0), src)
+
+    try:
+        for idx, (occs, soil, cands, sig, perf) in frames:
+            timer.merge(perf)  # etapas do analyze_frame (também as medidas nos workers)
+            if gate is not None:
+                reuse(gate.pop_static(before=idx))
+                last = (copy.deepcopy(occs), soil, cands)  # antes do modelo (emit) alterar as ocorrências
+            if sig is not None:
+                with timer.stage("motion"):
+                    shift = estimate_shift(prev_sig, sig, W)
+            else:
+                shift = (0.0, 0.0)
+            prev_sig = sig
+            process(idx, occs, soil, cands, shift)
+        if gate is not None:
+            reuse(gate.pop_static())
+        if tracker is not None:
+            emit(tracker.flush())
+    finally:
+        cap.release()  # o processo pode continuar vivo (worker da API)
+    with timer.stage("thumbs_flush"):
+        thumbs.close()  # espera a fila de thumbs (serial) esvaziar
+    with timer.stage("output_close"):
+        writer.close()
+    if args.sprite:
+        with timer.stage("sprites"):
+            build_sprites(out_dir/"thumbs", occ_frames)
+    if store is not None:
+        with timer.stage("candidates_save"):
+            store.save(out_dir/"candidates.npz")
+    if gate is not None:
+        timer.samples["change_gate"] = gate.times
+    if mosaic is not None:
+        with timer.stage("mosaic_save"):
+            mosaic_info = mosaic.finish()
+        timer.samples["mosaic"] = mosaic.times
+    st = sampler.stats
+    summary = {"versao": CLI_VERSION, "amostragem": st["estrategia"], "codec": st["codec"], "passo": st["passo"], "fps": fps,
+               "frames_decodificados": st["frames_grab"]+st["frames_bgr"], "frames_convertidos_bgr": st["frames_bgr"],
+               "seeks": st["seeks"], "frames_amostrados": n_sampled, "frames_analisados": n_sampled-n_soil-n_reused,
+               "frames_solo": n_soil, "occ": writer.count}
+    if gate is not None:
+        summary["frames_reutilizados"] = n_reused  # cena parada: resultado do último frame analisado
+        if args.adaptive:
+            summary["passo_min"] = gate.stats["passo_min"]; summary["passo_max"] = gate.stats["passo_max"]
+    if tracker is not None:
+        summary["deteccoes"] = tracker.n_in  # antes do agrupamento em trilhas (occ = trilhas)
+    if tiler is not None:
+        summary["blocos"] = tiler.stats["tiles"] - tiles0["tiles"]
+        summary["blocos_resolucao_cheia"] = tiler.stats["refined"] - tiles0["refined"]
+    if mosaic is not None:
+        summary["mosaico_frames"] = mosaic_info["frames"]; summary["mosaico_sem_registro"] = mosaic_info["sem_registro"]
+        if mosaic_info.get("raster"):
+            r = mosaic_info["raster"]
+            summary["mosaico_raster"] = f"{r['largura']}x{r['altura']}"; summary["mosaico_pixel_ref_px"] = r["pixel_ref_px"]
+    if scorer is not None:
+        summary["modelo"] = getattr(scorer, "version", None) or Path(args.model).name
+    with timer.stage("report"):
+        (out_dir/"resumo.txt").write_text("".join(f"{k}={v}\n" for k, v in summary.items()), encoding="utf-8")
+        (out_dir/"report.html").write_text(read_report_template(), encoding="utf-8")
+    if progress:
+        progress.total = n_sampled
+        progress.update(n_sampled, writer.count, state="done", force=True)
+    # por último: os bytes incluem todos os artefatos (menos o vídeo de entrada, se estiver em out_dir)
+    write_timings(out_dir/TIMINGS_NAME, {
+        "versao": CLI_VERSION, "run_id": args.run_id, "wall_s": round(timer.wall(), 3), "workers": args.workers,
+        "frames": {"decodificados": summary["frames_decodificados"], "amostrados": n_sampled,
+                   "analisados": summary["frames_analisados"], "solo": n_soil, "reutilizados": n_reused},
+        "contornos": timer.counts.get("contornos", 0), "ocorrencias": writer.count,
+        "bytes": bytes_written(out_dir, exclude=[in_path]), "etapas": timer.summary()})
+    if args.catalog:
+        catalog = RunCatalog(args.catalog)
+        try:
+            opts = {k: v for k, v in vars(args).items() if k not in CATALOG_SKIP_OPTS}
+            catalog.index_run(out_dir, opts, source="cli", run_id=args.run_id, created=time.time() - timer.wall(),
+                              input_name=in_path.name)
+        finally:
+            catalog.close()
+    return summary
+
+def analyze_batch(args:argparse.Namespace)->Dict[str,Any]:
+    """Lote (--input-dir / --manifest): run_batch() com as demais flags em cada clipe."""
+    clips = list_clips(args.input_dir, args.manifest)
+    options = {k: v for k, v in vars(args).items() if k not in BATCH_OPTS}
+    options_namespace(options)  # flag inválida falha antes do primeiro clipe
+    parse_formats(args.output_format)
+    run_id = options.pop("run_id")  # prefixo do run_id de cada clipe
+    jobs = args.batch_jobs if args.batch_jobs > 0 else (os.cpu_count() or 1)
+    return run_batch(clips, args.out, options, jobs, run_id=run_id, analyze=analyze_video, version=CLI_VERSION)
 
-        for c in cnts:
-            area = cv2.contourArea(c)
-            if area < args.min_area: 
-                continue
-            x,y,w,h = cv2.boundingRect(c)
-            wx,wy,ww,wh = int(x*work.shape[1]/frame.shape[1]), int(y*work.shape[0]/frame.shape[0]), int(w*work.shape[1]/frame.shape[1]), int(h*work.shape[0]/frame.shape[0])
-            crop_v = vari[wy:wy+wh, wx:wx+ww]; crop_n=ngrdi[wy:wy+wh, wx:wx+ww]; crop_f=ifv[wy:wy+wh, wx:wx+ww]
-            if crop_v.size < 25: 
-                continue
-            mV=float(crop_v.mean()); mN=float(crop_n.mean()); mF=float(crop_f.mean())
-            sev = max(0.0,(0.15-mV)*4)+max(0.0,(0.12-mN)*3)+max(0.0,(0.40-mF)*2)
-            if sev < args.min_severity:
-                continue
-
-            cc = (c.astype(np.float32) * [sx, sy]).astype(np.int32)
-            cv2.drawContours(overlay,[cc],-1,(0,0,255),2)
-
-            all_occs.append({
-                "frame": idx, "time_s": round(idx/float(fps),3),
-                "bbox": [int(x*sx), int(y*sy), int(w*sx), int(h*sy)],
-                "area_px": int(area*sx*sy),
-                "type": "baixo_sinal",
-                "confidence": 80 if sev < 1.3 else 92,
-                "recommendation": "Atenção moderada: monitorar; checar irrigação/manejo." if sev < 1.3 else "Prioridade alta: vistoriar imediatamente; verificar irrigação/solo/pragas.",
-                "evidence": {"vari": round(mV,3), "ngrdi": round(mN,3), "ifv": round(mF,3), "severity": round(float(sev),2)}
-            })
-
-        cv2.imwrite(str(out_dir/"thumbs"/f"frame{idx}.png"), frame)
-        cv2.imwrite(str(out_dir/"thumbs"/f"frame{idx}_overlay.png"), overlay)
-        idx += 1
-
-    cap.release()
-
-    (out_dir/"occurrences_v2.json").write_text(json.dumps(all_occs, ensure_ascii=False, indent=2), encoding="utf-8")
-    (out_dir/"report.html").write_text(read_report_template(), encoding="utf-8")
-    print(f"[OK] Ocorrências: {len(all_occs)}")
-    return 0
+def main(argv:Optional[list]=None):
+    ap = build_parser()
+    args = ap.parse_args(argv)
+    if bool(args.input) + bool(args.input_dir) + bool(args.manifest) != 1:
+        ap.error("use uma entrada: --input, --input-dir ou --manifest")
+    try:
+        if args.input:
+            summary = analyze_video(args.input, args.out, args)
+        else:
+            batch = analyze_batch(args)
+    except (IOError, ValueError) as e:
+        print(f"ERRO: {e}", file=sys.stderr); return 2
+    if args.input:
+        print(f"[OK] Ocorrências: {summary['occ']}")
+        return 0
+    for c in batch["clips"]:
+        if not c["ok"]:
+            print(f"ERRO: {c['name']}: {c['erro']}", file=sys.stderr)
+    print(f"[OK] Clipes: {batch['clips_ok']}/{len(batch['clips'])}, ocorrências: {batch['occ']}")
+    return 0 if batch["clips_ok"] == len(batch["clips"]) else 2
 
 if __name__ == "__main__":
     sys.exit(main())
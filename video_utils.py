@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# video_utils.py — v0.7d
+# Amostragem de frames para o CLI: evita pagar decodificação + conversão BGR
+# nos frames que são descartados por --every / --every-seconds.
+#
+# Estratégias:
+# - "grab": cap.grab() nos frames descartados (demux/decodifica, sem converter/copiar
+#   para BGR) e cap.read() só nos amostrados. Funciona com qualquer container.
+# - "seek": cap.set(CAP_PROP_POS_FRAMES, alvo) quando o salto é grande; o backend
+#   posiciona no keyframe anterior e decodifica só o trecho até o alvo. Compensa em
+#   codecs intra (MJPEG/ProRes/DNxHD...) ou quando o passo é maior que um GOP típico.
+# - "auto": escolhe pela contagem de frames, codec (FOURCC) e passo.
+#
+# `scale` multiplica o passo a partir do próximo frame (amostragem adaptativa,
+# change_utils.ChangeGate); com scale = 1 os frames amostrados são os de sempre.
+import cv2
+
+# Codecs intra-frame: todo frame é keyframe, o seek é sempre barato
+INTRA_FOURCCS = {
+    "MJPG", "mjpg", "mjpa", "mjpb", "jpeg", "AVRn", "png ", "MPNG",
+    "apcn", "apch", "apcs", "apco", "ap4h", "ap4x",
+    "AVdn", "AVdh", "dvh1", "dvhd", "dvsd", "FFV1", "HFYU", "rawv", "I420",
+}
+# Passo (frames) a partir do qual o seek compensa em codecs inter (GOP típico de 1–3 s a 30 fps)
+SEEK_MIN_STEP = 90
+STRATEGIES = ("auto", "grab", "seek")
+
+def fourcc_str(cap)->str:
+    v = int(cap.get(cv2.CAP_PROP_FOURCC) or 0)
+    return "".join(chr((v >> 8*i) & 0xFF) for i in range(4)) if v else ""
+
+def choose_strategy(cap, step:int)->str:
+    """Escolhe a estratégia mais barata para o container/codec e o passo pedido."""
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    if step <= 1 or total <= 0:
+        return "grab"  # sem contagem confiável (stream/container quebrado) o seek não é seguro
+    if fourcc_str(cap) in INTRA_FOURCCS:
+        return "seek"
+    return "seek" if step >= SEEK_MIN_STEP else "grab"
+
+class FrameSampler:
+    """Itera (idx, frame_bgr) sobre os frames amostrados de um cv2.VideoCapture aberto.
+
+    `every` é o passo em frames; `every_seconds` (se > 0) tem prioridade e amostra por tempo
+    (em "grab" usa CAP_PROP_POS_MSEC, robusto a fps variável). Contadores em `stats`.
+    `scale` pode ser alterado entre um frame e o seguinte (passo efetivo = passo x scale)."""
+    def __init__(self, cap, every:int=30, every_seconds:float=None, strategy:str="auto", fps:float=None):
+        self.cap = cap
+        self.fps = float(fps or cap.get(cv2.CAP_PROP_FPS) or 30.0)
+        self.every_seconds = float(every_seconds) if every_seconds and every_seconds > 0 else None
+        if self.every_seconds:
+            self.step = max(1, int(round(self.every_seconds * self.fps)))
+        else:
+            self.step = max(1, int(every))
+        if strategy not in STRATEGIES:
+            raise ValueError(f"estratégia de amostragem inválida: {strategy}")
+        self.codec = fourcc_str(cap)
+        self.intra = self.codec in INTRA_FOURCCS
+        self.strategy = choose_strategy(cap, self.step) if strategy == "auto" else strategy
+        self.scale = 1.0
+        self.stats = {"estrategia": self.strategy, "codec": self.codec, "passo": self.step,
+                      "frames_grab": 0, "frames_bgr": 0, "seeks": 0}
+
+    def current_step(self)->int:
+        """Passo efetivo em frames (com `scale`)."""
+        base = self.every_seconds * self.fps if self.every_seconds else self.step
+        return max(1, int(round(base * self.scale)))
+
+    def expected(self)->int:
+        """Número estimado de frames amostrados no passo base (0 se o container não informa a contagem)."""
+        total = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        if total <= 0:
+            return 0
+        if self.every_seconds:
+            return int((total / self.fps) // self.every_seconds) + 1
+        return (total + self.step - 1) // self.step
+
+    def __iter__(self):
+        if self.strategy == "seek":
+            return self._iter_seek()
+        return self._iter_grab()
+
+    def _read(self):
+        ok, frame = self.cap.read()
+        if ok:
+            self.stats["frames_bgr"] += 1
+        return ok, frame
+
+    def _iter_grab(self):
+        idx = 0
+        next_idx = 0; next_t = 0.0
+        while True:
+            if self.every_seconds:
+                if not self.cap.grab():
+                    break
+                t = (self.cap.get(cv2.CAP_PROP_POS_MSEC) or idx*1000.0/self.fps) / 1000.0
+                if t + 0.5/self.fps >= next_t:
+                    ok, frame = self.cap.retrieve()
+                    if not ok:
+                        break
+                    self.stats["frames_bgr"] += 1
+                    yield idx, frame
+                    while next_t <= t + 0.5/self.fps:
+                        next_t += self.every_seconds * self.scale
+                else:
+                    self.stats["frames_grab"] += 1
+            elif idx >= next_idx:
+                ok, frame = self._read()
+                if not ok:
+                    break
+                yield idx, frame
+                next_idx = idx + self.current_step()
+            else:
+                if not self.cap.grab():
+                    break
+                self.stats["frames_grab"] += 1
+            idx += 1
+
+    def _iter_seek(self):
+        # Saltos curtos decodificam adiante com grab(); só salta (seek) quando o trecho
+        # pulado é maior que um GOP típico — ou sempre, em codecs intra.
+        min_gap = 1 if self.intra else SEEK_MIN_STEP
+        total = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        pos = 0
+        target = 0
+        base = 0; k = 0; inc = None  # alvo k = base + k x passo (recomeça quando scale muda)
+        while True:
+            if total and target >= total:
+                break
+            if target - pos > min_gap:
+                if not self.cap.set(cv2.CAP_PROP_POS_FRAMES, target):
+                    # backend não suporta seek: segue decodificando sequencialmente
+                    self.strategy = self.stats["estrategia"] = "grab"
+                    min_gap = float("inf")
+                else:
+                    self.stats["seeks"] += 1
+                    pos = target
+            while pos < target:
+                if not self.cap.grab():
+                    return
+                self.stats["frames_grab"] += 1
+                pos += 1
+            ok, frame = self._read()
+            if not ok:
+                return
+            pos += 1
+            yield target, frame
+            cur = (self.every_seconds * self.fps if self.every_seconds else self.step) * self.scale
+            if cur != inc:
+                base, k, inc = target, 0, cur
+            k += 1
+            target = max(target + 1, base + int(round(k * inc)))